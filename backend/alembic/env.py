@@ -7,8 +7,8 @@ from logging.config import fileConfig
 from alembic import context
 from sqlalchemy import engine_from_config, pool
 
-# Permite importar database/models desde backend/
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+# Raíz del repo en el path: models importa `backend.database`.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from dotenv import load_dotenv
 
@@ -20,7 +20,7 @@ if config.config_file_name is not None:
     fileConfig(config.config_file_name)
 
 # Importa metadata
-import models  # noqa: E402
+from backend import models  # noqa: E402
 
 
 target_metadata = models.Base.metadata
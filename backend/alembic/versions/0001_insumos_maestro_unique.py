@@ -0,0 +1,60 @@
+"""insumos_maestro: índice único (tipo, descripcion, unidad_compra)
+
+Respalda el upsert por lotes (`INSERT ... ON CONFLICT`) de
+`apu_service.crear_renglon_y_composicion_desde_apu_json`. Antes de crear el
+índice se fusionan duplicados existentes, reapuntando sus referencias al
+registro con el sondeo IA más reciente.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TEMP TABLE _insumos_duplicados AS
+        SELECT id,
+               first_value(id) OVER (
+                   PARTITION BY tipo, descripcion, unidad_compra
+                   ORDER BY ultimo_sondeo_ia DESC NULLS LAST, id
+               ) AS conservar_id
+        FROM insumos_maestro
+        """
+    )
+    op.execute("DELETE FROM _insumos_duplicados WHERE id = conservar_id")
+    for tabla in ("apu_composicion", "detalle_orden_compra", "movimientos_bodega"):
+        op.execute(
+            f"""
+            UPDATE {tabla} t
+            SET insumo_id = d.conservar_id
+            FROM _insumos_duplicados d
+            WHERE t.insumo_id = d.id
+            """
+        )
+    op.execute("DELETE FROM insumos_maestro i USING _insumos_duplicados d WHERE i.id = d.id")
+    op.execute("DROP TABLE _insumos_duplicados")
+
+    op.create_index(
+        "uq_insumos_maestro_tipo_descripcion_unidad",
+        "insumos_maestro",
+        ["tipo", "descripcion", "unidad_compra"],
+        unique=True,
+        if_not_exists=True,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("uq_insumos_maestro_tipo_descripcion_unidad", table_name="insumos_maestro")
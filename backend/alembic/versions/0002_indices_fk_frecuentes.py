@@ -0,0 +1,56 @@
+"""Índices para los filtros por FK más frecuentes
+
+Auditor (desviación de presupuesto / teórico disponible), planilla
+(asistencia y avances por trabajador y fecha), inventario (movimientos por
+proyecto e insumo) y compras (OC por proyecto y estado, detalle por OC).
+
+Se crean con CONCURRENTLY para no bloquear escrituras en tablas grandes, e
+IF NOT EXISTS por si ya se aplicó `supabase_schema.sql`.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+from alembic import op
+
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+INDICES: list[tuple[str, str, list[str]]] = [
+    ("ix_presupuesto_renglones_proyecto_id", "presupuesto_renglones", ["proyecto_id"]),
+    ("ix_apu_composicion_renglon_id", "apu_composicion", ["renglon_id"]),
+    ("ix_apu_composicion_insumo_id", "apu_composicion", ["insumo_id"]),
+    ("ix_detalle_orden_compra_oc_id", "detalle_orden_compra", ["oc_id"]),
+    ("ix_detalle_orden_compra_insumo_id", "detalle_orden_compra", ["insumo_id"]),
+    ("ix_ordenes_compra_proyecto_estado", "ordenes_compra", ["proyecto_id", "estado"]),
+    ("ix_movimientos_bodega_proyecto_insumo", "movimientos_bodega", ["proyecto_id", "insumo_id"]),
+    ("ix_asistencia_trabajador_fecha", "asistencia", ["trabajador_id", "fecha"]),
+    ("ix_reportes_avance_usuario_fecha", "reportes_avance", ["usuario_id", "fecha_reporte"]),
+]
+
+
+def upgrade() -> None:
+    # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción.
+    with op.get_context().autocommit_block():
+        for nombre, tabla, columnas in INDICES:
+            op.create_index(
+                nombre,
+                tabla,
+                columnas,
+                if_not_exists=True,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for nombre, tabla, _columnas in reversed(INDICES):
+            op.drop_index(nombre, table_name=tabla, if_exists=True, postgresql_concurrently=True)
@@ -0,0 +1,55 @@
+"""stock_actual: saldo materializado de bodega por (proyecto, insumo)
+
+Crea la tabla (si `create_all` no la creó ya) y la llena desde
+`movimientos_bodega`, de modo que `/inventario/resumen?snapshot=true` sea
+correcto desde el primer momento.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # `create_all` (arranque de la API, scripts/migrar.py) puede haber creado
+    # la tabla antes de esta revisión, vacía o con solo lo escrito desde
+    # entonces: en ese caso se reconstruye completa desde las tablas fuente.
+    if sa.inspect(op.get_bind()).has_table("stock_actual"):
+        op.execute("DELETE FROM stock_actual")
+    else:
+        op.create_table(
+            "stock_actual",
+            sa.Column("proyecto_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("proyectos.id"), primary_key=True),
+            sa.Column("insumo_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("insumos_maestro.id"), primary_key=True),
+            sa.Column("cantidad", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("actualizado_en", sa.DateTime(), nullable=True),
+        )
+    op.execute(
+        """
+        INSERT INTO stock_actual (proyecto_id, insumo_id, cantidad, actualizado_en)
+        SELECT proyecto_id,
+               insumo_id,
+               SUM(CASE WHEN tipo_movimiento = 'ENTRADA' THEN cantidad ELSE -cantidad END),
+               now()
+        FROM movimientos_bodega
+        WHERE proyecto_id IS NOT NULL AND insumo_id IS NOT NULL
+        GROUP BY proyecto_id, insumo_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("stock_actual")
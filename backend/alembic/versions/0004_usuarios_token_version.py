@@ -0,0 +1,32 @@
+"""usuarios.token_version: revocación de tokens al cambiar rol/estado
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # `create_all` ya crea la columna en una base nueva.
+    columnas = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("usuarios")}
+    if "token_version" not in columnas:
+        op.add_column(
+            "usuarios",
+            sa.Column("token_version", sa.Integer(), nullable=False, server_default="0"),
+        )
+
+
+def downgrade() -> None:
+    op.drop_column("usuarios", "token_version")
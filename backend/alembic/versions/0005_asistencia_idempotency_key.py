@@ -0,0 +1,55 @@
+"""asistencia.idempotency_key: sincronización offline sin duplicados
+
+`POST /campo/asistencia/batch` inserta con ON CONFLICT DO NOTHING sobre
+(trabajador_id, idempotency_key): la clave la elige el dispositivo, así que
+solo es única por trabajador. El índice único se crea con CONCURRENTLY (tabla
+grande, escrituras continuas desde campo); los NULL de registros previos no
+chocan entre sí.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+_INDICE = "uq_asistencia_trabajador_idempotency_key"
+
+
+def upgrade() -> None:
+    # `create_all` ya crea la columna en una base nueva.
+    columnas = {c["name"] for c in sa.inspect(op.get_bind()).get_columns("asistencia")}
+    if "idempotency_key" not in columnas:
+        op.add_column("asistencia", sa.Column("idempotency_key", sa.String(length=100), nullable=True))
+    # CREATE INDEX CONCURRENTLY no puede correr dentro de una transacción.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            _INDICE,
+            "asistencia",
+            ["trabajador_id", "idempotency_key"],
+            unique=True,
+            if_not_exists=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            _INDICE,
+            table_name="asistencia",
+            if_exists=True,
+            postgresql_concurrently=True,
+        )
+    op.drop_column("asistencia", "idempotency_key")
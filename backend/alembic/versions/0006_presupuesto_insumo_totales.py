@@ -0,0 +1,63 @@
+"""presupuesto_insumo_totales: disponibilidad por (proyecto, insumo) para OCs
+
+Crea la tabla (si `create_all` no la creó ya) y la llena desde renglones ×
+APU (presupuestado) y detalles de OC (comprado), así la validación de órdenes
+de compra es correcta desde el primer momento.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # `create_all` (arranque de la API, scripts/migrar.py) puede haber creado
+    # la tabla antes de esta revisión, vacía o con solo lo escrito desde
+    # entonces: en ese caso se reconstruye completa desde las tablas fuente.
+    if sa.inspect(op.get_bind()).has_table("presupuesto_insumo_totales"):
+        op.execute("DELETE FROM presupuesto_insumo_totales")
+    else:
+        op.create_table(
+            "presupuesto_insumo_totales",
+            sa.Column("proyecto_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("proyectos.id"), primary_key=True),
+            sa.Column("insumo_id", postgresql.UUID(as_uuid=True), sa.ForeignKey("insumos_maestro.id"), primary_key=True),
+            sa.Column("cantidad_presupuestada", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("cantidad_comprada", sa.Float(), nullable=False, server_default="0"),
+            sa.Column("actualizado_en", sa.DateTime(), nullable=True),
+        )
+    op.execute(
+        """
+        INSERT INTO presupuesto_insumo_totales
+            (proyecto_id, insumo_id, cantidad_presupuestada, cantidad_comprada, actualizado_en)
+        SELECT proyecto_id, insumo_id, SUM(presupuestado), SUM(comprado), now()
+        FROM (
+            SELECT r.proyecto_id, c.insumo_id, r.cantidad_total * c.rendimiento AS presupuestado, 0.0 AS comprado
+            FROM presupuesto_renglones r
+            JOIN apu_composicion c ON c.renglon_id = r.id
+            WHERE r.proyecto_id IS NOT NULL AND c.insumo_id IS NOT NULL
+            UNION ALL
+            SELECT o.proyecto_id, d.insumo_id, 0.0, d.cantidad_pedida
+            FROM detalle_orden_compra d
+            JOIN ordenes_compra o ON o.id = d.oc_id
+            WHERE o.proyecto_id IS NOT NULL AND d.insumo_id IS NOT NULL
+        ) partes
+        GROUP BY proyecto_id, insumo_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("presupuesto_insumo_totales")
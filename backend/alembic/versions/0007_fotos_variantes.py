@@ -0,0 +1,41 @@
+"""fotos_bitacora / fotos_evidencia: miniatura, WebP y sha256 del original
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+
+"""
+
+from __future__ import annotations
+
+import sqlalchemy as sa
+from alembic import op
+
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+_TABLAS = ("fotos_bitacora", "fotos_evidencia")
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    for tabla in _TABLAS:
+        # `create_all` ya crea las columnas en una base nueva.
+        existentes = {c["name"] for c in inspector.get_columns(tabla)}
+        for columna in (
+            sa.Column("url_thumbnail", sa.String(length=255), nullable=True),
+            sa.Column("url_webp", sa.String(length=255), nullable=True),
+            sa.Column("sha256", sa.String(length=64), nullable=True),
+        ):
+            if columna.name not in existentes:
+                op.add_column(tabla, columna)
+
+
+def downgrade() -> None:
+    for tabla in _TABLAS:
+        op.drop_column(tabla, "sha256")
+        op.drop_column(tabla, "url_webp")
+        op.drop_column(tabla, "url_thumbnail")
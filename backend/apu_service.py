@@ -1,12 +1,20 @@
 from __future__ import annotations
 
 import datetime
+import os
+import threading
 import uuid
-from typing import Any
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable
 
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
 
 from backend import models
+from backend.ia_apu import generar_apu_preciso_con_cantidades, generar_composicion_apu_ia
+from backend.ia_cache import parse_sondeo_ia
+from backend.presupuesto_service import sumar_presupuestado
+from backend.utils.normas import calcular_insumos_por_renglon_detallado
 
 
 def crear_renglon_y_composicion_desde_apu_json(
@@ -25,7 +33,11 @@ def crear_renglon_y_composicion_desde_apu_json(
     if not isinstance(insumos, list):
         raise ValueError("APU inválido: 'insumos' debe ser lista")
 
+    # Si el APU vino del cache, conservar la fecha real del sondeo IA.
+    sondeo_ia = parse_sondeo_ia(apu.get("sondeo_ia")) or datetime.datetime.utcnow()
+
     composiciones_data: list[dict[str, Any]] = []
+    insumos_por_clave: dict[tuple[str, str, str], dict[str, Any]] = {}
 
     for item in insumos:
         if not isinstance(item, dict):
@@ -44,43 +56,36 @@ def crear_renglon_y_composicion_desde_apu_json(
         if not isinstance(precio_guate, (int, float)) or precio_guate < 0:
             raise ValueError("APU inválido: precio_guate debe ser número >= 0")
 
-        existente = (
-            db.query(models.InsumoMaestro)
-            .filter(models.InsumoMaestro.tipo == tipo)
-            .filter(models.InsumoMaestro.descripcion == nombre)
-            .filter(models.InsumoMaestro.unidad_compra == unidad_compra)
-            .first()
-        )
-
-        if existente is None:
-            existente = models.InsumoMaestro(
-                tipo=tipo,
-                descripcion=nombre,
-                unidad_compra=unidad_compra,
-                precio_referencial_gtq=float(precio_guate),
-                ultimo_sondeo_ia=datetime.datetime.utcnow(),
-            )
-            db.add(existente)
-            db.flush()
-        else:
-            setattr(existente, "precio_referencial_gtq", float(precio_guate))
-            setattr(existente, "ultimo_sondeo_ia", datetime.datetime.utcnow())
-
+        clave = (tipo, nombre, unidad_compra)
+        # Si el APU repite un insumo, prevalece el último precio (igual que antes).
+        insumos_por_clave[clave] = {
+            "id": uuid.uuid4(),
+            "tipo": tipo,
+            "descripcion": nombre,
+            "unidad_compra": unidad_compra,
+            "precio_referencial_gtq": float(precio_guate),
+            "ultimo_sondeo_ia": sondeo_ia,
+        }
         composiciones_data.append(
             {
-                "insumo_id": existente.id,
+                "clave": clave,
                 "rendimiento": float(rendimiento),
                 "desperdicio": float(desperdicio_default),
                 "precio_aplicado": float(precio_guate),
             }
         )
 
+    insumo_ids = _upsert_insumos(db, list(insumos_por_clave.values()))
+
     costo_unitario_ia = sum(
         float(c["rendimiento"]) * float(c["precio_aplicado"]) * float(c["desperdicio"])
         for c in composiciones_data
     )
 
+    # IDs generados en Python: el renglón y sus composiciones salen en un solo
+    # flush (INSERT del renglón + un INSERT multi-fila de composiciones).
     renglon = models.PresupuestoRenglon(
+        id=uuid.uuid4(),
         proyecto_id=proyecto_id,
         descripcion=nombre_renglon,
         unidad_medida=unidad,
@@ -88,18 +93,227 @@ def crear_renglon_y_composicion_desde_apu_json(
         costo_unitario_ia=float(costo_unitario_ia),
     )
     db.add(renglon)
-    db.flush()
 
-    composiciones: list[models.APUComposicion] = []
-    for item in composiciones_data:
-        c = models.APUComposicion(
+    composiciones: list[models.APUComposicion] = [
+        models.APUComposicion(
+            id=uuid.uuid4(),
             renglon_id=renglon.id,
-            insumo_id=item["insumo_id"],
+            insumo_id=insumo_ids[item["clave"]],
             rendimiento=item["rendimiento"],
             desperdicio=item["desperdicio"],
             precio_aplicado=item["precio_aplicado"],
         )
-        db.add(c)
-        composiciones.append(c)
+        for item in composiciones_data
+    ]
+    db.add_all(composiciones)
+    db.flush()
+
+    presupuestado: dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+    for c in composiciones:
+        clave = (proyecto_id, c.insumo_id)
+        presupuestado[clave] = presupuestado.get(clave, 0.0) + float(cantidad_total) * float(c.rendimiento)
+    sumar_presupuestado(db, presupuestado)
 
     return renglon, composiciones
+
+
+def _upsert_insumos(
+    db: Session, filas: list[dict[str, Any]]
+) -> dict[tuple[str, str, str], uuid.UUID]:
+    """Crea/actualiza insumos en un solo `INSERT ... ON CONFLICT ... RETURNING`.
+
+    Usa el índice único `uq_insumos_maestro_tipo_descripcion_unidad`. Para los
+    existentes actualiza precio y fecha de sondeo, como hacía el flujo anterior.
+    """
+
+    if not filas:
+        return {}
+
+    stmt = pg_insert(models.InsumoMaestro).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            models.InsumoMaestro.tipo,
+            models.InsumoMaestro.descripcion,
+            models.InsumoMaestro.unidad_compra,
+        ],
+        set_={
+            "precio_referencial_gtq": stmt.excluded.precio_referencial_gtq,
+            "ultimo_sondeo_ia": stmt.excluded.ultimo_sondeo_ia,
+        },
+    ).returning(
+        models.InsumoMaestro.id,
+        models.InsumoMaestro.tipo,
+        models.InsumoMaestro.descripcion,
+        models.InsumoMaestro.unidad_compra,
+    )
+
+    return {
+        (r.tipo, r.descripcion, r.unidad_compra): r.id
+        for r in db.execute(stmt)
+    }
+
+
+def _max_concurrencia_ia() -> int:
+    raw = os.getenv("IA_MAX_CONCURRENCIA", "6").strip().strip('"').strip("'")
+    try:
+        value = int(raw)
+    except ValueError as exc:
+        raise RuntimeError("IA_MAX_CONCURRENCIA debe ser un entero") from exc
+    return max(1, value)
+
+
+def _generar_apu_item_matriz(
+    *,
+    nombre_renglon: str,
+    renglon_base: str,
+    unidad_hint: str,
+    departamento: str,
+    cantidad_base: float,
+    usar_cache: bool,
+) -> tuple[dict[str, Any], str]:
+    """Genera el APU de un renglón de la matriz (sin tocar la BD).
+
+    - Si la calculadora técnica tiene regla -> APU preciso (cantidades + IA precios/MO)
+    - Si no hay regla aún -> fallback a APU IA estándar
+    """
+
+    unidad_calc, detalles = calcular_insumos_por_renglon_detallado(
+        nombre_renglon=renglon_base,
+        cantidad_total=float(cantidad_base),
+    )
+
+    # Unidad final: prioridad a calculadora, luego matriz.
+    unidad_final = (unidad_calc or "").strip() or (unidad_hint or "").strip() or "u"
+
+    if detalles:
+        apu = generar_apu_preciso_con_cantidades(
+            nombre_renglon=nombre_renglon,
+            departamento=departamento,
+            unidad_renglon=unidad_final,
+            insumos_materiales=detalles,
+            usar_cache=usar_cache,
+        )
+        return apu, "preciso"
+
+    apu = generar_composicion_apu_ia(
+        nombre_renglon=nombre_renglon,
+        departamento=departamento,
+        usar_cache=usar_cache,
+    )
+    # Forzar unidad del renglón si vino por matriz.
+    if isinstance(apu, dict) and unidad_final:
+        apu["unidad"] = unidad_final
+    return apu, "ia"
+
+
+def inyectar_matriz_y_generar_apus(
+    db: Session,
+    *,
+    proyecto_id: uuid.UUID,
+    items: list[dict[str, Any]],
+    departamento: str,
+    cantidad_base: float = 1.0,
+    usar_cache: bool = True,
+    max_concurrencia: int | None = None,
+    al_progresar: Callable[[int, int, dict[str, Any] | None], None] | None = None,
+) -> dict[str, Any]:
+    """Genera los APUs de la matriz en paralelo y los persiste en una sola transacción.
+
+    Las llamadas al LLM (I/O) se reparten en un pool de hilos acotado por
+    `IA_MAX_CONCURRENCIA`; la escritura en BD ocurre al final, en orden de la
+    matriz, con un SAVEPOINT por renglón para conservar el reporte ok/fallos.
+
+    `al_progresar(completados, total, parcial)` se invoca cada vez que termina
+    una llamada al LLM (lo usa `jobs_service` para el polling de progreso).
+    """
+
+    tareas: list[tuple[str, dict[str, str]]] = []
+    for it in items:
+        fase = str(it.get("fase") or "").strip()
+        renglon_base = str(it.get("renglon") or "").strip()
+        unidad_hint = str(it.get("unidad") or "").strip()
+
+        if not renglon_base:
+            continue
+
+        nombre_renglon = f"{fase} - {renglon_base}" if fase else renglon_base
+        tareas.append(
+            (
+                nombre_renglon,
+                {"renglon_base": renglon_base, "unidad_hint": unidad_hint},
+            )
+        )
+
+    total = len(tareas)
+    completados = 0
+    lock = threading.Lock()
+
+    def _notificar(nombre_renglon: str, futuro: Future) -> None:
+        nonlocal completados
+        if al_progresar is None:
+            return
+        with lock:
+            completados += 1
+            actual = completados
+        error = futuro.exception()
+        al_progresar(
+            actual,
+            total,
+            {"renglon": nombre_renglon, "generado": error is None, "error": str(error) if error else None},
+        )
+
+    workers = max_concurrencia or _max_concurrencia_ia()
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, total or 1))) as pool:
+        futuros: list[tuple[str, Future]] = []
+        for nombre_renglon, datos in tareas:
+            futuro = pool.submit(
+                _generar_apu_item_matriz,
+                nombre_renglon=nombre_renglon,
+                renglon_base=datos["renglon_base"],
+                unidad_hint=datos["unidad_hint"],
+                departamento=departamento,
+                cantidad_base=cantidad_base,
+                usar_cache=usar_cache,
+            )
+            futuro.add_done_callback(lambda f, n=nombre_renglon: _notificar(n, f))
+            futuros.append((nombre_renglon, futuro))
+
+        ok: list[dict[str, str]] = []
+        fallos: list[dict[str, str]] = []
+
+        for nombre_renglon, futuro in futuros:
+            try:
+                apu, fuente = futuro.result()
+                with db.begin_nested():
+                    renglon_db, _ = crear_renglon_y_composicion_desde_apu_json(
+                        db,
+                        proyecto_id=proyecto_id,
+                        nombre_renglon=nombre_renglon,
+                        cantidad_total=float(cantidad_base),
+                        apu=apu,
+                    )
+                ok.append(
+                    {
+                        "renglon_id": str(renglon_db.id),
+                        "renglon": nombre_renglon,
+                        "fuente": fuente,
+                    }
+                )
+            except Exception as exc:
+                fallos.append(
+                    {
+                        "renglon": nombre_renglon,
+                        "error": str(exc),
+                    }
+                )
+
+    db.commit()
+
+    return {
+        "status": "ok" if not fallos else "partial",
+        "proyecto_id": str(proyecto_id),
+        "generados": len(ok),
+        "fallidos": len(fallos),
+        "detalle_ok": ok,
+        "detalle_fallos": fallos,
+    }
@@ -0,0 +1,102 @@
+"""Registro de asistencia GPS en lote (sincronización de dispositivos offline).
+
+Un lote valida todos los `trabajador_id` con una consulta y los inserta con un
+solo `INSERT ... ON CONFLICT (trabajador_id, idempotency_key) DO NOTHING
+RETURNING`: si el teléfono reintenta un lote ya recibido, los registros con la
+misma clave se reportan como "duplicado" con el id original en vez de crearse
+otra vez. La clave la elige el dispositivo, así que solo es única por
+trabajador. Los registros sin clave se insertan sin ON CONFLICT.
+"""
+
+from __future__ import annotations
+
+import uuid
+from typing import Any
+
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.schemas import AsistenciaGPSRequest
+
+
+def registrar_asistencias(db: Session, registros: list[AsistenciaGPSRequest]) -> list[dict[str, Any]]:
+    """Inserta los registros válidos (sin commit) y retorna un resultado por registro.
+
+    estado: "creado" | "duplicado" (clave ya registrada) | "error" (trabajador no existe).
+    """
+
+    ids = {r.trabajador_id for r in registros}
+    existentes = set(db.scalars(select(models.Trabajador.id).where(models.Trabajador.id.in_(ids))))
+
+    resultados: list[dict[str, Any]] = []
+    filas: list[dict[str, Any]] = []
+    sin_clave: list[dict[str, Any]] = []
+    primera_por_clave: dict[tuple[uuid.UUID, str], dict[str, Any]] = {}
+    for indice, r in enumerate(registros):
+        resultado: dict[str, Any] = {"indice": indice, "idempotency_key": r.idempotency_key}
+        resultados.append(resultado)
+        if r.trabajador_id not in existentes:
+            resultado.update(estado="error", detalle="Trabajador no encontrado")
+            continue
+        clave = (r.trabajador_id, r.idempotency_key)
+        if r.idempotency_key is not None and clave in primera_por_clave:
+            # Misma clave del mismo trabajador repetida dentro del lote: es el mismo registro.
+            resultado.update(estado="duplicado", _clave=clave)
+            continue
+
+        asistencia_id = uuid.uuid4()
+        resultado.update(estado="creado", asistencia_id=str(asistencia_id))
+        fila = {
+            "id": asistencia_id,
+            "trabajador_id": r.trabajador_id,
+            "fecha": r.fecha,
+            "entrada": r.fecha,
+            "gps_check": True,
+            "latitud_gps": float(r.latitud),
+            "longitud_gps": float(r.longitud),
+        }
+        if r.idempotency_key is None:
+            sin_clave.append(fila)
+        else:
+            primera_por_clave[clave] = resultado
+            filas.append({**fila, "idempotency_key": r.idempotency_key})
+
+    if sin_clave:
+        db.execute(insert(models.RegistroAsistencia).values(sin_clave))
+
+    if filas:
+        stmt = (
+            pg_insert(models.RegistroAsistencia)
+            .values(filas)
+            .on_conflict_do_nothing(
+                index_elements=[models.RegistroAsistencia.trabajador_id, models.RegistroAsistencia.idempotency_key]
+            )
+            .returning(models.RegistroAsistencia.id)
+        )
+        insertados = {str(i) for i in db.scalars(stmt)}
+
+        # Las claves que ya existían no se insertaron: se reporta el id original.
+        omitidas = {k: v for k, v in primera_por_clave.items() if v["asistencia_id"] not in insertados}
+        if omitidas:
+            previos = db.execute(
+                select(
+                    models.RegistroAsistencia.trabajador_id,
+                    models.RegistroAsistencia.idempotency_key,
+                    models.RegistroAsistencia.id,
+                ).where(
+                    tuple_(models.RegistroAsistencia.trabajador_id, models.RegistroAsistencia.idempotency_key).in_(
+                        list(omitidas)
+                    )
+                )
+            ).all()
+            for trabajador_id, clave, asistencia_id in previos:
+                omitidas[(trabajador_id, clave)].update(estado="duplicado", asistencia_id=str(asistencia_id))
+
+    # Los duplicados dentro del lote apuntan al id final de su primera aparición.
+    for resultado in resultados:
+        clave = resultado.pop("_clave", None)
+        if clave is not None:
+            resultado["asistencia_id"] = primera_por_clave[clave]["asistencia_id"]
+    return resultados
@@ -1,6 +1,14 @@
 from __future__ import annotations
 
+import logging
 import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
 from typing import Any
 
@@ -10,12 +18,17 @@ from jose import JWTError
 from jose import jwt
 from passlib.hash import pbkdf2_sha256
 from passlib.hash import bcrypt as passlib_bcrypt
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from backend.database import get_db
+from backend.database import get_async_db, get_db
 from backend import models
+from backend.utils.procesos import contexto_pool
 
 
+_logger = logging.getLogger("uvicorn.error")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
 
@@ -33,6 +46,21 @@ def _get_algorithm() -> str:
     return value.strip().strip('"').strip("'")
 
 
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} must be an integer") from exc
+
+
+def _token_claims_enabled() -> bool:
+    raw = os.getenv("AUTH_TOKEN_CLAIMS", "false").strip().strip('"').strip("'").lower()
+    return raw in ("1", "true", "yes", "on")
+
+
 def _get_expire_minutes() -> int:
     raw = os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "480")
     raw = raw.strip().strip('"').strip("'")
@@ -43,11 +71,81 @@ def _get_expire_minutes() -> int:
     return value
 
 
-def hash_password(password: str) -> str:
-    return pbkdf2_sha256.hash(password)
+# --- Hash de contraseñas ------------------------------------------------------
+# PBKDF2/bcrypt son CPU puro: se calculan en un pool de procesos (no compiten
+# por el GIL con el servidor) y con un tope de peticiones en espera, para que
+# una ráfaga de logins no agote el threadpool de FastAPI.
 
+_pool_hash: ProcessPoolExecutor | None = None
+_cupos_hash: threading.BoundedSemaphore | None = None
+_pool_hash_lock = threading.Lock()
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+
+def _get_pbkdf2_rounds() -> int:
+    value = _env_int("AUTH_PBKDF2_ROUNDS", pbkdf2_sha256.default_rounds)
+    if value < 1000:
+        raise RuntimeError("AUTH_PBKDF2_ROUNDS must be >= 1000")
+    return value
+
+
+def _get_pool_hash() -> tuple[ProcessPoolExecutor | None, threading.BoundedSemaphore]:
+    """AUTH_HASH_PROCESOS=0 calcula en el hilo que llama (tests, 1 núcleo)."""
+
+    global _pool_hash, _cupos_hash
+    with _pool_hash_lock:
+        if _cupos_hash is None:
+            procesos = _env_int("AUTH_HASH_PROCESOS", os.cpu_count() or 2)
+            if procesos > 0:
+                _pool_hash = ProcessPoolExecutor(max_workers=procesos, mp_context=contexto_pool())
+            _cupos_hash = threading.BoundedSemaphore(max(1, _env_int("AUTH_HASH_COLA", 64)))
+        return _pool_hash, _cupos_hash
+
+
+def cerrar_pool_hash(roto: ProcessPoolExecutor | None = None) -> None:
+    """Cierra el pool; el siguiente uso crea otro. Con `roto`, solo si sigue
+    siendo el vigente (otro hilo pudo haberlo rehecho ya)."""
+
+    global _pool_hash, _cupos_hash
+    with _pool_hash_lock:
+        if roto is not None and _pool_hash is not roto:
+            return
+        if _pool_hash is not None:
+            _pool_hash.shutdown(wait=False, cancel_futures=True)
+        _pool_hash = None
+        _cupos_hash = None
+
+
+def _calcular(fn, *args):
+    pool, cupos = _get_pool_hash()
+    if not cupos.acquire(timeout=_env_int("AUTH_HASH_ESPERA_S", 10)):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Servidor ocupado, intenta de nuevo",
+            headers={"Retry-After": "2"},
+        )
+    try:
+        if pool is None:
+            return fn(*args)
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # Un worker murió (OOM, señal) y el pool ya no acepta trabajos:
+            # se rehace y se reintenta una vez, en vez de fallar hasta reiniciar.
+            _logger.warning("Pool de hash roto; se crea uno nuevo")
+            cerrar_pool_hash(roto=pool)
+            pool, _cupos = _get_pool_hash()
+            if pool is None:
+                return fn(*args)
+            return pool.submit(fn, *args).result()
+    finally:
+        cupos.release()
+
+
+def _hash_pbkdf2(password: str, rounds: int) -> str:
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+
+def _verificar_hash(plain_password: str, hashed_password: str) -> bool:
     # Accept both new PBKDF2 hashes and legacy bcrypt hashes.
     try:
         if hashed_password.startswith("$pbkdf2-sha256$"):
@@ -59,6 +157,25 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
+def hash_password(password: str) -> str:
+    return _calcular(_hash_pbkdf2, password, _get_pbkdf2_rounds())
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return bool(_calcular(_verificar_hash, plain_password, hashed_password))
+
+
+def necesita_rehash(hashed_password: str) -> bool:
+    """True si el hash es bcrypt legado o PBKDF2 con otras rondas que las configuradas."""
+
+    if not hashed_password.startswith("$pbkdf2-sha256$"):
+        return True
+    try:
+        return pbkdf2_sha256.using(rounds=_get_pbkdf2_rounds()).needs_update(hashed_password)
+    except ValueError:
+        return True
+
+
 def create_access_token(data: dict[str, Any]) -> str:
     to_encode = dict(data)
     expire = datetime.utcnow() + timedelta(minutes=_get_expire_minutes())
@@ -70,43 +187,216 @@ def decode_access_token(token: str) -> dict[str, Any]:
     return jwt.decode(token, _get_secret_key(), algorithms=[_get_algorithm()])
 
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db),
-) -> models.Usuario:
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="No se pudo validar el acceso",
-    )
+_credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="No se pudo validar el acceso",
+)
+
+
+@dataclass(frozen=True)
+class UsuarioActual:
+    """Lo que los endpoints necesitan del usuario autenticado (sin sesión ORM)."""
 
+    id: uuid.UUID
+    username: str
+    rol: str | None
+    is_active: bool = True
+    is_approved: bool = True
+    token_version: int = 0
+
+    @classmethod
+    def desde_modelo(cls, user: models.Usuario) -> UsuarioActual:
+        return cls(
+            id=user.id,
+            username=user.username,
+            rol=user.rol,
+            is_active=bool(user.is_active) if user.is_active is not None else True,
+            is_approved=bool(user.is_approved),
+            token_version=int(user.token_version or 0),
+        )
+
+
+class _CacheUsuarios:
+    """LRU con TTL por username (por proceso): `UsuarioActual` o su `token_version`.
+
+    Los endpoints de admin invalidan la entrada al cambiar rol/estado; en las
+    demás réplicas el cambio se ve al vencer el TTL (`AUTH_CACHE_TTL_S`).
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._datos: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def obtener(self, username: str) -> Any | None:
+        ttl = _env_int("AUTH_CACHE_TTL_S", 30)
+        if ttl <= 0:
+            return None
+        with self._lock:
+            entrada = self._datos.get(username)
+            if entrada is None:
+                return None
+            guardado_en, usuario = entrada
+            if time.monotonic() - guardado_en > ttl:
+                del self._datos[username]
+                return None
+            self._datos.move_to_end(username)
+            return usuario
+
+    def guardar(self, username: str, valor: Any) -> None:
+        if _env_int("AUTH_CACHE_TTL_S", 30) <= 0:
+            return
+        maximo = max(1, _env_int("AUTH_CACHE_MAX", 2048))
+        with self._lock:
+            self._datos[username] = (time.monotonic(), valor)
+            self._datos.move_to_end(username)
+            while len(self._datos) > maximo:
+                self._datos.popitem(last=False)
+
+    def invalidar(self, username: str | None = None) -> None:
+        with self._lock:
+            if username is None:
+                self._datos.clear()
+            else:
+                self._datos.pop(username, None)
+
+
+_cache_usuarios = _CacheUsuarios()
+_cache_versiones = _CacheUsuarios()
+
+
+def invalidar_usuario(username: str | None = None) -> None:
+    """Saca al usuario (o a todos) del caché de autenticación de este proceso."""
+
+    _cache_usuarios.invalidar(username)
+    _cache_versiones.invalidar(username)
+
+
+def claims_de_usuario(user: models.Usuario) -> dict[str, Any]:
+    """Claims del access token; `tv` permite revocarlo subiendo `token_version`."""
+
+    return {
+        "sub": user.username,
+        "uid": str(user.id),
+        "rol": user.rol,
+        "tv": int(user.token_version or 0),
+    }
+
+
+def _payload_desde_token(token: str) -> dict[str, Any]:
     try:
         payload = decode_access_token(token)
-        username: str | None = payload.get("sub")
-        if not username:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
+        raise _credentials_exception
+    if not payload.get("sub"):
+        raise _credentials_exception
+    return payload
+
+
+def _desde_claims(payload: dict[str, Any]) -> UsuarioActual | None:
+    """Con AUTH_TOKEN_CLAIMS=true, arma el usuario desde el token sin cargarlo de la BD.
+
+    Solo se emiten tokens a usuarios activos y aprobados. Los endpoints de
+    admin suben `token_version` al cambiar rol/estado: el llamador compara
+    `tv` con la versión vigente (`_con_version`), cacheada por
+    AUTH_CACHE_TTL_S, así que el token viejo deja de valer en esta réplica
+    de inmediato y en las demás al vencer el TTL.
+    """
+
+    if not _token_claims_enabled():
+        return None
+    try:
+        return UsuarioActual(
+            id=uuid.UUID(str(payload["uid"])),
+            username=str(payload["sub"]),
+            rol=payload.get("rol"),
+            token_version=int(payload["tv"]),
+        )
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _con_version(user: UsuarioActual, version: int | None) -> UsuarioActual | None:
+    """`user` de los claims con la `token_version` vigente (None si ya no existe)."""
+
+    if version is None:
+        return None
+    _cache_versiones.guardar(user.username, int(version))
+    return replace(user, token_version=int(version))
+
 
-    user = db.query(models.Usuario).filter(models.Usuario.username == username).first()
+def _validar_usuario(user: UsuarioActual | None, payload: dict[str, Any]) -> UsuarioActual:
     if user is None:
-        raise credentials_exception
-    if hasattr(user, "is_active") and not bool(user.is_active):
+        raise _credentials_exception
+    if not user.is_active:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario desactivado",
         )
-    if hasattr(user, "is_approved") and not bool(user.is_approved):
+    if not user.is_approved:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Usuario pendiente de aprobación",
         )
+    # Tokens anteriores a `tv` no traen versión y se aceptan hasta que expiren.
+    if "tv" in payload and int(payload["tv"]) != user.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Sesión expirada, vuelve a iniciar sesión",
+        )
     return user
 
 
+def get_current_user(
+    token: str = Depends(oauth2_scheme),
+    db: Session = Depends(get_db),
+) -> UsuarioActual:
+    payload = _payload_desde_token(token)
+    username = payload["sub"]
+    user = _cache_usuarios.obtener(username)
+    claims = _desde_claims(payload) if user is None else None
+    if claims is not None:
+        version = _cache_versiones.obtener(username)
+        if version is None:
+            version = db.query(models.Usuario.token_version).filter(models.Usuario.username == username).scalar()
+        user = _con_version(claims, version)
+    if user is None:
+        modelo = db.query(models.Usuario).filter(models.Usuario.username == username).first()
+        if modelo is not None:
+            user = UsuarioActual.desde_modelo(modelo)
+            _cache_usuarios.guardar(username, user)
+    return _validar_usuario(user, payload)
+
+
+async def get_current_user_async(
+    token: str = Depends(oauth2_scheme),
+    db: AsyncSession = Depends(get_async_db),
+) -> UsuarioActual:
+    """Igual que `get_current_user`, para endpoints que usan `AsyncSession`."""
+
+    payload = _payload_desde_token(token)
+    username = payload["sub"]
+    user = _cache_usuarios.obtener(username)
+    claims = _desde_claims(payload) if user is None else None
+    if claims is not None:
+        version = _cache_versiones.obtener(username)
+        if version is None:
+            version = await db.scalar(
+                select(models.Usuario.token_version).where(models.Usuario.username == username).limit(1)
+            )
+        user = _con_version(claims, version)
+    if user is None:
+        result = await db.execute(select(models.Usuario).where(models.Usuario.username == username).limit(1))
+        modelo = result.scalars().first()
+        if modelo is not None:
+            user = UsuarioActual.desde_modelo(modelo)
+            _cache_usuarios.guardar(username, user)
+    return _validar_usuario(user, payload)
+
+
 def RoleChecker(allowed_roles: list[str]):
     allowed = set(allowed_roles)
 
-    def role_checker(user: models.Usuario = Depends(get_current_user)) -> models.Usuario:
+    def role_checker(user: UsuarioActual = Depends(get_current_user)) -> UsuarioActual:
         if (user.rol or "") not in allowed:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
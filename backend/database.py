@@ -1,6 +1,12 @@
 import os
 import pathlib
-from sqlalchemy import create_engine
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine, event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
@@ -66,14 +72,144 @@ if db_url.startswith("postgres://"):
 if ".supabase.co" in db_url and "sslmode=" not in db_url:
     db_url = db_url + ("&" if "?" in db_url else "?") + "sslmode=require"
 
-engine = create_engine(
-    db_url,
-    pool_pre_ping=True,
-    connect_args={
-        # Fail fast if Supabase is unreachable; avoids the container hanging on startup.
-        "connect_timeout": int(os.getenv("DB_CONNECT_TIMEOUT", "10")),
-    },
-)
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} must be an integer") from exc
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'").lower()
+    if not raw:
+        return default
+    return raw in ("1", "true", "yes", "on")
+
+
+def _modo_pool(url: str) -> str:
+    """'pool' (QueuePool propio) o 'pgbouncer' (pooler en modo transacción).
+
+    En 'auto' (default) se elige 'pgbouncer' si el DSN apunta al puerto 6543,
+    que es el transaction pooler de Supabase.
+    """
+
+    raw = (os.getenv("DB_POOL_MODE") or "auto").strip().strip('"').strip("'").lower()
+    if raw == "auto":
+        return "pgbouncer" if make_url(url).port == 6543 else "pool"
+    if raw not in ("pool", "pgbouncer"):
+        raise RuntimeError("DB_POOL_MODE must be one of: auto, pool, pgbouncer")
+    return raw
+
+
+class MetricasPool:
+    """Contadores de checkout por motor (los expone `/health/db-pool`).
+
+    La espera de un checkout incluye abrir una conexión nueva cuando el pool
+    no tiene una libre; `timeouts` cuenta los checkouts que agotaron
+    `DB_POOL_TIMEOUT`.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.en_uso = 0
+        self.conexiones_nuevas = 0
+        self.timeouts = 0
+        self.esperas = 0
+        self.espera_total_s = 0.0
+        self.espera_max_s = 0.0
+
+    def registrar_espera(self, segundos: float, *, timeout: bool = False) -> None:
+        with self._lock:
+            self.esperas += 1
+            self.espera_total_s += segundos
+            self.espera_max_s = max(self.espera_max_s, segundos)
+            if timeout:
+                self.timeouts += 1
+
+    def registrar(self, campo: str, delta: int = 1) -> None:
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + delta)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "en_uso": self.en_uso,
+                "conexiones_nuevas": self.conexiones_nuevas,
+                "timeouts": self.timeouts,
+                "espera_media_ms": round(self.espera_total_s * 1000 / self.esperas, 3) if self.esperas else 0.0,
+                "espera_max_ms": round(self.espera_max_s * 1000, 3),
+            }
+
+
+_metricas = {"sync": MetricasPool(), "async": MetricasPool()}
+
+
+def _pool_medido(base, metricas: MetricasPool):
+    """Subclase de `base` que mide el tiempo de cada checkout."""
+
+    class _PoolMedido(base):
+        def _do_get(self):
+            t0 = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except sa_exc.TimeoutError:
+                metricas.registrar_espera(time.perf_counter() - t0, timeout=True)
+                raise
+            metricas.registrar_espera(time.perf_counter() - t0)
+            return conn
+
+    _PoolMedido.__name__ = f"Medido{base.__name__}"
+    return _PoolMedido
+
+
+def _escuchar_pool(sync_engine, metricas: MetricasPool) -> None:
+    event.listen(sync_engine, "connect", lambda *_: metricas.registrar("conexiones_nuevas"))
+
+    def _checkout(*_):
+        metricas.registrar("checkouts")
+        metricas.registrar("en_uso")
+
+    event.listen(sync_engine, "checkout", _checkout)
+    event.listen(sync_engine, "checkin", lambda *_: metricas.registrar("en_uso", -1))
+
+
+def _opciones_pool(base) -> dict:
+    metricas = _metricas["async" if base is AsyncAdaptedQueuePool else "sync"]
+    if POOL_MODE == "pgbouncer":
+        # El pooler ya reutiliza conexiones del lado servidor: un pool local
+        # encima solo acapara conexiones del pooler entre peticiones.
+        return {"poolclass": _pool_medido(NullPool, metricas)}
+    return {
+        "poolclass": _pool_medido(base, metricas),
+        "pool_size": _env_int("DB_POOL_SIZE", 5),
+        "max_overflow": _env_int("DB_MAX_OVERFLOW", 10),
+        # Reciclar antes del timeout de inactividad del servidor evita el
+        # ping de pool_pre_ping en cada checkout.
+        "pool_recycle": _env_int("DB_POOL_RECYCLE", 1800),
+        "pool_timeout": _env_int("DB_POOL_TIMEOUT", 30),
+        "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", False),
+    }
+
+
+POOL_MODE = _modo_pool(db_url)
+
+_connect_args = {
+    # Fail fast if Supabase is unreachable; avoids the container hanging on startup.
+    "connect_timeout": _env_int("DB_CONNECT_TIMEOUT", 10),
+}
+# psycopg2 no usa prepared statements del lado servidor; psycopg 3 sí (tras
+# 5 ejecuciones), y con pgbouncer en modo transacción eso rompe.
+if POOL_MODE == "pgbouncer" and make_url(db_url).get_driver_name() == "psycopg":
+    _connect_args["prepare_threshold"] = None
+
+engine = create_engine(db_url, connect_args=_connect_args, **_opciones_pool(QueuePool))
+_escuchar_pool(engine, _metricas["sync"])
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -82,4 +218,84 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+# --- Motor async (asyncpg) ---------------------------------------------------
+# Opcional: solo lo usan los endpoints de campo más concurridos. Se crea al
+# primer uso para que el resto de la API no dependa de asyncpg.
+
+_async_engine = None
+_AsyncSessionLocal = None
+
+
+def _async_db_url(url: str):
+    """Traduce el DSN de psycopg2 a asyncpg (driver y parámetros libpq)."""
+
+    u = make_url(url).set(drivername="postgresql+asyncpg")
+    query = dict(u.query)
+    # asyncpg no entiende sslmode/connect_timeout: usa ssl= y timeout=.
+    sslmode = query.pop("sslmode", None)
+    if sslmode:
+        query["ssl"] = sslmode
+    query.pop("connect_timeout", None)
+    if POOL_MODE == "pgbouncer":
+        query["prepared_statement_cache_size"] = "0"
+    return u.set(query=query)
+
+
+def get_async_engine():
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is None:
+        try:
+            from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+        except ImportError as exc:  # pragma: no cover - depende del entorno
+            raise RuntimeError("El motor async requiere asyncpg (pip install asyncpg)") from exc
+
+        connect_args = {
+            "timeout": _env_int("DB_CONNECT_TIMEOUT", 10),
+            "statement_cache_size": _env_int("DB_ASYNC_STATEMENT_CACHE", 100),
+        }
+        if POOL_MODE == "pgbouncer":
+            # pgbouncer (modo transacción) reparte las sentencias entre
+            # conexiones de servidor: sin caché y con nombres únicos.
+            connect_args["statement_cache_size"] = 0
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid.uuid4()}__"
+        _async_engine = create_async_engine(
+            _async_db_url(db_url),
+            connect_args=connect_args,
+            **_opciones_pool(AsyncAdaptedQueuePool),
+        )
+        _escuchar_pool(_async_engine.sync_engine, _metricas["async"])
+        _AsyncSessionLocal = async_sessionmaker(_async_engine, autoflush=False, expire_on_commit=False)
+    return _async_engine
+
+
+async def get_async_db():
+    get_async_engine()
+    async with _AsyncSessionLocal() as db:
+        yield db
+
+
+async def dispose_async_engine() -> None:
+    global _async_engine, _AsyncSessionLocal
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _AsyncSessionLocal = None
+
+
+def metricas_pool() -> dict:
+    """Estado y contadores de los pools (sync y, si ya existe, async)."""
+
+    def _estado(sync_engine, metricas: MetricasPool) -> dict:
+        datos = metricas.snapshot()
+        pool = sync_engine.pool
+        if isinstance(pool, QueuePool):
+            datos.update(tamano=pool.size(), libres=pool.checkedin(), overflow=pool.overflow())
+        return datos
+
+    salida = {"modo": POOL_MODE, "sync": _estado(engine, _metricas["sync"])}
+    if _async_engine is not None:
+        salida["async"] = _estado(_async_engine.sync_engine, _metricas["async"])
+    return salida
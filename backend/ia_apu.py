@@ -1,13 +1,23 @@
+import datetime
 import json
 import os
 from typing import Any
 
-from openai import OpenAI
+from backend.ia_cache import clave_cache, guardar_cache, leer_cache
+from backend.ia_cliente import completar_json
 
 
-def generar_composicion_apu_ia(nombre_renglon: str, departamento: str) -> dict[str, Any]:
+def generar_composicion_apu_ia(
+    nombre_renglon: str,
+    departamento: str,
+    *,
+    usar_cache: bool = True,
+) -> dict[str, Any]:
     """Genera un APU (composición) usando un LLM.
 
+    Con `usar_cache=True` (default) una respuesta previa para el mismo
+    renglón/departamento/modelo se sirve desde `ia_cache`.
+
     Retorna un dict con esta estructura:
     {
       "unidad": "m2",
@@ -29,34 +39,27 @@ Devuelve un JSON estrictamente con esta estructura:
 }}
 """.strip()
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Falta OPENAI_API_KEY en el entorno (backend/.env)")
-
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    client = OpenAI(api_key=api_key)
-
-    response = client.chat.completions.create(
-        model=model,
-        temperature=0.2,
-        messages=[
-            {
-                "role": "system",
-                "content": "Responde únicamente con JSON válido. Sin texto adicional.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
+    clave = clave_cache(
+        "generar_composicion_apu_ia",
+        model,
+        {"nombre_renglon": nombre_renglon, "departamento": departamento},
     )
+    if usar_cache:
+        cached = leer_cache(clave)
+        if cached is not None:
+            return cached
 
-    content = (response.choices[0].message.content or "").strip()
+    content = completar_json(prompt, model=model)
     data = json.loads(content)
 
     _validar_estructura_apu(data)
+    data["sondeo_ia"] = datetime.datetime.utcnow().isoformat()
+    guardar_cache(clave, data)
     return data
 
 
-def consultar_precios_ia(renglon: str, departamento: str) -> dict[str, Any]:
+def consultar_precios_ia(renglon: str, departamento: str, *, usar_cache: bool = True) -> dict[str, Any]:
     """Compat: genera APU en el formato del snippet compartido.
 
     Este wrapper evita duplicar lógica/llamadas a OpenAI: reutiliza
@@ -71,7 +74,11 @@ def consultar_precios_ia(renglon: str, departamento: str) -> dict[str, Any]:
     }
     """
 
-    base = generar_composicion_apu_ia(nombre_renglon=renglon, departamento=departamento)
+    base = generar_composicion_apu_ia(
+        nombre_renglon=renglon,
+        departamento=departamento,
+        usar_cache=usar_cache,
+    )
 
     unidad = base.get("unidad") or base.get("unidad_medida") or ""
     insumos_in = base.get("insumos") if isinstance(base.get("insumos"), list) else []
@@ -98,6 +105,7 @@ def consultar_precios_ia(renglon: str, departamento: str) -> dict[str, Any]:
     return {
         "unidad_medida": unidad,
         "insumos": insumos_out,
+        "sondeo_ia": base.get("sondeo_ia"),
     }
 
 
@@ -107,6 +115,7 @@ def generar_apu_preciso_con_cantidades(
     departamento: str,
     unidad_renglon: str,
     insumos_materiales: list[dict[str, Any]],
+    usar_cache: bool = True,
 ) -> dict[str, Any]:
     """Genera APU usando cantidades matemáticas como base.
 
@@ -174,29 +183,27 @@ Reglas:
 3) No agregues texto extra. Solo JSON.
 """.strip()
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Falta OPENAI_API_KEY en el entorno (backend/.env)")
-
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    client = OpenAI(api_key=api_key)
-
-    response = client.chat.completions.create(
-        model=model,
-        temperature=0.2,
-        messages=[
-            {
-                "role": "system",
-                "content": "Responde únicamente con JSON válido. Sin texto adicional.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
+    clave = clave_cache(
+        "generar_apu_preciso_con_cantidades",
+        model,
+        {
+            "nombre_renglon": nombre_renglon,
+            "departamento": departamento,
+            "unidad_renglon": unidad_out,
+            "insumos_materiales": base_items,
+        },
     )
+    if usar_cache:
+        cached = leer_cache(clave)
+        if cached is not None:
+            return cached
 
-    content = (response.choices[0].message.content or "").strip()
+    content = completar_json(prompt, model=model)
     data = json.loads(content)
     _validar_estructura_apu(data)
+    data["sondeo_ia"] = datetime.datetime.utcnow().isoformat()
+    guardar_cache(clave, data)
     return data
 
 
@@ -224,6 +231,7 @@ def generar_analisis_total(
     salario_minimo_mensual_gtq: float | None = None,
     factor_transporte_regional: float | None = None,
     fecha_referencia: str | None = None,
+    usar_cache: bool = True,
 ) -> dict[str, Any]:
     """Genera un análisis de costos directos/indirectos en JSON.
 
@@ -239,12 +247,7 @@ def generar_analisis_total(
     if cantidad_f <= 0:
         raise ValueError("cantidad debe ser > 0")
 
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
-        raise RuntimeError("Falta OPENAI_API_KEY en el entorno (backend/.env)")
-
     model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    client = OpenAI(api_key=api_key)
 
     refs: dict[str, Any] = {
         "fecha_referencia": fecha_referencia,
@@ -252,6 +255,16 @@ def generar_analisis_total(
         "factor_transporte_regional": factor_transporte_regional,
     }
 
+    clave = clave_cache(
+        "generar_analisis_total",
+        model,
+        {"renglon": renglon, "cantidad": cantidad_f, "departamento": departamento, "refs": refs},
+    )
+    if usar_cache:
+        cached = leer_cache(clave)
+        if cached is not None:
+            return cached
+
     prompt = f"""
 Necesito un análisis de costos para obra en {departamento}, Guatemala.
 Renglón: {renglon}
@@ -281,21 +294,10 @@ Devuelve ÚNICAMENTE JSON con esta estructura:
 }}
 """.strip()
 
-    response = client.chat.completions.create(
-        model=model,
-        temperature=0.2,
-        messages=[
-            {
-                "role": "system",
-                "content": "Responde únicamente con JSON válido. Sin texto adicional.",
-            },
-            {"role": "user", "content": prompt},
-        ],
-        response_format={"type": "json_object"},
-    )
-
-    content = (response.choices[0].message.content or "").strip()
+    content = completar_json(prompt, model=model)
     data = json.loads(content)
     if not isinstance(data, dict):
         raise ValueError("La respuesta no es un JSON objeto")
+    data["sondeo_ia"] = datetime.datetime.utcnow().isoformat()
+    guardar_cache(clave, data)
     return data
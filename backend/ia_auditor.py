@@ -1,8 +1,11 @@
 from backend import models
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import case, func
 import uuid
 
+# Porcentaje de consumo del presupuesto IA a partir del cual hay alerta crítica.
+UMBRAL_ALERTA_CRITICA = 105
+
 def verificar_desviacion_presupuesto(db: Session, proyecto_id: uuid.UUID):
     """
     Compara el costo teórico (IA) vs el costo real (Facturas/OC)
@@ -55,10 +58,99 @@ def verificar_desviacion_presupuesto(db: Session, proyecto_id: uuid.UUID):
         "presupuesto_ia": float(presupuesto_teorico),
         "gasto_real": float(gasto_real),
         "porcentaje_consumido": round(desviacion, 2),
-        "alerta_critica": desviacion > 105  # Alerta si nos pasamos del 5%
+        "alerta_critica": desviacion > UMBRAL_ALERTA_CRITICA  # Alerta si nos pasamos del 5%
     }
 
 
+def _consulta_portafolio(db: Session, *, solo_alertas: bool):
+    """Presupuesto IA y gasto real por proyecto en una consulta agrupada (sin ordenar)."""
+
+    presupuesto = (
+        db.query(
+            models.PresupuestoRenglon.proyecto_id.label("proyecto_id"),
+            func.sum(
+                models.PresupuestoRenglon.costo_unitario_ia * models.PresupuestoRenglon.cantidad_total
+            ).label("presupuesto_ia"),
+        )
+        .group_by(models.PresupuestoRenglon.proyecto_id)
+        .subquery()
+    )
+
+    subtotal_expr = func.coalesce(
+        models.DetalleOrdenCompra.subtotal,
+        models.DetalleOrdenCompra.cantidad_pedida * models.DetalleOrdenCompra.precio_unitario_compra,
+    )
+    gasto = (
+        db.query(
+            models.OrdenCompra.proyecto_id.label("proyecto_id"),
+            func.sum(subtotal_expr).label("gasto_real"),
+        )
+        .join(models.DetalleOrdenCompra, models.DetalleOrdenCompra.oc_id == models.OrdenCompra.id)
+        .group_by(models.OrdenCompra.proyecto_id)
+        .subquery()
+    )
+
+    presupuesto_ia = func.coalesce(presupuesto.c.presupuesto_ia, 0.0)
+    gasto_real = func.coalesce(gasto.c.gasto_real, 0.0)
+    porcentaje = case((presupuesto_ia > 0, gasto_real / presupuesto_ia * 100), else_=0.0)
+
+    q = (
+        db.query(
+            models.Proyecto.id,
+            models.Proyecto.nombre_proyecto,
+            presupuesto_ia.label("presupuesto_ia"),
+            gasto_real.label("gasto_real"),
+            porcentaje.label("porcentaje"),
+        )
+        .outerjoin(presupuesto, presupuesto.c.proyecto_id == models.Proyecto.id)
+        .outerjoin(gasto, gasto.c.proyecto_id == models.Proyecto.id)
+    )
+    if solo_alertas:
+        q = q.filter(porcentaje > UMBRAL_ALERTA_CRITICA)
+    return q
+
+
+def verificar_desviacion_portafolio(
+    db: Session,
+    *,
+    solo_alertas: bool = False,
+    despues_de: uuid.UUID | None = None,
+    limit: int | None = None,
+) -> list[dict]:
+    """Versión por conjuntos de `verificar_desviacion_presupuesto` para todos los proyectos.
+
+    Una sola consulta agrupada (presupuesto IA y gasto real por proyecto, unidos
+    a `proyectos`), en vez de dos consultas por proyecto. Ordena por id de
+    proyecto: `despues_de` + `limit` permiten paginar por keyset.
+    """
+
+    q = _consulta_portafolio(db, solo_alertas=solo_alertas)
+    if despues_de is not None:
+        q = q.filter(models.Proyecto.id > despues_de)
+    q = q.order_by(models.Proyecto.id.asc())
+    if limit is not None:
+        q = q.limit(limit)
+
+    return [
+        {
+            "proyecto_id": str(r.id),
+            "nombre_proyecto": r.nombre_proyecto,
+            "presupuesto_ia": float(r.presupuesto_ia or 0.0),
+            "gasto_real": float(r.gasto_real or 0.0),
+            "porcentaje_consumido": round(float(r.porcentaje or 0.0), 2),
+            "alerta_critica": float(r.porcentaje or 0.0) > UMBRAL_ALERTA_CRITICA,
+        }
+        for r in q.all()
+    ]
+
+
+def contar_alertas_criticas(db: Session) -> int:
+    """Número de proyectos con alerta crítica (un `SELECT count(*)`, sin traer las filas)."""
+
+    alertas = _consulta_portafolio(db, solo_alertas=True).subquery()
+    return int(db.query(func.count()).select_from(alertas).scalar() or 0)
+
+
 def obtener_teorico_disponible(db: Session, proyecto_id: uuid.UUID, insumo_id: uuid.UUID) -> float:
     """Calcula: (Suma de Cantidad_Renglones * Rendimiento_APU) - Suma_Ya_Comprada."""
 
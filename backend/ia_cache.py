@@ -0,0 +1,153 @@
+"""Cache persistente (en disco) para respuestas del LLM.
+
+La llave es un hash SHA-256 de (función, modelo, entradas normalizadas), así
+que el mismo renglón/departamento pedido dos veces responde desde disco sin
+pagar otra llamada a OpenAI.
+
+Configuración (env):
+  - IA_CACHE_DIR: carpeta de almacenamiento (default: backend/cache_ia)
+  - IA_CACHE_TTL_HORAS: vigencia de una entrada (default: 168 = 7 días)
+  - IA_CACHE_ENABLED: "false" desactiva el cache globalmente
+
+Cada entrada guarda `sondeo_ia` (momento en que se consultó al LLM). Ese valor
+viaja dentro del APU y se usa como `InsumoMaestro.ultimo_sondeo_ia` al
+persistir, de modo que un precio servido desde cache no aparenta ser un
+sondeo nuevo, y el TTL define cuándo un sondeo deja de ser vigente.
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import tempfile
+import unicodedata
+from typing import Any
+
+
+_logger = logging.getLogger("uvicorn.error")
+
+_default_dir = pathlib.Path(__file__).resolve().parent / "cache_ia"
+
+
+def _cache_habilitado() -> bool:
+    return os.getenv("IA_CACHE_ENABLED", "true").strip().lower() not in {"0", "false", "no"}
+
+
+def _cache_dir() -> pathlib.Path:
+    raw = os.getenv("IA_CACHE_DIR", "").strip()
+    return pathlib.Path(raw).expanduser() if raw else _default_dir
+
+
+def _ttl() -> datetime.timedelta:
+    raw = os.getenv("IA_CACHE_TTL_HORAS", "168").strip().strip('"').strip("'")
+    try:
+        horas = float(raw)
+    except ValueError as exc:
+        raise RuntimeError("IA_CACHE_TTL_HORAS debe ser numérico") from exc
+    return datetime.timedelta(hours=max(horas, 0.0))
+
+
+def _normalizar(value: Any) -> Any:
+    """Normaliza entradas para que variaciones triviales compartan llave.
+
+    "Levantado de Muro " y "levantado  de muro" producen la misma llave.
+    """
+
+    if isinstance(value, str):
+        text = unicodedata.normalize("NFC", value)
+        return " ".join(text.split()).lower()
+    if isinstance(value, float):
+        return round(value, 6)
+    if isinstance(value, dict):
+        return {str(k): _normalizar(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalizar(v) for v in value]
+    return value
+
+
+def clave_cache(funcion: str, modelo: str, entradas: dict[str, Any]) -> str:
+    material = json.dumps(
+        {"funcion": funcion, "modelo": modelo, "entradas": _normalizar(entradas)},
+        ensure_ascii=False,
+        sort_keys=True,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _ruta(clave: str) -> pathlib.Path:
+    # Dos niveles de carpeta evitan directorios con miles de archivos.
+    return _cache_dir() / clave[:2] / f"{clave}.json"
+
+
+def leer_cache(clave: str) -> dict[str, Any] | None:
+    """Retorna la respuesta cacheada o None si no existe / expiró."""
+
+    if not _cache_habilitado():
+        return None
+
+    path = _ruta(clave)
+    try:
+        entrada = json.loads(path.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        return None
+    except Exception as exc:
+        _logger.warning("IA cache corrupto (%s): %s", path.name, exc)
+        path.unlink(missing_ok=True)
+        return None
+
+    try:
+        sondeo = datetime.datetime.fromisoformat(str(entrada["sondeo_ia"]))
+        data = entrada["data"]
+    except Exception:
+        path.unlink(missing_ok=True)
+        return None
+
+    if datetime.datetime.utcnow() - sondeo > _ttl():
+        path.unlink(missing_ok=True)
+        return None
+
+    if not isinstance(data, dict):
+        return None
+    return data
+
+
+def guardar_cache(clave: str, data: dict[str, Any]) -> None:
+    """Escribe la entrada de forma atómica. Errores de disco no son fatales."""
+
+    if not _cache_habilitado():
+        return
+
+    path = _ruta(clave)
+    entrada = {
+        "sondeo_ia": data.get("sondeo_ia") or datetime.datetime.utcnow().isoformat(),
+        "data": data,
+    }
+    tmp_name = None
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=str(path.parent), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entrada, f, ensure_ascii=False)
+        os.replace(tmp_name, path)
+    except Exception as exc:
+        # En plataformas con filesystem de solo lectura el cache simplemente no aplica.
+        _logger.warning("IA cache no disponible: %s", exc)
+        if tmp_name is not None:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+
+
+def parse_sondeo_ia(value: Any) -> datetime.datetime | None:
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        return datetime.datetime.fromisoformat(value.strip())
+    except ValueError:
+        return None
@@ -0,0 +1,156 @@
+"""Cliente OpenAI compartido para todo el backend.
+
+- Un cliente por (api_key, base_url) por proceso: reutiliza las conexiones
+  HTTP (TLS/keep-alive) en vez de crear `OpenAI(...)` en cada llamada.
+- Reintentos con backoff exponencial + jitter ante 429, 5xx, timeouts y
+  errores de conexión (respeta `Retry-After` si el servidor lo envía).
+- Single-flight: peticiones idénticas concurrentes (mismo modelo + mensajes)
+  comparten una sola llamada en vuelo.
+
+Configuración (env):
+  - OPENAI_API_KEY, OPENAI_BASE_URL (opcional; útil para un stub local)
+  - OPENAI_TIMEOUT_S (default 60)
+  - IA_REINTENTOS (default 4), IA_BACKOFF_BASE_S (default 0.5), IA_BACKOFF_MAX_S (default 20)
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any
+
+import openai
+from openai import OpenAI
+
+
+_lock = threading.Lock()
+_clientes: dict[tuple[str, str | None], OpenAI] = {}
+_en_vuelo: dict[str, Future] = {}
+
+_SYSTEM_JSON = "Responde únicamente con JSON válido. Sin texto adicional."
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = os.getenv(name, str(default)).strip().strip('"').strip("'")
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser numérico") from exc
+
+
+def obtener_cliente() -> OpenAI:
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise RuntimeError("Falta OPENAI_API_KEY en el entorno (backend/.env)")
+    base_url = (os.getenv("OPENAI_BASE_URL") or "").strip() or None
+
+    key = (api_key, base_url)
+    with _lock:
+        client = _clientes.get(key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=_env_float("OPENAI_TIMEOUT_S", 60.0),
+                # Los reintentos los maneja `_crear_con_reintentos` (con jitter y single-flight).
+                max_retries=0,
+            )
+            _clientes[key] = client
+        return client
+
+
+def cerrar_clientes() -> None:
+    with _lock:
+        clientes = list(_clientes.values())
+        _clientes.clear()
+    for client in clientes:
+        try:
+            client.close()
+        except Exception:
+            pass
+
+
+def _es_reintentable(exc: Exception) -> bool:
+    if isinstance(exc, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500
+    return False
+
+
+def _espera_reintento(intento: int, exc: Exception) -> float:
+    response = getattr(exc, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), _env_float("IA_BACKOFF_MAX_S", 20.0))
+        except ValueError:
+            pass
+
+    # "Full jitter": espera aleatoria en [0, base * 2^intento], acotada.
+    base = _env_float("IA_BACKOFF_BASE_S", 0.5)
+    techo = min(_env_float("IA_BACKOFF_MAX_S", 20.0), base * (2**intento))
+    return random.uniform(0, techo)
+
+
+def _crear_con_reintentos(client: OpenAI, params: dict[str, Any]) -> str:
+    reintentos = int(_env_float("IA_REINTENTOS", 4))
+    intento = 0
+    while True:
+        try:
+            response = client.chat.completions.create(**params)
+            return (response.choices[0].message.content or "").strip()
+        except Exception as exc:
+            if intento >= reintentos or not _es_reintentable(exc):
+                raise
+            time.sleep(_espera_reintento(intento, exc))
+            intento += 1
+
+
+def completar_json(prompt: str, *, model: str, temperature: float = 0.2) -> str:
+    """Ejecuta un chat completion en modo JSON y retorna el contenido (texto).
+
+    Llamadas idénticas que lleguen mientras otra está en vuelo esperan y
+    reciben el mismo resultado (o la misma excepción).
+    """
+
+    client = obtener_cliente()
+    params: dict[str, Any] = {
+        "model": model,
+        "temperature": temperature,
+        "messages": [
+            {"role": "system", "content": _SYSTEM_JSON},
+            {"role": "user", "content": prompt},
+        ],
+        "response_format": {"type": "json_object"},
+    }
+    clave = hashlib.sha256(
+        json.dumps([str(client.base_url), params], ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+    with _lock:
+        futuro = _en_vuelo.get(clave)
+        lider = futuro is None
+        if lider:
+            futuro = Future()
+            _en_vuelo[clave] = futuro
+
+    if not lider:
+        return futuro.result()
+
+    try:
+        content = _crear_con_reintentos(client, params)
+    except BaseException as exc:
+        futuro.set_exception(exc)
+        raise
+    else:
+        futuro.set_result(content)
+        return content
+    finally:
+        with _lock:
+            _en_vuelo.pop(clave, None)
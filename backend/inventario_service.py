@@ -0,0 +1,177 @@
+"""Inventario de bodega: libro de movimientos + saldo materializado.
+
+`movimientos_bodega` es el libro (append-only) y `stock_actual` guarda el
+saldo ENTRADA - SALIDA por (proyecto, insumo). Todo movimiento nuevo debe
+pasar por `registrar_movimientos`, que escribe el libro y aplica el delta al
+saldo en la misma transacción, así `/inventario/resumen?snapshot=true` lee
+una fila por insumo en vez de re-sumar el libro completo.
+
+`reconciliar_stock` recalcula el saldo desde el libro (corrige escrituras
+que no pasaron por aquí, p.ej. SQL manual) y reporta cuántas filas diferían.
+"""
+
+from __future__ import annotations
+
+import datetime
+import uuid
+from typing import Any
+
+from sqlalchemy import and_, case, delete, func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from backend import models
+
+
+def _cantidad_con_signo():
+    return case(
+        (models.MovimientoBodega.tipo_movimiento == "ENTRADA", models.MovimientoBodega.cantidad),
+        else_=-models.MovimientoBodega.cantidad,
+    )
+
+
+def registrar_movimientos(db: Session, movimientos: list[dict[str, Any]]) -> list[models.MovimientoBodega]:
+    """Agrega movimientos al libro y actualiza `stock_actual` (sin commit).
+
+    Cada movimiento: {proyecto_id, insumo_id, tipo_movimiento, cantidad}.
+    El saldo se actualiza con un solo `INSERT ... ON CONFLICT DO UPDATE`
+    sumando el delta, de modo que escritores concurrentes no se pisan.
+    """
+
+    if not movimientos:
+        return []
+
+    registros = [
+        models.MovimientoBodega(
+            proyecto_id=m["proyecto_id"],
+            insumo_id=m["insumo_id"],
+            tipo_movimiento=str(m["tipo_movimiento"]).upper(),
+            cantidad=float(m["cantidad"]),
+        )
+        for m in movimientos
+    ]
+    db.add_all(registros)
+
+    deltas: dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+    for r in registros:
+        signo = 1.0 if r.tipo_movimiento == "ENTRADA" else -1.0
+        key = (r.proyecto_id, r.insumo_id)
+        deltas[key] = deltas.get(key, 0.0) + signo * r.cantidad
+
+    ahora = datetime.datetime.utcnow()
+    # Orden estable de llaves: evita deadlocks entre transacciones que tocan los mismos saldos.
+    filas = [
+        {"proyecto_id": p, "insumo_id": i, "cantidad": delta, "actualizado_en": ahora}
+        for (p, i), delta in sorted(deltas.items(), key=lambda kv: (str(kv[0][0]), str(kv[0][1])))
+    ]
+    stmt = pg_insert(models.StockActual).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[models.StockActual.proyecto_id, models.StockActual.insumo_id],
+        set_={
+            "cantidad": models.StockActual.cantidad + stmt.excluded.cantidad,
+            "actualizado_en": stmt.excluded.actualizado_en,
+        },
+    )
+    db.execute(stmt)
+    return registros
+
+
+def _resumen_por_insumo(db: Session, cantidad, join_on, proyecto_col, proyecto_id) -> list[dict[str, Any]]:
+    q = (
+        db.query(
+            models.InsumoMaestro.id.label("id"),
+            models.InsumoMaestro.descripcion.label("descripcion"),
+            models.InsumoMaestro.unidad_compra.label("unidad"),
+            func.coalesce(func.sum(cantidad), 0.0).label("cantidad"),
+        )
+        .join(proyecto_col.class_, join_on)
+    )
+    if proyecto_id is not None:
+        q = q.filter(proyecto_col == proyecto_id)
+
+    q = q.group_by(
+        models.InsumoMaestro.id,
+        models.InsumoMaestro.descripcion,
+        models.InsumoMaestro.unidad_compra,
+    ).order_by(models.InsumoMaestro.descripcion.asc())
+
+    return [
+        {
+            "id": str(r.id),
+            "descripcion": r.descripcion,
+            "unidad": r.unidad,
+            "cantidad": float(r.cantidad or 0),
+        }
+        for r in q.all()
+    ]
+
+
+def resumen_libro(db: Session, proyecto_id: uuid.UUID | None = None) -> list[dict[str, Any]]:
+    """`/inventario/resumen`: ENTRADA - SALIDA sumando `movimientos_bodega`."""
+
+    return _resumen_por_insumo(
+        db,
+        _cantidad_con_signo(),
+        models.MovimientoBodega.insumo_id == models.InsumoMaestro.id,
+        models.MovimientoBodega.proyecto_id,
+        proyecto_id,
+    )
+
+
+def resumen_stock(db: Session, proyecto_id: uuid.UUID | None = None) -> list[dict[str, Any]]:
+    """Mismo formato que `resumen_libro`, leído desde `stock_actual`."""
+
+    return _resumen_por_insumo(
+        db,
+        models.StockActual.cantidad,
+        models.StockActual.insumo_id == models.InsumoMaestro.id,
+        models.StockActual.proyecto_id,
+        proyecto_id,
+    )
+
+
+def reconciliar_stock(db: Session) -> dict[str, Any]:
+    """Recalcula `stock_actual` desde el libro completo y hace commit.
+
+    En Postgres bloquea `stock_actual` (EXCLUSIVE: lecturas sí, escrituras no)
+    durante el recálculo, así ningún delta concurrente se pierde ni se cuenta
+    dos veces.
+    """
+
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE stock_actual IN EXCLUSIVE MODE"))
+
+    libro = (
+        select(
+            models.MovimientoBodega.proyecto_id.label("proyecto_id"),
+            models.MovimientoBodega.insumo_id.label("insumo_id"),
+            func.sum(_cantidad_con_signo()).label("cantidad"),
+        )
+        .where(models.MovimientoBodega.proyecto_id.is_not(None))
+        .where(models.MovimientoBodega.insumo_id.is_not(None))
+        .group_by(models.MovimientoBodega.proyecto_id, models.MovimientoBodega.insumo_id)
+        .subquery()
+    )
+    stock = models.StockActual.__table__
+    diferencias = db.execute(
+        select(func.count())
+        .select_from(
+            libro.join(
+                stock,
+                and_(stock.c.proyecto_id == libro.c.proyecto_id, stock.c.insumo_id == libro.c.insumo_id),
+                full=True,
+            )
+        )
+        .where(func.abs(func.coalesce(libro.c.cantidad, 0.0) - func.coalesce(stock.c.cantidad, 0.0)) > 1e-6)
+    ).scalar_one()
+
+    db.execute(delete(models.StockActual))
+    db.execute(
+        insert(models.StockActual).from_select(
+            ["proyecto_id", "insumo_id", "cantidad", "actualizado_en"],
+            select(libro.c.proyecto_id, libro.c.insumo_id, libro.c.cantidad, func.now()),
+        )
+    )
+    filas = db.query(func.count()).select_from(models.StockActual).scalar() or 0
+    db.commit()
+    return {"status": "ok", "filas": int(filas), "diferencias_corregidas": int(diferencias or 0)}
@@ -0,0 +1,230 @@
+"""Cola de trabajos en segundo plano (in-process).
+
+Los endpoints largos (inyección de matriz, APU preciso, análisis total) pueden
+encolar su trabajo aquí y responder de inmediato con un `job_id`. El progreso
+se consulta con `GET /jobs/{job_id}`.
+
+- Los trabajos corren en un pool de hilos acotado (JOBS_MAX_WORKERS, default 2).
+- El estado se guarda en la tabla `jobs` para que cualquier réplica pueda
+  responder el polling. Si la BD no está disponible (o JOBS_PERSISTIR=false),
+  el estado vive solo en memoria de este proceso (modo local).
+"""
+
+from __future__ import annotations
+
+import datetime
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from sqlalchemy.orm import Session
+
+from backend import models
+from backend.database import SessionLocal
+
+
+_logger = logging.getLogger("uvicorn.error")
+
+# Firma de la función de progreso que recibe cada trabajo:
+#   reportar(completados, total, parcial)
+ReportarProgreso = Callable[[int, int, "dict[str, Any] | None"], None]
+FuncionJob = Callable[[Session, ReportarProgreso], dict[str, Any]]
+
+_lock = threading.Lock()
+_executor: ThreadPoolExecutor | None = None
+_jobs_locales: dict[str, dict[str, Any]] = {}
+# Un lock por job serializa las escrituras en BD (los callbacks de progreso llegan
+# desde varios hilos a la vez) y garantiza que siempre se guarde el estado más reciente.
+_locks_persistencia: dict[str, threading.Lock] = {}
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, str(default)).strip().strip('"').strip("'")
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser un entero") from exc
+
+
+def _persistir_habilitado() -> bool:
+    return os.getenv("JOBS_PERSISTIR", "true").strip().lower() not in {"0", "false", "no"}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, _env_int("JOBS_MAX_WORKERS", 2)),
+                thread_name_prefix="jobs",
+            )
+        return _executor
+
+
+def _serializar(estado: dict[str, Any]) -> dict[str, Any]:
+    out = dict(estado)
+    for key in ("creado_en", "actualizado_en"):
+        value = out.get(key)
+        if isinstance(value, datetime.datetime):
+            out[key] = value.isoformat()
+    return out
+
+
+def _guardar_en_bd(estado: dict[str, Any]) -> bool:
+    """Upsert best-effort del estado del job. Nunca interrumpe al trabajo.
+
+    Retorna False si el job debe seguir solo en memoria local.
+    """
+
+    if not estado.get("persistido"):
+        return False
+
+    db = SessionLocal()
+    try:
+        job = db.get(models.Job, uuid.UUID(estado["job_id"]))
+        if job is None:
+            job = models.Job(id=uuid.UUID(estado["job_id"]), tipo=estado["tipo"])
+            db.add(job)
+        job.estado = estado["estado"]
+        job.completados = estado["completados"]
+        job.total = estado["total"]
+        job.parametros = estado["parametros"]
+        job.parciales = estado["parciales"]
+        job.resultado = estado["resultado"]
+        job.error = (estado["error"] or None) and str(estado["error"])[:1000]
+        job.creado_en = estado["creado_en"]
+        job.actualizado_en = estado["actualizado_en"]
+        db.commit()
+        return True
+    except Exception as exc:
+        db.rollback()
+        # Fallback a modo local: el polling seguirá funcionando en esta réplica.
+        _logger.warning("Job %s sin persistencia en BD: %s", estado["job_id"], exc)
+        return False
+    finally:
+        db.close()
+
+
+def _snapshot(job_id: str) -> dict[str, Any]:
+    with _lock:
+        estado = _jobs_locales[job_id]
+        snapshot = dict(estado)
+        snapshot["parciales"] = list(estado["parciales"])
+    return snapshot
+
+
+def _actualizar(job_id: str, **cambios: Any) -> None:
+    with _lock:
+        estado = _jobs_locales[job_id]
+        estado.update(cambios)
+        estado["actualizado_en"] = datetime.datetime.utcnow()
+        lock_job = _locks_persistencia.setdefault(job_id, threading.Lock())
+
+    with lock_job:
+        snapshot = _snapshot(job_id)
+        if snapshot["persistido"] and not _guardar_en_bd(snapshot):
+            with _lock:
+                _jobs_locales[job_id]["persistido"] = False
+
+
+def _purgar_jobs_locales() -> None:
+    limite = datetime.datetime.utcnow() - datetime.timedelta(hours=_env_int("JOBS_RETENCION_HORAS", 24))
+    with _lock:
+        for job_id in [
+            k
+            for k, v in _jobs_locales.items()
+            if v["estado"] in {"completado", "fallido"} and v["actualizado_en"] < limite
+        ]:
+            _jobs_locales.pop(job_id, None)
+            _locks_persistencia.pop(job_id, None)
+
+
+def _ejecutar(job_id: str, funcion: FuncionJob) -> None:
+    _actualizar(job_id, estado="en_proceso")
+
+    def reportar(completados: int, total: int, parcial: dict[str, Any] | None = None) -> None:
+        with _lock:
+            parciales = _jobs_locales[job_id]["parciales"]
+            if parcial is not None:
+                parciales.append(parcial)
+        _actualizar(job_id, completados=int(completados), total=int(total))
+
+    db = SessionLocal()
+    try:
+        resultado = funcion(db, reportar)
+        _actualizar(job_id, estado="completado", resultado=resultado)
+    except Exception as exc:
+        db.rollback()
+        # HTTPException (endpoints reutilizados como job) trae el mensaje en `detail`.
+        mensaje = str(getattr(exc, "detail", None) or exc)
+        _logger.error("Job %s falló: %s", job_id, mensaje)
+        _actualizar(job_id, estado="fallido", error=mensaje)
+    finally:
+        db.close()
+
+
+def encolar_job(tipo: str, parametros: dict[str, Any], funcion: FuncionJob) -> str:
+    """Registra y encola un trabajo. Retorna el `job_id` de inmediato.
+
+    `funcion(db, reportar)` recibe una sesión propia (no la del request) y debe
+    retornar un dict JSON-serializable con el resultado final.
+    """
+
+    _purgar_jobs_locales()
+
+    job_id = str(uuid.uuid4())
+    ahora = datetime.datetime.utcnow()
+    estado: dict[str, Any] = {
+        "job_id": job_id,
+        "tipo": tipo,
+        "estado": "pendiente",
+        "completados": 0,
+        "total": 0,
+        "parametros": parametros,
+        "parciales": [],
+        "resultado": None,
+        "error": None,
+        "creado_en": ahora,
+        "actualizado_en": ahora,
+        "persistido": _persistir_habilitado(),
+    }
+    if estado["persistido"]:
+        estado["persistido"] = _guardar_en_bd(dict(estado))
+    with _lock:
+        _jobs_locales[job_id] = estado
+
+    _get_executor().submit(_ejecutar, job_id, funcion)
+    return job_id
+
+
+def obtener_job(db: Session, job_id: uuid.UUID) -> dict[str, Any] | None:
+    """Estado actual del job: memoria local primero, luego la tabla `jobs`."""
+
+    with _lock:
+        local = str(job_id) in _jobs_locales
+    if local:
+        snapshot = _snapshot(str(job_id))
+        snapshot.pop("persistido", None)
+        return _serializar(snapshot)
+
+    job = db.get(models.Job, job_id)
+    if job is None:
+        return None
+    return _serializar(
+        {
+            "job_id": str(job.id),
+            "tipo": job.tipo,
+            "estado": job.estado,
+            "completados": int(job.completados or 0),
+            "total": int(job.total or 0),
+            "parametros": job.parametros,
+            "parciales": job.parciales or [],
+            "resultado": job.resultado,
+            "error": job.error,
+            "creado_en": job.creado_en,
+            "actualizado_en": job.actualizado_en,
+        }
+    )
@@ -1,39 +1,68 @@
-from fastapi import Body, FastAPI, Depends, HTTPException, Request, UploadFile, File, Form, Header
+from fastapi import Body, FastAPI, Depends, HTTPException, Request, Response, UploadFile, File, Form, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.staticfiles import StaticFiles
 from fastapi_utils.tasks import repeat_every
-from sqlalchemy import case, func
+from sqlalchemy import func, or_
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 import os
 import datetime
 import uuid
 import pathlib
 import logging
-import shutil
-from backend.database import SessionLocal, engine, get_db
+from typing import Literal
+from backend.database import SessionLocal, dispose_async_engine, engine, get_async_db, get_db, metricas_pool
 from backend.ia_auditor import (
     calcular_consumo_materiales_por_avance,
-    obtener_teorico_disponible,
+    contar_alertas_criticas,
+    verificar_desviacion_portafolio,
     verificar_desviacion_presupuesto,
 )
-from backend.planilla_service import calcular_pago_semanal
+from backend.planilla_service import cerrar_planilla
+from backend.asistencia_service import registrar_asistencias
+from backend.pdf_render_service import cerrar_pool_render, renderizar_lote, renderizar_pdf, renderizar_pdf_bytes
+from backend.presupuesto_service import (
+    disponibles_por_insumo,
+    huella_presupuesto,
+    recalcular_totales_presupuesto,
+    sumar_comprado,
+)
+from backend.inventario_service import reconciliar_stock, registrar_movimientos, resumen_libro, resumen_stock
 from pydantic import BaseModel, Field, AliasChoices
 from backend.ia_apu import generar_composicion_apu_ia, generar_apu_preciso_con_cantidades
 from backend.ia_service import consultar_precios_ia, generar_analisis_total
-from backend.apu_service import crear_renglon_y_composicion_desde_apu_json
+from backend.ia_cliente import cerrar_clientes
+from backend.apu_service import crear_renglon_y_composicion_desde_apu_json, inyectar_matriz_y_generar_apus
 from backend.schemas import (
     APUResponse,
     InsumoBase,
     ItemCompra,
     UserCreate,
+    AsistenciaBatchRequest,
     AsistenciaGPSRequest,
     OrdenCompraEstadoUpdate,
     GastoPersonalCreate,
     Proyecto as ProyectoSchema,
 )
+from backend.jobs_service import encolar_job, obtener_job
+from backend.utils.paginacion import Orden, codificar_cursor, decodificar_cursor, paginar, parse_orden
 from backend.finanzas_service import calcular_balance_vida_negocio, calcular_estado_financiero_proyecto
-from backend.auth import RoleChecker, create_access_token, get_current_user, hash_password, verify_password
+from backend.auth import (
+    RoleChecker,
+    UsuarioActual,
+    cerrar_pool_hash,
+    claims_de_usuario,
+    create_access_token,
+    get_current_user,
+    get_current_user_async,
+    hash_password,
+    invalidar_usuario,
+    necesita_rehash,
+    verify_password,
+)
 from backend import models
 
 app = FastAPI()
@@ -43,10 +72,13 @@ app = FastAPI()
 def health_check():
     return {"status": "ok"}
 from backend import models
-from backend.utils.pdf_gen import generar_pdf_presupuesto, generar_pdf_presupuesto_profesional
+from backend.utils import pdf_cache
+from backend.utils.pdf_gen import _safe_name
+from backend.utils import subidas
+from backend.utils.uploads import ArchivoDemasiadoGrande, FotoGuardada, cerrar_pool_uploads, guardar_foto, tamano_maximo
 from backend.utils.normas import calcular_insumos_por_renglon, calcular_insumos_por_renglon_detallado
 from backend.utils.matriz_maestra import obtener_matriz_renglones_maestra
-from backend.utils.csv_import import procesar_csv_maestro
+from backend.utils.csv_import import cerrar_pool_validacion, procesar_csv_maestro
 from backend.whatsapp_service import enviar_resumen_diario
 
 
@@ -97,12 +129,15 @@ class AnalisisTotalRequest(BaseModel):
     salario_minimo_mensual_gtq: float | None = Field(default=None, ge=0)
     factor_transporte_regional: float | None = Field(default=None, ge=0)
     fecha_referencia: str | None = None
+    # False fuerza una consulta nueva al LLM (ignora ia_cache).
+    usar_cache: bool = True
 
 
 class InyectarMatrizMaestraRequest(BaseModel):
     departamento: str = Field(..., min_length=1)
     # cantidad base por renglón: se usa como "1 unidad" para generar rendimientos y costos unitarios.
     cantidad_base: float = Field(default=1.0, gt=0)
+    usar_cache: bool = True
 
 
 _uploads_dir = pathlib.Path(__file__).resolve().parent / "uploads"
@@ -114,6 +149,22 @@ except Exception as exc:
     # The API should still start even if uploads are unavailable.
     logging.getLogger("uvicorn.error").warning("Uploads disabled: %s", exc)
 
+
+async def _guardar_foto_o_413(foto, nombre_por_defecto: str) -> FotoGuardada:
+    if not getattr(foto, "filename", None):
+        foto.filename = nombre_por_defecto
+    try:
+        return await guardar_foto(foto, _uploads_dir)
+    except ArchivoDemasiadoGrande as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+
+
+def _url_absoluta(base: str, url: str | None) -> str | None:
+    if isinstance(url, str) and url.startswith("/"):
+        return f"{base}{url}"
+    return url
+
+
 @app.on_event("startup")
 def _startup_init_db():
     try:
@@ -124,6 +175,36 @@ def _startup_init_db():
         logging.getLogger("uvicorn.error").error("DB init failed: %s", exc)
 
 
+@app.on_event("shutdown")
+def _shutdown_cerrar_clientes_ia():
+    cerrar_clientes()
+
+
+@app.on_event("shutdown")
+def _shutdown_pool_render_pdf():
+    cerrar_pool_render()
+
+
+@app.on_event("shutdown")
+def _shutdown_pool_uploads():
+    cerrar_pool_uploads()
+
+
+@app.on_event("shutdown")
+def _shutdown_pool_validacion_csv():
+    cerrar_pool_validacion()
+
+
+@app.on_event("shutdown")
+def _shutdown_pool_hash():
+    cerrar_pool_hash()
+
+
+@app.on_event("shutdown")
+async def _shutdown_motor_async():
+    await dispose_async_engine()
+
+
 @app.on_event("startup")
 @repeat_every(seconds=60 * 60 * 24)
 def reporte_automatico_whatsapp() -> None:
@@ -136,15 +217,7 @@ def reporte_automatico_whatsapp() -> None:
     try:
         # 1) Lógica mínima para obtener datos del día
         # Nota: por ahora calcula cuántas obras tienen alerta crítica de sobrecosto.
-        proyectos = db.query(models.Proyecto).all()
-        alertas_criticas = 0
-        for p in proyectos:
-            try:
-                res = verificar_desviacion_presupuesto(db, p.id)
-                if res.get("alerta_critica"):
-                    alertas_criticas += 1
-            except Exception:
-                continue
+        alertas_criticas = contar_alertas_criticas(db)
 
         datos = {
             "nombre_dueno": os.getenv("NOMBRE_DUENO", ""),
@@ -164,6 +237,34 @@ def reporte_automatico_whatsapp() -> None:
         db.close()
 
 
+def _stock_reconciliacion_segundos() -> int:
+    raw = os.getenv("STOCK_RECONCILIACION_HORAS", "24").strip().strip('"').strip("'")
+    try:
+        horas = float(raw)
+    except ValueError as exc:
+        raise RuntimeError("STOCK_RECONCILIACION_HORAS debe ser numérico") from exc
+    return max(60, int(horas * 60 * 60))
+
+
+@app.on_event("startup")
+@repeat_every(seconds=_stock_reconciliacion_segundos())
+def reconciliar_stock_periodico() -> None:
+    # Igual que el reporte de WhatsApp: deshabilitado por defecto para no
+    # correrlo en cada réplica. Alternativa: POST /inventario/reconciliar desde un cron.
+    if os.getenv("ENABLE_STOCK_RECONCILIACION", "false").lower() not in {"1", "true", "yes"}:
+        return
+
+    db = SessionLocal()
+    try:
+        res = reconciliar_stock(db)
+        logging.getLogger("uvicorn.error").info("Stock reconciliado: %s", res)
+    except Exception as exc:
+        db.rollback()
+        logging.getLogger("uvicorn.error").error("Stock reconciliation failed: %s", exc)
+    finally:
+        db.close()
+
+
 def _require_whatsapp_cron_token(x_cron_token: str | None) -> None:
     expected = os.getenv("WHATSAPP_CRON_TOKEN")
     if not expected:
@@ -184,15 +285,7 @@ def cron_whatsapp_resumen_diario(
 
     db = SessionLocal()
     try:
-        proyectos = db.query(models.Proyecto).all()
-        alertas_criticas = 0
-        for p in proyectos:
-            try:
-                res = verificar_desviacion_presupuesto(db, p.id)
-                if res.get("alerta_critica"):
-                    alertas_criticas += 1
-            except Exception:
-                continue
+        alertas_criticas = contar_alertas_criticas(db)
 
         datos = {
             "nombre_dueno": os.getenv("NOMBRE_DUENO", ""),
@@ -216,6 +309,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginación por keyset de los endpoints que retornan listas.
+    expose_headers=["X-Next-Cursor"],
 )
 
 
@@ -246,8 +341,35 @@ def apu_normas_insumos(payload: NormasInsumosRequest):
     }
 
 
+def _respuesta_job_encolado(request: Request, tipo: str, parametros: dict, funcion) -> JSONResponse:
+    job_id = encolar_job(tipo, parametros, funcion)
+    base = str(request.base_url).rstrip("/")
+    return JSONResponse(
+        status_code=202,
+        content={"status": "encolado", "job_id": job_id, "url": f"{base}/jobs/{job_id}"},
+    )
+
+
+@app.get("/jobs/{job_id}")
+def consultar_job(job_id: uuid.UUID, db: Session = Depends(get_db)):
+    """Progreso y resultados (parciales o finales) de un trabajo en segundo plano."""
+
+    job = obtener_job(db, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job no encontrado")
+    return job
+
+
 @app.post("/ia/analisis-total")
-def ia_analisis_total(payload: AnalisisTotalRequest):
+def ia_analisis_total(payload: AnalisisTotalRequest, request: Request, asincrono: bool = False):
+    if asincrono:
+        return _respuesta_job_encolado(
+            request,
+            "analisis_total",
+            payload.model_dump(mode="json"),
+            lambda job_db, reportar: ia_analisis_total(payload=payload, request=request),
+        )
+
     data = generar_analisis_total(
         payload.renglon,
         payload.cantidad,
@@ -255,6 +377,7 @@ def ia_analisis_total(payload: AnalisisTotalRequest):
         salario_minimo_mensual_gtq=payload.salario_minimo_mensual_gtq,
         factor_transporte_regional=payload.factor_transporte_regional,
         fecha_referencia=payload.fecha_referencia,
+        usar_cache=payload.usar_cache,
     )
     return {"status": "ok", "data": data}
 
@@ -271,6 +394,8 @@ def matriz_renglones_maestra():
 def inyectar_matriz_maestra_y_generar_apus(
     proyecto_id: uuid.UUID,
     payload: InyectarMatrizMaestraRequest,
+    request: Request,
+    asincrono: bool = False,
     db: Session = Depends(get_db),
 ):
     """Inyecta TODA la Matriz Maestra y genera APUs.
@@ -279,7 +404,9 @@ def inyectar_matriz_maestra_y_generar_apus(
     - Si la calculadora técnica tiene regla para el renglón -> APU preciso (cantidades + IA precios/MO)
     - Si no hay regla aún -> fallback a APU IA estándar para no detener el proceso
 
-    Nota: esto puede hacer muchas llamadas a IA (costo/tiempo).
+    Nota: esto puede hacer muchas llamadas a IA (costo/tiempo). Se ejecutan en
+    paralelo (IA_MAX_CONCURRENCIA) y se guardan en una sola transacción.
+    Con `?asincrono=true` se encola como job y responde 202 con `job_id`.
     """
 
     proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
@@ -290,83 +417,40 @@ def inyectar_matriz_maestra_y_generar_apus(
     if not items:
         raise HTTPException(status_code=500, detail="Matriz maestra vacía")
 
-    ok: list[dict[str, str]] = []
-    fallos: list[dict[str, str]] = []
-
-    for it in items:
-        fase = str(it.get("fase") or "").strip()
-        renglon_base = str(it.get("renglon") or "").strip()
-        unidad_hint = str(it.get("unidad") or "").strip()
-
-        if not renglon_base:
-            continue
-
-        nombre_renglon = f"{fase} - {renglon_base}" if fase else renglon_base
-
-        try:
-            unidad_calc, detalles = calcular_insumos_por_renglon_detallado(
-                nombre_renglon=renglon_base,
-                cantidad_total=float(payload.cantidad_base),
-            )
-
-            # Unidad final: prioridad a calculadora, luego matriz.
-            unidad_final = (unidad_calc or "").strip() or (unidad_hint or "").strip() or "u"
-
-            if detalles:
-                apu = generar_apu_preciso_con_cantidades(
-                    nombre_renglon=nombre_renglon,
-                    departamento=payload.departamento,
-                    unidad_renglon=unidad_final,
-                    insumos_materiales=detalles,
-                )
-                fuente = "preciso"
-            else:
-                # Fallback controlado: si aún no hay regla matemática, usar IA estándar.
-                apu = generar_composicion_apu_ia(nombre_renglon=nombre_renglon, departamento=payload.departamento)
-                # Forzar unidad del renglón si vino por matriz.
-                if isinstance(apu, dict) and unidad_final:
-                    apu["unidad"] = unidad_final
-                fuente = "ia"
-
-            renglon_db, composiciones = crear_renglon_y_composicion_desde_apu_json(
-                db,
+    if asincrono:
+        return _respuesta_job_encolado(
+            request,
+            "inyectar_matriz_y_apus",
+            {"proyecto_id": str(proyecto_id), **payload.model_dump(mode="json")},
+            lambda job_db, reportar: inyectar_matriz_y_generar_apus(
+                job_db,
                 proyecto_id=proyecto_id,
-                nombre_renglon=nombre_renglon,
-                cantidad_total=float(payload.cantidad_base),
-                apu=apu,
-            )
-            db.commit()
-
-            ok.append(
-                {
-                    "renglon_id": str(renglon_db.id),
-                    "renglon": nombre_renglon,
-                    "fuente": fuente,
-                }
-            )
-        except Exception as exc:
-            db.rollback()
-            fallos.append(
-                {
-                    "renglon": nombre_renglon,
-                    "error": str(exc),
-                }
-            )
+                items=items,
+                departamento=payload.departamento,
+                cantidad_base=float(payload.cantidad_base),
+                usar_cache=payload.usar_cache,
+                al_progresar=reportar,
+            ),
+        )
 
-    return {
-        "status": "ok" if not fallos else "partial",
-        "proyecto_id": str(proyecto_id),
-        "generados": len(ok),
-        "fallidos": len(fallos),
-        "detalle_ok": ok,
-        "detalle_fallos": fallos,
-    }
+    try:
+        return inyectar_matriz_y_generar_apus(
+            db,
+            proyecto_id=proyecto_id,
+            items=items,
+            departamento=payload.departamento,
+            cantidad_base=float(payload.cantidad_base),
+            usar_cache=payload.usar_cache,
+        )
+    except Exception as exc:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(exc))
 
 
 @app.post("/notificaciones/resumen-diario/whatsapp")
 def notificar_resumen_diario_whatsapp(
     payload: ResumenDiarioWhatsAppRequest,
-    user: models.Usuario = Depends(get_current_user),
+    user: UsuarioActual = Depends(get_current_user),
 ):
     try:
         sid = enviar_resumen_diario(payload.model_dump())
@@ -376,12 +460,76 @@ def notificar_resumen_diario_whatsapp(
     except Exception as exc:
         raise HTTPException(status_code=500, detail=f"Error enviando WhatsApp: {exc}")
 
+_ORDEN_GASTOS = {
+    "fecha": models.GastoPersonal.fecha,
+    "monto": models.GastoPersonal.monto,
+    "categoria": models.GastoPersonal.categoria,
+}
+
+
+def _filtrar_gastos(
+    q,
+    *,
+    categoria: str | None,
+    desde: datetime.datetime | None,
+    hasta: datetime.datetime | None,
+):
+    if categoria:
+        q = q.filter(models.GastoPersonal.categoria == categoria)
+    if desde is not None:
+        q = q.filter(models.GastoPersonal.fecha >= desde)
+    if hasta is not None:
+        q = q.filter(models.GastoPersonal.fecha <= hasta)
+    return q
+
+
+def _paginar_o_400(query, *, orden: str, permitidos: dict, id_col, limit: int, cursor: str | None):
+    try:
+        return paginar(
+            query,
+            orden=parse_orden(orden, permitidos),
+            id_col=id_col,
+            limit=limit,
+            cursor=cursor,
+        )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
 @app.get("/finanzas/resumen")
-def get_finanzas(db: Session = Depends(get_db)):
-    gastos = db.query(models.GastoPersonal).all()
-    total = sum(g.monto for g in gastos)
+def get_finanzas(
+    db: Session = Depends(get_db),
+    user: UsuarioActual = Depends(get_current_user),
+    usuario_id: uuid.UUID | None = None,
+    categoria: str | None = None,
+    desde: datetime.datetime | None = None,
+    hasta: datetime.datetime | None = None,
+    orden: str = "-fecha",
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
+):
+    """Gastos paginados; `total_gastos` es la suma (SQL) de todo el filtro, no solo de la página.
+
+    Solo un admin puede ver los gastos de otro usuario (o de todos, sin `usuario_id`);
+    los demás ven siempre los propios.
+    """
+
+    if (user.rol or "") != "admin":
+        if usuario_id is not None and usuario_id != user.id:
+            raise HTTPException(status_code=403, detail="No tienes permisos suficientes para esta acción")
+        usuario_id = user.id
+
+    q = _filtrar_gastos(db.query(models.GastoPersonal), categoria=categoria, desde=desde, hasta=hasta)
+    if usuario_id is not None:
+        q = q.filter(models.GastoPersonal.usuario_id == usuario_id)
+
+    total = q.with_entities(func.coalesce(func.sum(models.GastoPersonal.monto), 0.0)).scalar()
+    gastos, next_cursor = _paginar_o_400(
+        q, orden=orden, permitidos=_ORDEN_GASTOS, id_col=models.GastoPersonal.id, limit=limit, cursor=cursor
+    )
     return {
         "total_gastos": float(total or 0),
+        "next_cursor": next_cursor,
         "lista": [
             {
                 "id": str(g.id),
@@ -398,19 +546,29 @@ def get_finanzas(db: Session = Depends(get_db)):
 @app.get("/finanzas-personales/resumen")
 def get_resumen_personal(
     db: Session = Depends(get_db),
-    user: models.Usuario = Depends(get_current_user),
+    user: UsuarioActual = Depends(get_current_user),
+    categoria: str | None = None,
+    desde: datetime.datetime | None = None,
+    hasta: datetime.datetime | None = None,
+    orden: str = "-fecha",
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
 ):
-    gastos = (
-        db.query(models.GastoPersonal)
-        .filter(models.GastoPersonal.usuario_id == user.id)
-        .order_by(models.GastoPersonal.fecha.desc())
-        .all()
+    q = _filtrar_gastos(
+        db.query(models.GastoPersonal).filter(models.GastoPersonal.usuario_id == user.id),
+        categoria=categoria,
+        desde=desde,
+        hasta=hasta,
+    )
+    total = q.with_entities(func.coalesce(func.sum(models.GastoPersonal.monto), 0.0)).scalar()
+    gastos, next_cursor = _paginar_o_400(
+        q, orden=orden, permitidos=_ORDEN_GASTOS, id_col=models.GastoPersonal.id, limit=limit, cursor=cursor
     )
-    total = sum(float(g.monto or 0) for g in gastos)
 
     return {
         "ingresos": 0.0,
-        "total_gastos": total,
+        "total_gastos": float(total or 0),
+        "next_cursor": next_cursor,
         "gastos_lista": [
             {
                 "id": str(g.id),
@@ -428,7 +586,7 @@ def get_resumen_personal(
 def crear_gasto_personal(
     payload: GastoPersonalCreate,
     db: Session = Depends(get_db),
-    user: models.Usuario = Depends(get_current_user),
+    user: UsuarioActual = Depends(get_current_user),
 ):
     gasto = models.GastoPersonal(
         usuario_id=user.id,
@@ -447,95 +605,203 @@ def crear_gasto_personal(
 def registrar_gasto_personal(
     payload: GastoPersonalCreate,
     db: Session = Depends(get_db),
-    user: models.Usuario = Depends(get_current_user),
+    user: UsuarioActual = Depends(get_current_user),
 ):
     return crear_gasto_personal(payload=payload, db=db, user=user)
 
 
 @app.get("/proyectos")
-def leer_proyectos(db: Session = Depends(get_db), user: models.Usuario = Depends(get_current_user)) -> list[ProyectoSchema]:
-    return db.query(models.Proyecto).all()
+async def leer_proyectos(
+    response: Response,
+    db: AsyncSession = Depends(get_async_db),
+    user: UsuarioActual = Depends(get_current_user_async),
+    q: str | None = None,
+    departamento: str | None = None,
+    orden: str = "nombre",
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: str | None = None,
+) -> list[ProyectoSchema]:
+    """Lista paginada; la siguiente página viene en el header `X-Next-Cursor`."""
+
+    def _listar(sync_db: Session):
+        query = sync_db.query(models.Proyecto)
+        if q:
+            query = query.filter(models.Proyecto.nombre_proyecto.ilike(f"%{q.strip()}%"))
+        if departamento:
+            query = query.filter(models.Proyecto.departamento == departamento)
+
+        return _paginar_o_400(
+            query,
+            orden=orden,
+            permitidos={"nombre": models.Proyecto.nombre_proyecto, "departamento": models.Proyecto.departamento},
+            id_col=models.Proyecto.id,
+            limit=limit,
+            cursor=cursor,
+        )
+
+    proyectos, next_cursor = await db.run_sync(_listar)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return proyectos
 
 
 @app.get("/inventario/resumen")
-def inventario_resumen(
-    db: Session = Depends(get_db),
+async def inventario_resumen(
+    db: AsyncSession = Depends(get_async_db),
     proyecto_id: uuid.UUID | None = None,
+    snapshot: bool = False,
 ):
     """Resumen de inventario (ENTRADA - SALIDA) por insumo.
 
     Opcional: filtrar por `proyecto_id`.
+    `snapshot=true` lee el saldo materializado (`stock_actual`) en vez de
+    re-sumar `movimientos_bodega`; su costo no crece con el libro.
     """
 
-    signed_qty = case(
-        (models.MovimientoBodega.tipo_movimiento == "ENTRADA", models.MovimientoBodega.cantidad),
-        else_=-models.MovimientoBodega.cantidad,
-    )
+    return await db.run_sync(resumen_stock if snapshot else resumen_libro, proyecto_id)
 
-    q = (
-        db.query(
-            models.InsumoMaestro.id.label("id"),
-            models.InsumoMaestro.descripcion.label("descripcion"),
-            models.InsumoMaestro.unidad_compra.label("unidad"),
-            func.coalesce(func.sum(signed_qty), 0.0).label("cantidad"),
-        )
-        .join(models.MovimientoBodega, models.MovimientoBodega.insumo_id == models.InsumoMaestro.id)
-    )
 
-    if proyecto_id is not None:
-        q = q.filter(models.MovimientoBodega.proyecto_id == proyecto_id)
+@app.get("/health/db-pool", dependencies=[Depends(RoleChecker(["admin"]))])
+def health_db_pool():
+    """Checkouts, esperas y conexiones de los pools de BD de esta réplica."""
 
-    q = q.group_by(
-        models.InsumoMaestro.id,
-        models.InsumoMaestro.descripcion,
-        models.InsumoMaestro.unidad_compra,
-    ).order_by(models.InsumoMaestro.descripcion.asc())
+    return metricas_pool()
 
-    rows = q.all()
-    return [
-        {
-            "id": str(r.id),
-            "descripcion": r.descripcion,
-            "unidad": r.unidad,
-            "cantidad": float(r.cantidad or 0),
-        }
-        for r in rows
-    ]
 
+@app.post("/inventario/reconciliar", dependencies=[Depends(RoleChecker(["admin"]))])
+def inventario_reconciliar(db: Session = Depends(get_db)):
+    """Recalcula `stock_actual` desde `movimientos_bodega`."""
 
-@app.get("/proyectos/{proyecto_id}/presupuesto/pdf")
-def generar_pdf_presupuesto_proyecto(
-    proyecto_id: uuid.UUID,
-    request: Request,
-    db: Session = Depends(get_db),
-):
-    proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
-    if proyecto is None:
-        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    try:
+        return reconciliar_stock(db)
+    except Exception as exc:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+@app.post("/presupuesto/totales/recalcular", dependencies=[Depends(RoleChecker(["admin"]))])
+def presupuesto_totales_recalcular(proyecto_id: uuid.UUID | None = None, db: Session = Depends(get_db)):
+    """Reconstruye `presupuesto_insumo_totales` (todo o un proyecto) desde renglones/APU y OCs."""
+
+    try:
+        resultado = recalcular_totales_presupuesto(db, proyecto_id)
+        db.commit()
+        return resultado
+    except Exception as exc:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
+_pdf_cache_dir = _uploads_dir / "pdf"
+
+# Prefijo del nombre de archivo por plantilla (llaves de pdf_cache.VERSION_PLANTILLA).
+_PREFIJOS_PDF = {
+    "presupuesto": "PRESUPUESTO",
+    "presupuesto_profesional": "Informe_Presupuesto",
+}
 
+
+def _datos_pdf_presupuesto(db: Session, proyecto: models.Proyecto, fecha: str) -> dict:
     renglones = (
         db.query(models.PresupuestoRenglon)
-        .filter(models.PresupuestoRenglon.proyecto_id == proyecto_id)
-        .order_by(models.PresupuestoRenglon.descripcion.asc())
+        .filter(models.PresupuestoRenglon.proyecto_id == proyecto.id)
+        .order_by(models.PresupuestoRenglon.descripcion.asc(), models.PresupuestoRenglon.id.asc())
         .all()
     )
-
-    datos = {
+    return {
         "nombre": getattr(proyecto, "nombre_proyecto", "Proyecto"),
         "departamento": getattr(proyecto, "departamento", ""),
+        "fecha": fecha,
         "renglones": [
             {
                 "descripcion": r.descripcion,
-                "total": float((r.cantidad_total or 0) * (r.costo_unitario_ia or 0)),
+                "unidad": getattr(r, "unidad_medida", ""),
+                "cantidad": float(getattr(r, "cantidad_total", 0) or 0),
+                "precio_unitario": float(getattr(r, "costo_unitario_ia", 0) or 0),
+                "total": float((getattr(r, "cantidad_total", 0) or 0) * (getattr(r, "costo_unitario_ia", 0) or 0)),
             }
             for r in renglones
         ],
     }
 
-    pdf_path = pathlib.Path(generar_pdf_presupuesto(datos, output_dir=_uploads_dir))
+
+def _clave_pdf_presupuesto(plantilla: str, proyecto_id: uuid.UUID, db: Session):
+    """(proyecto, fecha, clave, nombre) del PDF; la llave es el hash de los renglones
+    (una consulta agregada), los datos del proyecto, la fecha de emisión y la
+    versión de la plantilla."""
+
+    proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
+    if proyecto is None:
+        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+
+    fecha = datetime.datetime.utcnow().date().isoformat()
+    clave = pdf_cache.clave(
+        plantilla,
+        str(proyecto.id),
+        proyecto.nombre_proyecto,
+        proyecto.departamento,
+        fecha,
+        huella_presupuesto(db, proyecto_id),
+    )
+    nombre = f"{_PREFIJOS_PDF[plantilla]}_{_safe_name(proyecto.nombre_proyecto)}_{clave[:16]}.pdf"
+    return proyecto, fecha, clave, nombre
+
+
+def _pdf_presupuesto_cacheado(plantilla: str, proyecto_id: uuid.UUID, request: Request, db: Session):
+    """Sirve el PDF cacheado si los renglones no cambiaron; si no, lo genera una vez
+    en el pool de render."""
+
+    proyecto, fecha, clave, nombre = _clave_pdf_presupuesto(plantilla, proyecto_id, db)
+    etag = pdf_cache.etag(clave)
     base = str(request.base_url).rstrip("/")
-    url = f"{base}/uploads/{pdf_path.name}"
-    return {"status": "ok", "filename": pdf_path.name, "url": url}
+    url = f"{base}/uploads/{_pdf_cache_dir.name}/{nombre}"
+    cabeceras = {"ETag": etag, "Cache-Control": "private, no-cache"}
+
+    if pdf_cache.etag_coincide(request.headers.get("if-none-match"), etag) and (_pdf_cache_dir / nombre).exists():
+        return Response(status_code=304, headers=cabeceras)
+
+    _ruta, acierto = pdf_cache.obtener_o_generar(
+        _pdf_cache_dir,
+        nombre,
+        lambda tmp: renderizar_pdf(plantilla, _datos_pdf_presupuesto(db, proyecto, fecha), output_dir=tmp),
+    )
+    return JSONResponse(
+        {"status": "ok", "filename": nombre, "url": url, "cache": "hit" if acierto else "miss"},
+        headers=cabeceras,
+    )
+
+
+def _pdf_presupuesto_stream(plantilla: str, proyecto_id: uuid.UUID, request: Request, db: Session):
+    """Genera el PDF en memoria (en el pool de render) y lo envía en la misma
+    respuesta, sin escribir en uploads ni un segundo request."""
+
+    proyecto, fecha, clave, nombre = _clave_pdf_presupuesto(plantilla, proyecto_id, db)
+    etag = pdf_cache.etag(clave)
+    cabeceras = {
+        "ETag": etag,
+        "Cache-Control": "private, no-cache",
+        "Content-Disposition": f'attachment; filename="{nombre}"',
+    }
+    if pdf_cache.etag_coincide(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=cabeceras)
+
+    contenido = memoryview(renderizar_pdf_bytes(plantilla, _datos_pdf_presupuesto(db, proyecto, fecha)))
+    cabeceras["Content-Length"] = str(len(contenido))
+
+    def _chunks():
+        for i in range(0, len(contenido), 64 * 1024):
+            yield bytes(contenido[i : i + 64 * 1024])
+
+    return StreamingResponse(_chunks(), media_type="application/pdf", headers=cabeceras)
+
+
+@app.get("/proyectos/{proyecto_id}/presupuesto/pdf")
+def generar_pdf_presupuesto_proyecto(
+    proyecto_id: uuid.UUID,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    return _pdf_presupuesto_cacheado("presupuesto", proyecto_id, request, db)
 
 
 @app.get("/proyectos/{proyecto_id}/presupuesto/pdf-profesional")
@@ -544,37 +810,93 @@ def generar_pdf_presupuesto_proyecto_profesional(
     request: Request,
     db: Session = Depends(get_db),
 ):
-    proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
-    if proyecto is None:
-        raise HTTPException(status_code=404, detail="Proyecto no encontrado")
+    return _pdf_presupuesto_cacheado("presupuesto_profesional", proyecto_id, request, db)
 
-    renglones = (
-        db.query(models.PresupuestoRenglon)
-        .filter(models.PresupuestoRenglon.proyecto_id == proyecto_id)
-        .order_by(models.PresupuestoRenglon.descripcion.asc())
-        .all()
-    )
 
-    datos = {
-        "nombre": getattr(proyecto, "nombre_proyecto", "Proyecto"),
-        "departamento": getattr(proyecto, "departamento", ""),
-        "fecha": datetime.datetime.utcnow().date().isoformat(),
-        "renglones": [
-            {
-                "descripcion": r.descripcion,
-                "unidad": getattr(r, "unidad_medida", ""),
-                "cantidad": float(getattr(r, "cantidad_total", 0) or 0),
-                "precio_unitario": float(getattr(r, "costo_unitario_ia", 0) or 0),
-                "total": float((getattr(r, "cantidad_total", 0) or 0) * (getattr(r, "costo_unitario_ia", 0) or 0)),
-            }
-            for r in renglones
-        ],
-    }
+@app.get("/proyectos/{proyecto_id}/presupuesto/pdf/descargar")
+def descargar_pdf_presupuesto_proyecto(
+    proyecto_id: uuid.UUID,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    return _pdf_presupuesto_stream("presupuesto", proyecto_id, request, db)
+
+
+@app.get("/proyectos/{proyecto_id}/presupuesto/pdf-profesional/descargar")
+def descargar_pdf_presupuesto_proyecto_profesional(
+    proyecto_id: uuid.UUID,
+    request: Request,
+    db: Session = Depends(get_db),
+):
+    return _pdf_presupuesto_stream("presupuesto_profesional", proyecto_id, request, db)
+
+
+class PdfLoteRequest(BaseModel):
+    # None = todos los proyectos.
+    proyecto_ids: list[uuid.UUID] | None = Field(default=None, max_length=5000)
+    plantilla: Literal["presupuesto", "presupuesto_profesional"] = "presupuesto_profesional"
+
+
+@app.post("/presupuesto/pdf/lote", dependencies=[Depends(RoleChecker(["admin"]))])
+def generar_pdfs_presupuesto_lote(payload: PdfLoteRequest, request: Request):
+    """Genera en segundo plano el PDF de muchos proyectos (paquete de fin de mes).
+
+    Responde 202 con un `job_id`; cada PDF terminado aparece en `parciales`
+    con su URL. Los PDFs sin cambios se toman del caché.
+    """
 
-    pdf_path = pathlib.Path(generar_pdf_presupuesto_profesional(datos, output_dir=_uploads_dir))
     base = str(request.base_url).rstrip("/")
-    url = f"{base}/uploads/{pdf_path.name}"
-    return {"status": "ok", "filename": pdf_path.name, "url": url}
+    plantilla = payload.plantilla
+    parametros = {
+        "plantilla": plantilla,
+        "proyecto_ids": [str(p) for p in payload.proyecto_ids] if payload.proyecto_ids is not None else None,
+    }
+
+    def _job(db: Session, reportar):
+        if payload.proyecto_ids is not None:
+            ids = list(dict.fromkeys(payload.proyecto_ids))
+        else:
+            ids = list(db.scalars(select(models.Proyecto.id).order_by(models.Proyecto.nombre_proyecto)))
+
+        def _cargar_datos(proyecto_id: uuid.UUID, fecha: str) -> dict:
+            # Corre en un hilo del lote con su propia sesión, y solo para los PDFs
+            # que no están en caché: en memoria quedan los renglones de los
+            # documentos en curso, no los de todo el lote.
+            with SessionLocal() as sesion:
+                proyecto = sesion.get(models.Proyecto, proyecto_id)
+                if proyecto is None:
+                    raise ValueError("Proyecto no encontrado")
+                return _datos_pdf_presupuesto(sesion, proyecto, fecha)
+
+        trabajos = []
+        errores = []
+        for proyecto_id in ids:
+            try:
+                proyecto, fecha, _clave, nombre = _clave_pdf_presupuesto(plantilla, proyecto_id, db)
+            except HTTPException as exc:
+                errores.append({"proyecto_id": str(proyecto_id), "estado": "error", "detalle": exc.detail})
+                continue
+            trabajos.append(
+                {
+                    "proyecto_id": proyecto_id,
+                    "plantilla": plantilla,
+                    "nombre": nombre,
+                    "datos": lambda p=proyecto.id, f=fecha: _cargar_datos(p, f),
+                }
+            )
+
+        resultados = renderizar_lote(_pdf_cache_dir, trabajos, reportar) + errores
+        for r in resultados:
+            if r["estado"] == "ok":
+                r["url"] = f"{base}/uploads/{_pdf_cache_dir.name}/{r['filename']}"
+        return {
+            "total": len(resultados),
+            "ok": sum(1 for r in resultados if r["estado"] == "ok"),
+            "errores": sum(1 for r in resultados if r["estado"] == "error"),
+            "resultados": resultados,
+        }
+
+    return _respuesta_job_encolado(request, "pdf_lote", parametros, _job)
 
 
 @app.get("/proyectos/{proyecto_id}/fotos")
@@ -597,14 +919,15 @@ def listar_fotos_bitacora(
     base = str(request.base_url).rstrip("/")
     out: list[dict[str, object]] = []
     for f in filas:
-        url = getattr(f, "url_foto", None)
-        if isinstance(url, str) and url.startswith("/"):
-            url = f"{base}{url}"
+        url = _url_absoluta(base, getattr(f, "url_foto", None))
         out.append(
             {
                 "id": str(f.id),
                 "proyecto_id": str(f.proyecto_id) if f.proyecto_id else None,
                 "url_foto": url,
+                # Galerías: mostrar la miniatura y abrir url_webp/url_foto al tocarla.
+                "url_thumbnail": _url_absoluta(base, f.url_thumbnail) or url,
+                "url_webp": _url_absoluta(base, f.url_webp),
                 "comentario": getattr(f, "comentario", None),
                 "fecha_registro": f.fecha_registro.isoformat() if f.fecha_registro else None,
             }
@@ -614,49 +937,45 @@ def listar_fotos_bitacora(
 
 
 @app.post("/proyectos/{proyecto_id}/fotos")
-def subir_foto_bitacora(
+async def subir_foto_bitacora(
     proyecto_id: uuid.UUID,
     request: Request,
     foto: UploadFile = File(...),
     comentario: str | None = Form(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
-    if proyecto is None:
+    if await db.scalar(select(models.Proyecto.id).where(models.Proyecto.id == proyecto_id)) is None:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
 
-    filename = foto.filename or "bitacora.jpg"
-    suffix = pathlib.Path(filename).suffix or ".jpg"
-    safe_name = f"{uuid.uuid4().hex}{suffix}"
-    out_path = _uploads_dir / safe_name
-
+    guardada = await _guardar_foto_o_413(foto, "bitacora.jpg")
     try:
-        with out_path.open("wb") as f:
-            shutil.copyfileobj(foto.file, f)
-
-        rel_url = f"/uploads/{safe_name}"
         registro = models.FotoBitacora(
             proyecto_id=proyecto_id,
-            url_foto=rel_url,
+            url_foto=guardada.url,
+            url_thumbnail=guardada.url_thumbnail,
+            url_webp=guardada.url_webp,
+            sha256=guardada.sha256,
             comentario=str(comentario) if comentario not in (None, "") else None,
         )
         db.add(registro)
-        db.commit()
-        db.refresh(registro)
+        await db.commit()
     except Exception as exc:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
 
     base = str(request.base_url).rstrip("/")
     return {
         "status": "ok",
         "id": str(registro.id),
-        "url_foto": f"{base}{rel_url}",
+        "url_foto": _url_absoluta(base, guardada.url),
+        "url_thumbnail": _url_absoluta(base, guardada.url_thumbnail),
+        "url_webp": _url_absoluta(base, guardada.url_webp),
+        "duplicada": guardada.duplicada,
         "fecha_registro": registro.fecha_registro.isoformat() if registro.fecha_registro else None,
     }
 
 @app.post("/proyectos")
-def crear_proyecto(nombre: str, depto: str, db: Session = Depends(get_db), user: models.Usuario = Depends(get_current_user)):
+def crear_proyecto(nombre: str, depto: str, db: Session = Depends(get_db), user: UsuarioActual = Depends(get_current_user)):
     if not nombre or not nombre.strip():
         raise HTTPException(status_code=400, detail="El nombre del proyecto es obligatorio.")
     if not depto or not depto.strip():
@@ -678,19 +997,52 @@ def reportar_avance(renglon_id: uuid.UUID, cantidad: float, db: Session = Depend
     
     # 2. Lógica Inteligente: Descontar materiales de bodega según el APU
     composicion = db.query(models.APUComposicion).filter_by(renglon_id=renglon_id).all()
-    for item in composicion:
-        descuento = item.rendimiento * cantidad
-        mov = models.MovimientoBodega(
-            insumo_id=item.insumo_id,
-            proyecto_id=renglon.proyecto_id,
-            tipo_movimiento="SALIDA",
-            cantidad=descuento
-        )
-        db.add(mov)
-    
+    registrar_movimientos(
+        db,
+        [
+            {
+                "insumo_id": item.insumo_id,
+                "proyecto_id": renglon.proyecto_id,
+                "tipo_movimiento": "SALIDA",
+                "cantidad": item.rendimiento * cantidad,
+            }
+            for item in composicion
+        ],
+    )
+
     db.commit()
     return {"status": "Avance y materiales actualizados"}
 
+@app.get("/proyectos/alertas")
+def obtener_alertas_portafolio(
+    solo_alertas: bool = False,
+    cursor: str | None = None,
+    limit: int = Query(default=50, ge=1, le=500),
+    db: Session = Depends(get_db),
+    user: UsuarioActual = Depends(get_current_user),
+):
+    """Auditoría de presupuesto de todos los proyectos (una consulta por página).
+
+    Paginación por keyset: pasar `next_cursor` de la respuesta como `cursor`.
+    """
+
+    orden = Orden("proyecto_id", models.Proyecto.id)
+    despues_de = None
+    if cursor:
+        try:
+            _valor, despues_de = decodificar_cursor(cursor, orden, models.Proyecto.id)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+
+    data = verificar_desviacion_portafolio(db, solo_alertas=solo_alertas, despues_de=despues_de, limit=limit + 1)
+    next_cursor = None
+    if len(data) > limit:
+        data = data[:limit]
+        ultimo = data[-1]["proyecto_id"]
+        next_cursor = codificar_cursor(orden, ultimo, ultimo)
+    return {"data": data, "next_cursor": next_cursor}
+
+
 @app.get("/proyectos/{proyecto_id}/alertas")
 def obtener_alertas_proyecto(proyecto_id: str, db: Session = Depends(get_db)):
     try:
@@ -706,18 +1058,21 @@ class GenerarAPURequest(BaseModel):
     nombre_renglon: str = Field(min_length=1)
     departamento: str = Field(min_length=1)
     cantidad: float = Field(gt=0, validation_alias=AliasChoices("cantidad", "cantidad_total"))
+    usar_cache: bool = True
 
 
 class GenerarAPUCompatRequest(BaseModel):
     nombre_renglon: str = Field(min_length=1)
     departamento: str = Field(min_length=1)
     cantidad: float = Field(default=1.0, gt=0)
+    usar_cache: bool = True
 
 
 class GenerarAPUPrecisoRequest(BaseModel):
     nombre_renglon: str = Field(min_length=1)
     departamento: str = Field(min_length=1)
     cantidad: float = Field(gt=0, validation_alias=AliasChoices("cantidad", "cantidad_total"))
+    usar_cache: bool = True
 
 
 class ReportarAvanceObraRequest(BaseModel):
@@ -729,9 +1084,22 @@ class ReportarAvanceObraRequest(BaseModel):
     fotos: list[str] = Field(default_factory=list)
 
 
+class CrearSubidaRequest(BaseModel):
+    tamano_total: int = Field(gt=0)
+    nombre: str | None = Field(default=None, max_length=200)
+
+
+class FinalizarSubidaRequest(BaseModel):
+    reporte_id: uuid.UUID
+
+
 @app.post("/apu/generar", response_model=APUResponse)
 def generar_apu_preview(payload: GenerarAPURequest):
-    apu = generar_composicion_apu_ia(payload.nombre_renglon, payload.departamento)
+    apu = generar_composicion_apu_ia(
+        payload.nombre_renglon,
+        payload.departamento,
+        usar_cache=payload.usar_cache,
+    )
     insumos = [
         InsumoBase(
             nombre=i["nombre"],
@@ -754,9 +1122,25 @@ def generar_apu_preview(payload: GenerarAPURequest):
 def generar_apu_y_guardar(
     proyecto_id: uuid.UUID,
     payload: GenerarAPURequest,
+    request: Request,
+    asincrono: bool = False,
     db: Session = Depends(get_db),
 ):
-    apu = generar_composicion_apu_ia(payload.nombre_renglon, payload.departamento)
+    if asincrono:
+        return _respuesta_job_encolado(
+            request,
+            "generar_apu",
+            {"proyecto_id": str(proyecto_id), **payload.model_dump(mode="json")},
+            lambda job_db, reportar: generar_apu_y_guardar(
+                proyecto_id=proyecto_id, payload=payload, request=request, db=job_db
+            ),
+        )
+
+    apu = generar_composicion_apu_ia(
+        payload.nombre_renglon,
+        payload.departamento,
+        usar_cache=payload.usar_cache,
+    )
     renglon, composiciones = crear_renglon_y_composicion_desde_apu_json(
         db,
         proyecto_id=proyecto_id,
@@ -779,6 +1163,7 @@ def generar_apu_inteligente(
     proyecto_id: uuid.UUID,
     request: Request,
     payload: GenerarAPUCompatRequest | None = Body(default=None),
+    asincrono: bool = False,
     db: Session = Depends(get_db),
 ):
     """Compat: endpoint del snippet reutilizando nuestra lógica.
@@ -786,14 +1171,27 @@ def generar_apu_inteligente(
     Soporta:
     - JSON body: { nombre_renglon, departamento, cantidad? }
     - Query params (fallback): ?nombre_renglon=...&departamento=...&cantidad=...
+    - ?asincrono=true: encola el trabajo y responde 202 con `job_id`
     """
 
+    if asincrono:
+        parametros = payload.model_dump(mode="json") if payload is not None else dict(request.query_params)
+        return _respuesta_job_encolado(
+            request,
+            "generar_apu_compat",
+            {"proyecto_id": str(proyecto_id), **parametros},
+            lambda job_db, reportar: generar_apu_inteligente(
+                proyecto_id=proyecto_id, request=request, payload=payload, db=job_db
+            ),
+        )
+
     try:
         if payload is None:
             nombre_renglon = (request.query_params.get("nombre_renglon") or "").strip()
             departamento = (request.query_params.get("departamento") or "").strip()
             cantidad_q = request.query_params.get("cantidad")
             cantidad = float(cantidad_q) if cantidad_q else 1.0
+            usar_cache = (request.query_params.get("usar_cache") or "true").lower() not in {"0", "false", "no"}
             if not nombre_renglon or not departamento:
                 raise HTTPException(
                     status_code=422,
@@ -805,8 +1203,9 @@ def generar_apu_inteligente(
             nombre_renglon = payload.nombre_renglon
             departamento = payload.departamento
             cantidad = float(payload.cantidad)
+            usar_cache = payload.usar_cache
 
-        datos_ia = consultar_precios_ia(nombre_renglon, departamento)
+        datos_ia = consultar_precios_ia(nombre_renglon, departamento, usar_cache=usar_cache)
 
         apu = {
             "unidad": datos_ia.get("unidad_medida", ""),
@@ -821,6 +1220,7 @@ def generar_apu_inteligente(
                 for i in (datos_ia.get("insumos") or [])
                 if isinstance(i, dict)
             ],
+            "sondeo_ia": datos_ia.get("sondeo_ia"),
         }
 
         renglon, composiciones = crear_renglon_y_composicion_desde_apu_json(
@@ -847,6 +1247,8 @@ def generar_apu_inteligente(
 def generar_apu_con_calculadora(
     proyecto_id: uuid.UUID,
     payload: GenerarAPUPrecisoRequest,
+    request: Request,
+    asincrono: bool = False,
     db: Session = Depends(get_db),
 ):
     """Genera APU usando calculadora (normas) + IA para precios y mano de obra.
@@ -854,12 +1256,23 @@ def generar_apu_con_calculadora(
     - Calcula cantidades físicas (normas)
     - Pide a IA precios regionales y mano de obra
     - Guarda renglón + composición en BD
+    - ?asincrono=true: encola el trabajo y responde 202 con `job_id`
     """
 
     proyecto = db.query(models.Proyecto).filter(models.Proyecto.id == proyecto_id).first()
     if proyecto is None:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
 
+    if asincrono:
+        return _respuesta_job_encolado(
+            request,
+            "generar_apu_preciso",
+            {"proyecto_id": str(proyecto_id), **payload.model_dump(mode="json")},
+            lambda job_db, reportar: generar_apu_con_calculadora(
+                proyecto_id=proyecto_id, payload=payload, request=request, db=job_db
+            ),
+        )
+
     try:
         unidad_renglon, detalles = calcular_insumos_por_renglon_detallado(
             payload.nombre_renglon,
@@ -871,6 +1284,7 @@ def generar_apu_con_calculadora(
             departamento=payload.departamento,
             unidad_renglon=unidad_renglon,
             insumos_materiales=detalles,
+            usar_cache=payload.usar_cache,
         )
 
         renglon, composiciones = crear_renglon_y_composicion_desde_apu_json(
@@ -903,7 +1317,11 @@ def inyectar_renglon_ia(
     db: Session = Depends(get_db),
 ):
     try:
-        apu = generar_composicion_apu_ia(payload.nombre_renglon, payload.departamento)
+        apu = generar_composicion_apu_ia(
+            payload.nombre_renglon,
+            payload.departamento,
+            usar_cache=payload.usar_cache,
+        )
         crear_renglon_y_composicion_desde_apu_json(
             db,
             proyecto_id=proyecto_id,
@@ -939,26 +1357,32 @@ def crear_orden_compra(
     proyecto_id: uuid.UUID,
     items: list[ItemCompra],
     db: Session = Depends(get_db),
-    user: models.Usuario = Depends(get_current_user),
+    user: UsuarioActual = Depends(get_current_user),
 ):
-    nueva_oc = models.OrdenCompra(proyecto_id=proyecto_id)
-    db.add(nueva_oc)
-    db.flush()
-
-    total_acumulado_oc = 0.0
-
+    # Toda la orden se valida con un SELECT ... FOR UPDATE sobre el índice de
+    # disponibilidad: una OC concurrente del mismo insumo espera a esta.
+    pedido: dict[uuid.UUID, float] = {}
     for item in items:
-        disponible = obtener_teorico_disponible(db, proyecto_id, item.insumo_id)
-        if item.cantidad > disponible:
+        pedido[item.insumo_id] = pedido.get(item.insumo_id, 0.0) + float(item.cantidad)
+    disponibles = disponibles_por_insumo(db, proyecto_id, list(pedido), bloquear=True)
+
+    for insumo_id, cantidad in pedido.items():
+        disponible = disponibles.get(insumo_id, 0.0)
+        if cantidad > disponible:
             db.rollback()
             raise HTTPException(
                 status_code=400,
                 detail=(
-                    f"Exceso de material: El insumo {item.insumo_id} solo tiene "
+                    f"Exceso de material: El insumo {insumo_id} solo tiene "
                     f"{disponible} unidades disponibles en presupuesto."
                 ),
             )
 
+    nueva_oc = models.OrdenCompra(id=uuid.uuid4(), proyecto_id=proyecto_id)
+    db.add(nueva_oc)
+
+    total_acumulado_oc = 0.0
+    for item in items:
         subtotal = float(item.cantidad) * float(item.precio_pactado)
         detalle = models.DetalleOrdenCompra(
             oc_id=nueva_oc.id,
@@ -971,12 +1395,17 @@ def crear_orden_compra(
         db.add(detalle)
 
     nueva_oc.total_oc = total_acumulado_oc
+    sumar_comprado(db, {(proyecto_id, insumo_id): cantidad for insumo_id, cantidad in pedido.items()})
     db.commit()
     return {"status": "Orden de Compra creada exitosamente", "oc_id": str(nueva_oc.id)}
 
 
 @app.post("/campo/reportar-avance")
-async def reportar_avance_obra(request: Request, db: Session = Depends(get_db), user: models.Usuario = Depends(get_current_user)):
+async def reportar_avance_obra(
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    user: UsuarioActual = Depends(get_current_user_async),
+):
     content_type = (request.headers.get("content-type") or "").lower()
 
     if content_type.startswith("multipart/form-data"):
@@ -998,18 +1427,12 @@ async def reportar_avance_obra(request: Request, db: Session = Depends(get_db),
         lon_raw = form.get("lon") or form.get("longitud")
         lat = float(lat_raw) if lat_raw not in (None, "") else None
         lon = float(lon_raw) if lon_raw not in (None, "") else None
-        fotos_urls: list[str] = []
+        fotos: list[FotoGuardada | str] = []
 
         foto = form.get("foto")
-        if foto is not None:
+        if foto is not None and not isinstance(foto, str):
             # Starlette returns UploadFile for file inputs
-            filename = getattr(foto, "filename", None) or "evidencia.jpg"
-            suffix = pathlib.Path(filename).suffix or ".jpg"
-            safe_name = f"{uuid.uuid4().hex}{suffix}"
-            out_path = _uploads_dir / safe_name
-            with out_path.open("wb") as f:
-                shutil.copyfileobj(foto.file, f)
-            fotos_urls.append(f"/uploads/{safe_name}")
+            fotos.append(await _guardar_foto_o_413(foto, "evidencia.jpg"))
 
     else:
         body = await request.json()
@@ -1023,22 +1446,15 @@ async def reportar_avance_obra(request: Request, db: Session = Depends(get_db),
         lat = payload.lat
         lon = payload.lon
         comentario = payload.comentario
-        fotos_urls = list(payload.fotos)
+        fotos = list(payload.fotos)
 
-    renglon = (
-        db.query(models.PresupuestoRenglon)
-        .filter(models.PresupuestoRenglon.id == renglon_id)
-        .first()
+    proyecto_id = await db.scalar(
+        select(models.PresupuestoRenglon.proyecto_id).where(models.PresupuestoRenglon.id == renglon_id)
     )
-    if renglon is None:
+    if proyecto_id is None:
         raise HTTPException(status_code=404, detail="Renglón no encontrado")
 
-    proyecto = (
-        db.query(models.Proyecto)
-        .filter(models.Proyecto.id == renglon.proyecto_id)
-        .first()
-    )
-    if proyecto is None:
+    if await db.scalar(select(models.Proyecto.id).where(models.Proyecto.id == proyecto_id)) is None:
         raise HTTPException(status_code=404, detail="Proyecto no encontrado")
 
     nuevo_reporte = models.ReporteAvance(
@@ -1049,50 +1465,220 @@ async def reportar_avance_obra(request: Request, db: Session = Depends(get_db),
         comentario=str(comentario) if comentario not in (None, "") else None,
     )
     db.add(nuevo_reporte)
-    db.flush()
-
-    for url in fotos_urls:
-        foto = models.FotoEvidencia(reporte_id=nuevo_reporte.id, url_foto=str(url))
-        db.add(foto)
+    await db.flush()
+
+    for f in fotos:
+        if isinstance(f, FotoGuardada):
+            db.add(
+                models.FotoEvidencia(
+                    reporte_id=nuevo_reporte.id,
+                    url_foto=f.url,
+                    url_thumbnail=f.url_thumbnail,
+                    url_webp=f.url_webp,
+                    sha256=f.sha256,
+                )
+            )
+        else:
+            db.add(models.FotoEvidencia(reporte_id=nuevo_reporte.id, url_foto=str(f)))
 
-    consumo = calcular_consumo_materiales_por_avance(db, renglon_id, float(cantidad))
+    consumo = await db.run_sync(calcular_consumo_materiales_por_avance, renglon_id, float(cantidad))
 
-    db.commit()
+    await db.commit()
 
     return {
         "status": "Avance registrado",
+        # Para adjuntar fotos luego con POST /campo/subidas/{id}/finalizar.
+        "reporte_id": str(nuevo_reporte.id),
         "consumo_estimado": consumo,
         "advertencia_gps": False,
     }
 
 
-@app.post("/campo/asistencia")
-def registrar_asistencia_gps(payload: AsistenciaGPSRequest, db: Session = Depends(get_db)):
-    trabajador = (
-        db.query(models.Trabajador)
-        .filter(models.Trabajador.id == payload.trabajador_id)
-        .first()
-    )
-    if trabajador is None:
-        raise HTTPException(status_code=404, detail="Trabajador no encontrado")
-
-    registro = models.RegistroAsistencia(
-        trabajador_id=payload.trabajador_id,
-        fecha=payload.fecha,
-        entrada=payload.fecha,
-        gps_check=True,
-        latitud_gps=float(payload.latitud),
-        longitud_gps=float(payload.longitud),
+def _subidas_dir() -> pathlib.Path:
+    raw = os.getenv("UPLOAD_STAGING_DIR", "").strip().strip('"').strip("'")
+    # Fuera de uploads/: las partes no deben quedar servidas por /uploads.
+    return pathlib.Path(raw) if raw else _uploads_dir.parent / "uploads_staging"
+
+
+_TUS_HEADERS = {"Tus-Resumable": "1.0.0", "Cache-Control": "no-store"}
+
+
+async def _subida_propia(subida_id: uuid.UUID, user: UsuarioActual) -> subidas.EstadoSubida:
+    try:
+        return await subidas.estado(_subidas_dir(), str(subida_id), usuario=user.username)
+    except subidas.SubidaNoEncontrada:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+
+
+@app.post("/campo/subidas", status_code=201)
+async def crear_subida_evidencia(
+    payload: CrearSubidaRequest,
+    request: Request,
+    response: Response,
+    user: UsuarioActual = Depends(get_current_user_async),
+):
+    """Abre una subida reanudable (tus). Luego: PATCH con `Upload-Offset`,
+    HEAD/GET para saber desde dónde seguir y POST .../finalizar."""
+
+    try:
+        estado = await subidas.crear_subida(
+            _subidas_dir(),
+            payload.tamano_total,
+            max_bytes=tamano_maximo(),
+            nombre=payload.nombre,
+            usuario=user.username,
+        )
+    except subidas.SubidaExcedida as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+
+    url = f"{str(request.base_url).rstrip('/')}/campo/subidas/{estado.id}"
+    response.headers.update({**_TUS_HEADERS, "Location": url, "Upload-Offset": "0"})
+    return {"subida_id": estado.id, "offset": 0, "tamano_total": estado.tamano_total, "url": url}
+
+
+@app.head("/campo/subidas/{subida_id}")
+async def offset_subida_evidencia(subida_id: uuid.UUID, user: UsuarioActual = Depends(get_current_user_async)):
+    estado = await _subida_propia(subida_id, user)
+    return Response(
+        status_code=200,
+        headers={**_TUS_HEADERS, "Upload-Offset": str(estado.offset), "Upload-Length": str(estado.tamano_total)},
     )
 
+
+@app.get("/campo/subidas/{subida_id}")
+async def estado_subida_evidencia(
+    subida_id: uuid.UUID,
+    response: Response,
+    user: UsuarioActual = Depends(get_current_user_async),
+):
+    estado = await _subida_propia(subida_id, user)
+    response.headers.update({**_TUS_HEADERS, "Upload-Offset": str(estado.offset)})
+    return {
+        "subida_id": estado.id,
+        "offset": estado.offset,
+        "tamano_total": estado.tamano_total,
+        "completa": estado.completa,
+    }
+
+
+@app.patch("/campo/subidas/{subida_id}")
+async def anexar_subida_evidencia(
+    subida_id: uuid.UUID,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset", ge=0),
+    user: UsuarioActual = Depends(get_current_user_async),
+):
+    """Agrega el cuerpo (bytes crudos) en `Upload-Offset`. Si no coincide con lo
+    recibido responde 409 con el offset correcto en `Upload-Offset`."""
+
+    await _subida_propia(subida_id, user)
     try:
-        db.add(registro)
-        db.commit()
+        estado = await subidas.anexar(_subidas_dir(), str(subida_id), upload_offset, request.stream())
+    except subidas.SubidaNoEncontrada:
+        raise HTTPException(status_code=404, detail="Subida no encontrada")
+    except subidas.OffsetInvalido as exc:
+        raise HTTPException(
+            status_code=409,
+            detail=str(exc),
+            headers={**_TUS_HEADERS, "Upload-Offset": str(exc.offset_actual)},
+        )
+    except subidas.SubidaExcedida as exc:
+        raise HTTPException(status_code=413, detail=str(exc))
+
+    return Response(status_code=204, headers={**_TUS_HEADERS, "Upload-Offset": str(estado.offset)})
+
+
+@app.post("/campo/subidas/{subida_id}/finalizar")
+async def finalizar_subida_evidencia(
+    subida_id: uuid.UUID,
+    payload: FinalizarSubidaRequest,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    user: UsuarioActual = Depends(get_current_user_async),
+):
+    """Con la subida completa, guarda la foto (hash, dedup, variantes) y la
+    adjunta como evidencia del `ReporteAvance`."""
+
+    estado = await _subida_propia(subida_id, user)
+    if await db.scalar(select(models.ReporteAvance.id).where(models.ReporteAvance.id == payload.reporte_id)) is None:
+        raise HTTPException(status_code=404, detail="Reporte de avance no encontrado")
+
+    try:
+        async with await subidas.abrir_completa(_subidas_dir(), estado.id) as archivo:
+            guardada = await _guardar_foto_o_413(archivo, "evidencia.jpg")
+    except subidas.SubidaIncompleta as exc:
+        raise HTTPException(
+            status_code=409,
+            detail=str(exc),
+            headers={**_TUS_HEADERS, "Upload-Offset": str(estado.offset)},
+        )
+
+    try:
+        foto = models.FotoEvidencia(
+            reporte_id=payload.reporte_id,
+            url_foto=guardada.url,
+            url_thumbnail=guardada.url_thumbnail,
+            url_webp=guardada.url_webp,
+            sha256=guardada.sha256,
+        )
+        db.add(foto)
+        await db.commit()
     except Exception as exc:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
 
-    return {"status": "ok", "asistencia_id": str(registro.id)}
+    await subidas.descartar(_subidas_dir(), estado.id)
+    base = str(request.base_url).rstrip("/")
+    return {
+        "status": "ok",
+        "foto_id": str(foto.id),
+        "reporte_id": str(payload.reporte_id),
+        "url_foto": _url_absoluta(base, guardada.url),
+        "url_thumbnail": _url_absoluta(base, guardada.url_thumbnail),
+        "url_webp": _url_absoluta(base, guardada.url_webp),
+        "sha256": guardada.sha256,
+    }
+
+
+@app.post("/campo/asistencia")
+async def registrar_asistencia_gps(payload: AsistenciaGPSRequest, db: AsyncSession = Depends(get_async_db)):
+    try:
+        (resultado,) = await db.run_sync(registrar_asistencias, [payload])
+        await db.commit()
+    except Exception as exc:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    if resultado["estado"] == "error":
+        raise HTTPException(status_code=404, detail=resultado["detalle"])
+    return {"status": "ok", "asistencia_id": resultado["asistencia_id"]}
+
+
+@app.post("/campo/asistencia/batch")
+async def registrar_asistencia_gps_lote(payload: AsistenciaBatchRequest, db: AsyncSession = Depends(get_async_db)):
+    """Sincroniza varios registros (p.ej. un día offline) en una transacción.
+
+    Cada registro puede traer `idempotency_key`: reenviar el lote no duplica,
+    los ya recibidos vuelven como "duplicado" con su `asistencia_id`.
+    """
+
+    try:
+        resultados = await db.run_sync(registrar_asistencias, payload.registros)
+        await db.commit()
+    except Exception as exc:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    conteo = {"creado": 0, "duplicado": 0, "error": 0}
+    for r in resultados:
+        conteo[r["estado"]] += 1
+    return {
+        "status": "ok",
+        "creados": conteo["creado"],
+        "duplicados": conteo["duplicado"],
+        "errores": conteo["error"],
+        "resultados": resultados,
+    }
 
 
 @app.get("/campo/evidencias/{proyecto_id}")
@@ -1118,9 +1704,7 @@ def listar_evidencias_proyecto(
 
     reportes: list[dict[str, object]] = []
     for foto, rep in filas:
-        url = getattr(foto, "url_foto", None)
-        if isinstance(url, str) and url.startswith("/"):
-            url = f"{base}{url}"
+        url = _url_absoluta(base, getattr(foto, "url_foto", None))
 
         reportes.append(
             {
@@ -1131,6 +1715,8 @@ def listar_evidencias_proyecto(
                 "latitud_gps": rep.latitud_gps,
                 "longitud_gps": rep.longitud_gps,
                 "url_foto": url,
+                "url_thumbnail": _url_absoluta(base, foto.url_thumbnail) or url,
+                "url_webp": _url_absoluta(base, foto.url_webp),
             }
         )
 
@@ -1138,14 +1724,34 @@ def listar_evidencias_proyecto(
 
 
 @app.get("/compras/pendientes-aprobacion")
-def compras_pendientes_aprobacion(db: Session = Depends(get_db)):
-    filas = (
+def compras_pendientes_aprobacion(
+    response: Response,
+    db: Session = Depends(get_db),
+    proyecto_id: uuid.UUID | None = None,
+    orden: str = "-fecha_emision",
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
+):
+    """Lista paginada; la siguiente página viene en el header `X-Next-Cursor`."""
+
+    query = (
         db.query(models.OrdenCompra, models.Proyecto)
         .join(models.Proyecto, models.OrdenCompra.proyecto_id == models.Proyecto.id)
         .filter(models.OrdenCompra.estado == "pendiente")
-        .order_by(models.OrdenCompra.fecha_emision.desc())
-        .all()
     )
+    if proyecto_id is not None:
+        query = query.filter(models.OrdenCompra.proyecto_id == proyecto_id)
+
+    filas, next_cursor = _paginar_o_400(
+        query,
+        orden=orden,
+        permitidos={"fecha_emision": models.OrdenCompra.fecha_emision, "total": models.OrdenCompra.total_oc},
+        id_col=models.OrdenCompra.id,
+        limit=limit,
+        cursor=cursor,
+    )
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
 
     return [
         {
@@ -1191,47 +1797,54 @@ def actualizar_estado_orden_compra(
 
 @app.post("/finanzas/cerrar-planilla/{proyecto_id}")
 def cerrar_planilla_semanal(proyecto_id: uuid.UUID, db: Session = Depends(get_db)):
-    trabajadores = (
-        db.query(models.Trabajador)
-        .filter(models.Trabajador.proyecto_actual_id == proyecto_id)
-        .all()
-    )
-
     fecha_fin = datetime.datetime.utcnow()
     fecha_inicio = fecha_fin - datetime.timedelta(days=7)
 
-    planillas_generadas: list[dict[str, object]] = []
-
     try:
-        for t in trabajadores:
-            monto = calcular_pago_semanal(db, t.id, fecha_inicio, fecha_fin)
+        detalle = cerrar_planilla(db, fecha_inicio, fecha_fin, proyecto_id)
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
 
-            nueva_planilla = models.PagoPlanilla(
-                trabajador_id=t.id,
-                proyecto_id=proyecto_id,
-                fecha_inicio=fecha_inicio,
-                fecha_fin=fecha_fin,
-                monto_total=float(monto),
-            )
-            db.add(nueva_planilla)
-            planillas_generadas.append(
-                {
-                    "trabajador": t.nombre_completo,
-                    "monto_a_pagar": float(monto),
-                    "tipo": str(t.tipo_pago),
-                }
-            )
+    planillas_generadas = [
+        {"trabajador": d["trabajador"], "monto_a_pagar": d["monto_a_pagar"], "tipo": d["tipo"]}
+        for d in detalle
+    ]
+    return {"status": "Planilla calculada", "detalle": planillas_generadas}
 
+
+@app.post("/finanzas/cerrar-planilla", dependencies=[Depends(RoleChecker(["admin"]))])
+def cerrar_planilla_semanal_todos(db: Session = Depends(get_db)):
+    """Cierra la semana de todos los proyectos en una transacción."""
+
+    fecha_fin = datetime.datetime.utcnow()
+    fecha_inicio = fecha_fin - datetime.timedelta(days=7)
+
+    try:
+        detalle = cerrar_planilla(db, fecha_inicio, fecha_fin)
         db.commit()
     except Exception as exc:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
 
-    return {"status": "Planilla calculada", "detalle": planillas_generadas}
+    return {
+        "status": "Planilla calculada",
+        "proyectos": len({d["proyecto_id"] for d in detalle}),
+        "trabajadores": len(detalle),
+        "total": sum(d["monto_a_pagar"] for d in detalle),
+        "detalle": detalle,
+    }
 
 
 @app.post("/auth/register")
 def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
+    # Validar unicidad de username y email (antes de pagar el hash)
+    if db.query(models.Usuario).filter(models.Usuario.username == user.username).first():
+        raise HTTPException(status_code=409, detail="El nombre de usuario ya existe")
+    if db.query(models.Usuario).filter(models.Usuario.email == user.email).first():
+        raise HTTPException(status_code=409, detail="El email ya existe")
+
     hashed = hash_password(user.password)
     nuevo_usuario = models.Usuario(
         username=user.username,
@@ -1242,13 +1855,6 @@ def registrar_usuario(user: UserCreate, db: Session = Depends(get_db)):
         is_approved=False,
     )
 
-
-    # Validar unicidad de username y email
-    if db.query(models.Usuario).filter(models.Usuario.username == user.username).first():
-        raise HTTPException(status_code=409, detail="El nombre de usuario ya existe")
-    if db.query(models.Usuario).filter(models.Usuario.email == user.email).first():
-        raise HTTPException(status_code=409, detail="El email ya existe")
-
     try:
         db.add(nuevo_usuario)
         db.commit()
@@ -1301,15 +1907,31 @@ def bootstrap_admin(
 
 
 @app.get("/auth/admin/users/pending", dependencies=[Depends(RoleChecker(["admin"]))])
-def listar_usuarios_pendientes(db: Session = Depends(get_db)):
-    pending = (
-        db.query(models.Usuario)
-        .filter(models.Usuario.is_approved == False)  # noqa: E712
-        .order_by(models.Usuario.creado_en.asc())
-        .all()
+def listar_usuarios_pendientes(
+    db: Session = Depends(get_db),
+    q: str | None = None,
+    orden: str = "creado_en",
+    limit: int = Query(default=50, ge=1, le=500),
+    cursor: str | None = None,
+):
+    query = db.query(models.Usuario).filter(models.Usuario.is_approved == False)  # noqa: E712
+    if q:
+        patron = f"%{q.strip()}%"
+        query = query.filter(
+            or_(models.Usuario.username.ilike(patron), models.Usuario.email.ilike(patron))
+        )
+
+    pending, next_cursor = _paginar_o_400(
+        query,
+        orden=orden,
+        permitidos={"creado_en": models.Usuario.creado_en, "username": models.Usuario.username},
+        id_col=models.Usuario.id,
+        limit=limit,
+        cursor=cursor,
     )
     return {
         "status": "ok",
+        "next_cursor": next_cursor,
         "items": [
             {
                 "id": str(u.id),
@@ -1328,7 +1950,7 @@ def listar_usuarios_pendientes(db: Session = Depends(get_db)):
 @app.post("/auth/admin/users/{user_id}/approve", dependencies=[Depends(RoleChecker(["admin"]))])
 def aprobar_usuario(
     user_id: uuid.UUID,
-    admin_user: models.Usuario = Depends(get_current_user),
+    admin_user: UsuarioActual = Depends(get_current_user),
     db: Session = Depends(get_db),
 ):
     target = db.query(models.Usuario).filter(models.Usuario.id == user_id).first()
@@ -1348,6 +1970,7 @@ def aprobar_usuario(
     except Exception as exc:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
+    invalidar_usuario(target.username)
 
     return {"status": "ok", "message": "Usuario aprobado", "user_id": str(target.id)}
 
@@ -1366,12 +1989,14 @@ def actualizar_rol_usuario(user_id: uuid.UUID, payload: UpdateUserRoleRequest, d
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     target.rol = payload.rol
+    target.token_version = int(target.token_version or 0) + 1
     try:
         db.add(target)
         db.commit()
     except Exception as exc:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
+    invalidar_usuario(target.username)
 
     return {"status": "ok", "message": "Rol actualizado", "user_id": str(target.id), "rol": target.rol}
 
@@ -1383,12 +2008,14 @@ def actualizar_activo_usuario(user_id: uuid.UUID, payload: UpdateUserActiveReque
         raise HTTPException(status_code=404, detail="Usuario no encontrado")
 
     target.is_active = bool(payload.is_active)
+    target.token_version = int(target.token_version or 0) + 1
     try:
         db.add(target)
         db.commit()
     except Exception as exc:
         db.rollback()
         raise HTTPException(status_code=400, detail=str(exc))
+    invalidar_usuario(target.username)
 
     return {
         "status": "ok",
@@ -1412,7 +2039,16 @@ def auth_login(
     if hasattr(user, "is_approved") and not bool(user.is_approved):
         raise HTTPException(status_code=403, detail="Usuario pendiente de aprobación")
 
-    token = create_access_token({"sub": user.username, "rol": user.rol})
+    if necesita_rehash(user.hashed_password):
+        # Migra bcrypt legado / rondas viejas a la configuración actual.
+        try:
+            user.hashed_password = hash_password(form_data.password)
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logging.getLogger("uvicorn.error").warning("Password rehash failed for %s: %s", user.username, exc)
+
+    token = create_access_token(claims_de_usuario(user))
     return {"access_token": token, "token_type": "bearer"}
 
 
@@ -1426,19 +2062,22 @@ def login_alias(
 
 @app.post("/admin/import/csv-maestro", dependencies=[Depends(RoleChecker(["admin"]))])
 @app.post("/importar/maestro", dependencies=[Depends(RoleChecker(["admin"]))])
-async def admin_import_csv_maestro(
+def admin_import_csv_maestro(
     file: UploadFile = File(...),
     departamento_default: str = Form("Guatemala"),
     estado_oc: str = Form("entregada"),
+    validate_only: bool = Form(False),
     db: Session = Depends(get_db),
 ):
-    content = await file.read()
+    # Sync endpoint (threadpool): el CSV se lee en streaming desde el archivo temporal.
+    # validate_only=true: reporta todos los errores y lo que se crearía, sin escribir.
     try:
         return procesar_csv_maestro(
-            content,
+            file.file,
             db,
             departamento_default=str(departamento_default),
             estado_oc=str(estado_oc),
+            validate_only=bool(validate_only),
         )
     except Exception as exc:
         db.rollback()
@@ -1447,19 +2086,22 @@ async def admin_import_csv_maestro(
 
 # Alias compatible con el frontend: POST /importar/maestro
 @app.post("/importar/maestro", dependencies=[Depends(RoleChecker(["admin"]))])
-async def importar_maestro_alias(
+def importar_maestro_alias(
     file: UploadFile = File(...),
     departamento_default: str = Form("Guatemala"),
     estado_oc: str = Form("entregada"),
+    validate_only: bool = Form(False),
     db: Session = Depends(get_db),
 ):
-    content = await file.read()
+    # Sync endpoint (threadpool): el CSV se lee en streaming desde el archivo temporal.
+    # validate_only=true: reporta todos los errores y lo que se crearía, sin escribir.
     try:
         return procesar_csv_maestro(
-            content,
+            file.file,
             db,
             departamento_default=str(departamento_default),
             estado_oc=str(estado_oc),
+            validate_only=bool(validate_only),
         )
     except Exception as exc:
         db.rollback()
@@ -1,4 +1,4 @@
-from sqlalchemy import Boolean, Column, DateTime, Enum, Float, ForeignKey, String
+from sqlalchemy import JSON, Boolean, Column, DateTime, Enum, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.dialects.postgresql import UUID
 from backend.database import Base
 from sqlalchemy.orm import relationship
@@ -32,6 +32,8 @@ class Usuario(Base):
     approved_by_id = Column(UUID(as_uuid=True), ForeignKey("usuarios.id"), nullable=True)
     approved_at = Column(DateTime, nullable=True)
     creado_en = Column(DateTime, default=datetime.datetime.utcnow)
+    # Se incrementa al cambiar rol/estado: invalida los tokens ya emitidos.
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")
 
 class GastoPersonal(Base):
     __tablename__ = "gastos_personales"
@@ -64,6 +66,22 @@ class MovimientoBodega(Base):
     insumo = relationship("InsumoMaestro")
     proyecto = relationship("Proyecto")
 
+    __table_args__ = (Index("ix_movimientos_bodega_proyecto_insumo", "proyecto_id", "insumo_id"),)
+
+
+class StockActual(Base):
+    """Saldo materializado de bodega (ENTRADA - SALIDA) por proyecto e insumo.
+
+    Se mantiene de forma incremental en `inventario_service.registrar_movimientos`
+    y se reconcilia periódicamente contra `movimientos_bodega`.
+    """
+
+    __tablename__ = "stock_actual"
+    proyecto_id = Column(UUID(as_uuid=True), ForeignKey("proyectos.id"), primary_key=True)
+    insumo_id = Column(UUID(as_uuid=True), ForeignKey("insumos_maestro.id"), primary_key=True)
+    cantidad = Column(Float, nullable=False, default=0.0)
+    actualizado_en = Column(DateTime, default=datetime.datetime.utcnow)
+
 
 class InsumoMaestro(Base):
     __tablename__ = "insumos_maestro"
@@ -74,6 +92,17 @@ class InsumoMaestro(Base):
     precio_referencial_gtq = Column(Float, default=0.0)
     ultimo_sondeo_ia = Column(DateTime, default=datetime.datetime.utcnow)
 
+    __table_args__ = (
+        # Respalda el upsert por lotes de apu_service (INSERT ... ON CONFLICT).
+        Index(
+            "uq_insumos_maestro_tipo_descripcion_unidad",
+            "tipo",
+            "descripcion",
+            "unidad_compra",
+            unique=True,
+        ),
+    )
+
 
 class PresupuestoRenglon(Base):
     __tablename__ = "presupuesto_renglones"
@@ -90,6 +119,8 @@ class PresupuestoRenglon(Base):
         cascade="all, delete-orphan",
     )
 
+    __table_args__ = (Index("ix_presupuesto_renglones_proyecto_id", "proyecto_id"),)
+
 
 class APUComposicion(Base):
     __tablename__ = "apu_composicion"
@@ -103,6 +134,11 @@ class APUComposicion(Base):
     renglon = relationship("PresupuestoRenglon", back_populates="composicion")
     insumo = relationship("InsumoMaestro")
 
+    __table_args__ = (
+        Index("ix_apu_composicion_renglon_id", "renglon_id"),
+        Index("ix_apu_composicion_insumo_id", "insumo_id"),
+    )
+
 
 class ReporteAvance(Base):
     __tablename__ = "reportes_avance"
@@ -118,12 +154,17 @@ class ReporteAvance(Base):
     renglon = relationship("PresupuestoRenglon")
     fotos = relationship("FotoEvidencia", back_populates="reporte")
 
+    __table_args__ = (Index("ix_reportes_avance_usuario_fecha", "usuario_id", "fecha_reporte"),)
+
 
 class FotoEvidencia(Base):
     __tablename__ = "fotos_evidencia"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     reporte_id = Column(UUID(as_uuid=True), ForeignKey("reportes_avance.id"))
     url_foto = Column(String(255), nullable=False)
+    url_thumbnail = Column(String(255))
+    url_webp = Column(String(255))
+    sha256 = Column(String(64))
 
     reporte = relationship("ReporteAvance", back_populates="fotos")
 
@@ -133,6 +174,9 @@ class FotoBitacora(Base):
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     proyecto_id = Column(UUID(as_uuid=True), ForeignKey("proyectos.id"))
     url_foto = Column(String(255))  # URL de Supabase Storage o S3
+    url_thumbnail = Column(String(255))
+    url_webp = Column(String(255))
+    sha256 = Column(String(64))
     comentario = Column(String(500))
     fecha_registro = Column(DateTime, default=datetime.datetime.utcnow)
 
@@ -148,6 +192,8 @@ class OrdenCompra(Base):
     estado = Column(String, default="pendiente")
     total_oc = Column(Float, default=0.0)
 
+    __table_args__ = (Index("ix_ordenes_compra_proyecto_estado", "proyecto_id", "estado"),)
+
 
 class DetalleOrdenCompra(Base):
     __tablename__ = "detalle_orden_compra"
@@ -161,6 +207,27 @@ class DetalleOrdenCompra(Base):
     oc = relationship("OrdenCompra")
     insumo = relationship("InsumoMaestro")
 
+    __table_args__ = (
+        Index("ix_detalle_orden_compra_oc_id", "oc_id"),
+        Index("ix_detalle_orden_compra_insumo_id", "insumo_id"),
+    )
+
+
+class PresupuestoInsumoTotal(Base):
+    """Índice de disponibilidad por proyecto e insumo para validar compras.
+
+    cantidad_presupuestada = SUM(renglón.cantidad_total * APU.rendimiento) y
+    cantidad_comprada = SUM(detalle_orden_compra.cantidad_pedida). Se mantiene
+    de forma incremental en `presupuesto_service` (al crear renglones y OCs).
+    """
+
+    __tablename__ = "presupuesto_insumo_totales"
+    proyecto_id = Column(UUID(as_uuid=True), ForeignKey("proyectos.id"), primary_key=True)
+    insumo_id = Column(UUID(as_uuid=True), ForeignKey("insumos_maestro.id"), primary_key=True)
+    cantidad_presupuestada = Column(Float, nullable=False, default=0.0)
+    cantidad_comprada = Column(Float, nullable=False, default=0.0)
+    actualizado_en = Column(DateTime, default=datetime.datetime.utcnow)
+
 
 class Trabajador(Base):
     __tablename__ = "trabajadores"
@@ -183,6 +250,13 @@ class RegistroAsistencia(Base):
     latitud_gps = Column(Float)
     longitud_gps = Column(Float)
     gps_check = Column(Boolean, default=False)
+    # Clave generada por el dispositivo (única por trabajador): reintentos de sincronización no duplican.
+    idempotency_key = Column(String(100), nullable=True)
+
+    __table_args__ = (
+        Index("ix_asistencia_trabajador_fecha", "trabajador_id", "fecha"),
+        Index("uq_asistencia_trabajador_idempotency_key", "trabajador_id", "idempotency_key", unique=True),
+    )
 
 
 class PagoPlanilla(Base):
@@ -215,4 +289,21 @@ class FlujoCajaConsolidado(Base):
     total_egresos_planilla = Column(Float, default=0.0)
     utilidad_bruta = Column(Float, default=0.0)
     margen_porcentual = Column(Float, default=0.0)
-    fecha_corte = Column(DateTime, default=datetime.datetime.utcnow)
\ No newline at end of file
+    fecha_corte = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class Job(Base):
+    """Trabajo en segundo plano (generación IA de presupuestos, APUs, etc.)."""
+
+    __tablename__ = "jobs"
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    tipo = Column(String(50), nullable=False)
+    estado = Column(String(20), default="pendiente")  # pendiente, en_proceso, completado, fallido
+    completados = Column(Integer, default=0)
+    total = Column(Integer, default=0)
+    parametros = Column(JSON)
+    parciales = Column(JSON)
+    resultado = Column(JSON)
+    error = Column(String(1000))
+    creado_en = Column(DateTime, default=datetime.datetime.utcnow)
+    actualizado_en = Column(DateTime, default=datetime.datetime.utcnow)
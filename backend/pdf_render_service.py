@@ -0,0 +1,231 @@
+"""Render de PDFs de presupuesto fuera del proceso del servidor.
+
+El layout de reportlab es CPU puro: un informe profesional de miles de
+renglones retiene el GIL por segundos. Aquí cada documento se genera en un
+pool de procesos acotado (PDF_RENDER_PROCESOS, 0 = en el hilo que llama),
+con un tope de trabajos en espera (PDF_RENDER_COLA; lleno => 503) y un
+tiempo máximo por documento (PDF_RENDER_TIMEOUT_S => 504).
+
+El timeout se aplica dentro del worker con SIGALRM: el render se aborta y el
+proceso queda libre para el siguiente trabajo, sin matar el pool. En modo
+en línea (PDF_RENDER_PROCESOS=0) no hay timeout: el render corre en un hilo
+del threadpool, donde no se pueden instalar señales.
+
+`renderizar_lote` genera muchos documentos en paralelo (paquetes de fin de
+mes) usando el mismo pool, con a lo sumo PDF_RENDER_LOTE_PARALELO a la vez
+para dejar procesos libres a las descargas interactivas.
+"""
+
+from __future__ import annotations
+
+import io
+import logging
+import os
+import pathlib
+import signal
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturoTimeout
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable
+
+from fastapi import HTTPException, status
+
+from backend.utils import pdf_cache
+from backend.utils.pdf_gen import generar_pdf_presupuesto, generar_pdf_presupuesto_profesional
+from backend.utils.procesos import contexto_pool
+
+_logger = logging.getLogger("uvicorn.error")
+
+# Mismas llaves que pdf_cache.VERSION_PLANTILLA.
+_GENERADORES: dict[str, Callable[..., str]] = {
+    "presupuesto": generar_pdf_presupuesto,
+    "presupuesto_profesional": generar_pdf_presupuesto_profesional,
+}
+
+_pool: ProcessPoolExecutor | None = None
+_cupos: threading.BoundedSemaphore | None = None
+_pool_lock = threading.Lock()
+
+
+def _env_int(name: str, default: int) -> int:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser un entero") from exc
+
+
+def _procesos() -> int:
+    return _env_int("PDF_RENDER_PROCESOS", os.cpu_count() or 2)
+
+
+def _get_pool() -> tuple[ProcessPoolExecutor | None, threading.BoundedSemaphore]:
+    global _pool, _cupos
+    with _pool_lock:
+        if _cupos is None:
+            procesos = _procesos()
+            if procesos > 0:
+                _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=contexto_pool())
+            _cupos = threading.BoundedSemaphore(max(1, _env_int("PDF_RENDER_COLA", 16)))
+        return _pool, _cupos
+
+
+def cerrar_pool_render(roto: ProcessPoolExecutor | None = None) -> None:
+    """Cierra el pool; el siguiente render crea otro. Con `roto`, solo si sigue
+    siendo el vigente (otro hilo pudo haberlo rehecho ya)."""
+
+    global _pool, _cupos
+    with _pool_lock:
+        if roto is not None and _pool is not roto:
+            return
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+        _cupos = None
+
+
+class TiempoRenderAgotado(Exception):
+    pass
+
+
+def _alarma(signum, frame) -> None:
+    raise TiempoRenderAgotado()
+
+
+def _renderizar(
+    plantilla: str,
+    datos: dict[str, Any],
+    timeout_s: int,
+    output_dir: str | None,
+) -> str | bytes:
+    """Corre en el worker. Con `output_dir` retorna la ruta; sin él, los bytes del PDF."""
+
+    generador = _GENERADORES[plantilla]
+    # SIGALRM solo se puede instalar en el hilo principal (siempre, en un worker del pool).
+    usar_alarma = (
+        timeout_s > 0
+        and hasattr(signal, "setitimer")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if usar_alarma:
+        anterior = signal.signal(signal.SIGALRM, _alarma)
+        signal.setitimer(signal.ITIMER_REAL, timeout_s)
+    try:
+        if output_dir is not None:
+            return generador(datos, output_dir=output_dir)
+        buffer = io.BytesIO()
+        generador(datos, destino=buffer)
+        return buffer.getvalue()
+    finally:
+        if usar_alarma:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, anterior)
+
+
+def _ejecutar(
+    plantilla: str,
+    datos: dict[str, Any],
+    output_dir: str | None,
+    *,
+    espera_s: float | None,
+) -> str | bytes:
+    if plantilla not in _GENERADORES:
+        raise ValueError(f"Plantilla no soportada: {plantilla}")
+
+    pool, cupos = _get_pool()
+    if not cupos.acquire(timeout=espera_s):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Generador de PDFs ocupado, intenta de nuevo",
+            headers={"Retry-After": "5"},
+        )
+
+    timeout_s = _env_int("PDF_RENDER_TIMEOUT_S", 120)
+    futuro = None
+    try:
+        if pool is None:
+            return _renderizar(plantilla, datos, timeout_s, output_dir)
+        futuro = pool.submit(_renderizar, plantilla, datos, timeout_s, output_dir)
+        # Margen sobre el timeout del worker: cubre la espera en cola del pool.
+        return futuro.result(timeout=timeout_s * 2 if timeout_s > 0 else None)
+    except (TiempoRenderAgotado, FuturoTimeout) as exc:
+        if futuro is not None:
+            # Si sigue en la cola del pool no llega a correr; si ya corre, la
+            # alarma del worker lo corta. Así el cupo liberado abajo no deja
+            # trabajo huérfano ocupando procesos.
+            futuro.cancel()
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"El PDF tardó más de {timeout_s}s en generarse",
+        ) from exc
+    except BrokenProcessPool as exc:
+        # Un worker murió (típicamente OOM con un presupuesto enorme): el pool
+        # ya no acepta trabajos. Se descarta para que el siguiente use uno
+        # nuevo; reintentar aquí el mismo documento probablemente lo repetiría.
+        _logger.warning("Pool de render de PDFs roto; se crea uno nuevo")
+        cerrar_pool_render(roto=pool)
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="El generador de PDFs se reinició, intenta de nuevo",
+            headers={"Retry-After": "5"},
+        ) from exc
+    finally:
+        cupos.release()
+
+
+def renderizar_pdf(plantilla: str, datos: dict[str, Any], *, output_dir: str | os.PathLike) -> str:
+    """Genera el PDF en `output_dir` (en el pool) y retorna la ruta del archivo."""
+
+    return str(_ejecutar(plantilla, datos, str(output_dir), espera_s=_env_int("PDF_RENDER_ESPERA_S", 10)))
+
+
+def renderizar_pdf_bytes(plantilla: str, datos: dict[str, Any]) -> bytes:
+    """Genera el PDF en el pool y retorna su contenido (sin tocar el disco)."""
+
+    return bytes(_ejecutar(plantilla, datos, None, espera_s=_env_int("PDF_RENDER_ESPERA_S", 10)))
+
+
+def renderizar_lote(
+    directorio: pathlib.Path,
+    trabajos: list[dict[str, Any]],
+    reportar: Callable[[int, int, "dict[str, Any] | None"], None] | None = None,
+) -> list[dict[str, Any]]:
+    """Genera (o reutiliza del caché) un PDF por trabajo, en paralelo.
+
+    Cada trabajo: {"proyecto_id", "plantilla", "nombre", "datos": callable() -> dict}.
+    `datos` solo se llama si el PDF no está en caché, desde un hilo del lote:
+    debe abrir su propia sesión de BD (no usar la del request ni la del job).
+    Retorna un resultado por trabajo con estado "ok" o "error".
+    """
+
+    paralelo = max(1, _env_int("PDF_RENDER_LOTE_PARALELO", max(1, _procesos() - 1)))
+    total = len(trabajos)
+    completados = 0
+    lock = threading.Lock()
+
+    def uno(trabajo: dict[str, Any]) -> dict[str, Any]:
+        nonlocal completados
+        resultado: dict[str, Any] = {"proyecto_id": str(trabajo["proyecto_id"]), "filename": trabajo["nombre"]}
+        try:
+            _ruta, acierto = pdf_cache.obtener_o_generar(
+                directorio,
+                trabajo["nombre"],
+                # El lote espera turno sin límite: no compite con el 503 interactivo.
+                lambda tmp: _ejecutar(trabajo["plantilla"], trabajo["datos"](), str(tmp), espera_s=None),
+            )
+            resultado.update(estado="ok", cache="hit" if acierto else "miss")
+        except Exception as exc:
+            mensaje = str(getattr(exc, "detail", None) or exc)
+            _logger.warning("PDF de %s falló en el lote: %s", trabajo["proyecto_id"], mensaje)
+            resultado.update(estado="error", detalle=mensaje)
+        with lock:
+            completados += 1
+            if reportar is not None:
+                reportar(completados, total, resultado)
+        return resultado
+
+    with ThreadPoolExecutor(max_workers=paralelo, thread_name_prefix="pdf-lote") as hilos:
+        return list(hilos.map(uno, trabajos))
@@ -2,51 +2,131 @@ from __future__ import annotations
 
 import datetime
 import uuid
+from typing import Any
 
-from sqlalchemy import func
+from sqlalchemy import func, insert, select
 from sqlalchemy.orm import Session
 
 from backend import models
 
 
+def _filas_planilla(
+    db: Session,
+    condicion,
+    fecha_inicio: datetime.datetime,
+    fecha_fin: datetime.datetime,
+) -> list[Any]:
+    """Trabajadores que cumplen `condicion` con sus días laborados y avance del periodo.
+
+    Una sola consulta: asistencia (COUNT) y reportes de avance (SUM) se
+    agregan por trabajador en subconsultas agrupadas y se unen con LEFT JOIN.
+    """
+
+    alcance = select(models.Trabajador.id).where(condicion)
+    dias = (
+        select(
+            models.RegistroAsistencia.trabajador_id.label("trabajador_id"),
+            func.count().label("dias"),
+        )
+        .where(models.RegistroAsistencia.trabajador_id.in_(alcance))
+        .where(models.RegistroAsistencia.fecha.between(fecha_inicio, fecha_fin))
+        .group_by(models.RegistroAsistencia.trabajador_id)
+        .subquery()
+    )
+    avance = (
+        select(
+            models.ReporteAvance.usuario_id.label("trabajador_id"),
+            func.sum(models.ReporteAvance.cantidad_avanzada).label("avance"),
+        )
+        .where(models.ReporteAvance.usuario_id.in_(alcance))
+        .where(models.ReporteAvance.fecha_reporte.between(fecha_inicio, fecha_fin))
+        .group_by(models.ReporteAvance.usuario_id)
+        .subquery()
+    )
+    return db.execute(
+        select(
+            models.Trabajador.id,
+            models.Trabajador.nombre_completo,
+            models.Trabajador.tipo_pago,
+            models.Trabajador.tarifa_base,
+            models.Trabajador.proyecto_actual_id,
+            func.coalesce(dias.c.dias, 0).label("dias"),
+            func.coalesce(avance.c.avance, 0.0).label("avance"),
+        )
+        .outerjoin(dias, dias.c.trabajador_id == models.Trabajador.id)
+        .outerjoin(avance, avance.c.trabajador_id == models.Trabajador.id)
+        .where(condicion)
+        .order_by(models.Trabajador.proyecto_actual_id, models.Trabajador.nombre_completo)
+    ).all()
+
+
+def _monto(fila: Any) -> float:
+    tarifa = float(fila.tarifa_base) if fila.tarifa_base is not None else 0.0
+    if tarifa <= 0:
+        return 0.0
+
+    tipo_pago = str(fila.tipo_pago)
+    if tipo_pago == "jornal":
+        return float(fila.dias) * tarifa
+    if tipo_pago == "destajo":
+        return float(fila.avance or 0.0) * tarifa
+    raise ValueError(f"tipo_pago no soportado: {tipo_pago}")
+
+
 def calcular_pago_semanal(
     db: Session,
     trabajador_id: uuid.UUID,
     fecha_inicio: datetime.datetime,
     fecha_fin: datetime.datetime,
 ) -> float:
-    trabajador = (
-        db.query(models.Trabajador)
-        .filter(models.Trabajador.id == trabajador_id)
-        .first()
-    )
-    if trabajador is None:
+    filas = _filas_planilla(db, models.Trabajador.id == trabajador_id, fecha_inicio, fecha_fin)
+    if not filas:
         raise ValueError("Trabajador no encontrado")
+    return _monto(filas[0])
 
-    tarifa_base = getattr(trabajador, "tarifa_base", None)
-    tarifa = float(tarifa_base) if tarifa_base is not None else 0.0
-    if tarifa <= 0:
-        return 0.0
 
-    tipo_pago = str(trabajador.tipo_pago)
+def cerrar_planilla(
+    db: Session,
+    fecha_inicio: datetime.datetime,
+    fecha_fin: datetime.datetime,
+    proyecto_id: uuid.UUID | None = None,
+) -> list[dict[str, Any]]:
+    """Calcula e inserta (sin commit) los `PagoPlanilla` del periodo.
+
+    Con `proyecto_id` cierra ese proyecto; sin él, todos los trabajadores
+    asignados a algún proyecto. Un solo SELECT agregado + un INSERT multi-fila,
+    sin importar cuántos trabajadores haya.
+    """
 
-    if tipo_pago == "jornal":
-        dias_laborados = (
-            db.query(models.RegistroAsistencia)
-            .filter(models.RegistroAsistencia.trabajador_id == trabajador_id)
-            .filter(models.RegistroAsistencia.fecha.between(fecha_inicio, fecha_fin))
-            .count()
-        )
-        return float(dias_laborados) * tarifa
+    if proyecto_id is not None:
+        condicion = models.Trabajador.proyecto_actual_id == proyecto_id
+    else:
+        condicion = models.Trabajador.proyecto_actual_id.is_not(None)
 
-    if tipo_pago == "destajo":
-        avance_total = (
-            db.query(func.sum(models.ReporteAvance.cantidad_avanzada))
-            .filter(models.ReporteAvance.usuario_id == trabajador_id)
-            .filter(models.ReporteAvance.fecha_reporte.between(fecha_inicio, fecha_fin))
-            .scalar()
-            or 0.0
+    filas = _filas_planilla(db, condicion, fecha_inicio, fecha_fin)
+    detalle: list[dict[str, Any]] = []
+    pagos: list[dict[str, Any]] = []
+    for f in filas:
+        monto = _monto(f)
+        pagos.append(
+            {
+                "id": uuid.uuid4(),
+                "trabajador_id": f.id,
+                "proyecto_id": f.proyecto_actual_id,
+                "fecha_inicio": fecha_inicio,
+                "fecha_fin": fecha_fin,
+                "monto_total": monto,
+            }
+        )
+        detalle.append(
+            {
+                "proyecto_id": str(f.proyecto_actual_id),
+                "trabajador": f.nombre_completo,
+                "monto_a_pagar": monto,
+                "tipo": str(f.tipo_pago),
+            }
         )
-        return float(avance_total) * tarifa
 
-    raise ValueError(f"tipo_pago no soportado: {tipo_pago}")
+    if pagos:
+        db.execute(insert(models.PagoPlanilla), pagos)
+    return detalle
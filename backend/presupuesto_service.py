@@ -0,0 +1,189 @@
+"""Disponibilidad de presupuesto por insumo (`presupuesto_insumo_totales`).
+
+Por cada (proyecto, insumo) guarda lo presupuestado (renglones × APU) y lo ya
+pedido en órdenes de compra, así validar una OC completa es un solo SELECT
+en vez de dos agregados por línea. Quien crea renglones/composiciones o
+detalles de OC debe llamar a `sumar_presupuestado` / `sumar_comprado` en la
+misma transacción.
+
+`recalcular_totales_presupuesto` reconstruye la tabla desde las tablas de
+origen (backfill, datos cargados por SQL directo o deriva).
+"""
+
+from __future__ import annotations
+
+import datetime
+import hashlib
+import uuid
+from typing import Any
+
+from sqlalchemy import String, cast, delete, func, insert, literal, literal_column, select, text, union_all
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert as pg_insert
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+from backend import models
+
+Clave = tuple[uuid.UUID, uuid.UUID]
+
+
+def _sumar(db: Session, columna: str, cantidades: dict[Clave, float]) -> None:
+    if not cantidades:
+        return
+
+    otra = "cantidad_comprada" if columna == "cantidad_presupuestada" else "cantidad_presupuestada"
+    ahora = datetime.datetime.utcnow()
+    # Orden estable de llaves: evita deadlocks entre transacciones que tocan las mismas filas.
+    filas = [
+        {"proyecto_id": p, "insumo_id": i, columna: float(c), otra: 0.0, "actualizado_en": ahora}
+        for (p, i), c in sorted(cantidades.items(), key=lambda kv: (str(kv[0][0]), str(kv[0][1])))
+    ]
+    tabla = models.PresupuestoInsumoTotal
+    stmt = pg_insert(tabla).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.proyecto_id, tabla.insumo_id],
+        set_={
+            columna: getattr(tabla, columna) + getattr(stmt.excluded, columna),
+            "actualizado_en": stmt.excluded.actualizado_en,
+        },
+    )
+    db.execute(stmt)
+
+
+def sumar_presupuestado(db: Session, cantidades: dict[Clave, float]) -> None:
+    """Suma a lo presupuestado (sin commit). Llave: (proyecto_id, insumo_id)."""
+
+    _sumar(db, "cantidad_presupuestada", cantidades)
+
+
+def sumar_comprado(db: Session, cantidades: dict[Clave, float]) -> None:
+    """Suma a lo comprado (sin commit). Llave: (proyecto_id, insumo_id)."""
+
+    _sumar(db, "cantidad_comprada", cantidades)
+
+
+def disponibles_por_insumo(
+    db: Session,
+    proyecto_id: uuid.UUID,
+    insumo_ids: list[uuid.UUID],
+    *,
+    bloquear: bool = False,
+) -> dict[uuid.UUID, float]:
+    """Presupuestado - comprado de cada insumo, en un solo SELECT.
+
+    Con `bloquear=True` toma FOR UPDATE sobre esas filas (en orden de
+    insumo_id) hasta el commit: dos OCs simultáneas del mismo proyecto e
+    insumo se validan una después de la otra. Insumos sin fila => 0.
+    """
+
+    if not insumo_ids:
+        return {}
+
+    tabla = models.PresupuestoInsumoTotal
+    q = (
+        select(tabla.insumo_id, tabla.cantidad_presupuestada - tabla.cantidad_comprada)
+        .where(tabla.proyecto_id == proyecto_id)
+        .where(tabla.insumo_id.in_(set(insumo_ids)))
+        .order_by(tabla.insumo_id)
+    )
+    if bloquear:
+        q = q.with_for_update()
+    return {insumo_id: float(disponible or 0.0) for insumo_id, disponible in db.execute(q)}
+
+
+def _totales_desde_origen(proyecto_id: uuid.UUID | None = None):
+    R, C = models.PresupuestoRenglon, models.APUComposicion
+    OC, D = models.OrdenCompra, models.DetalleOrdenCompra
+
+    presupuestado = (
+        select(
+            R.proyecto_id.label("proyecto_id"),
+            C.insumo_id.label("insumo_id"),
+            (R.cantidad_total * C.rendimiento).label("presupuestado"),
+            literal(0.0).label("comprado"),
+        )
+        .join(C, C.renglon_id == R.id)
+        .where(R.proyecto_id.is_not(None), C.insumo_id.is_not(None))
+    )
+    comprado = (
+        select(OC.proyecto_id, D.insumo_id, literal(0.0), D.cantidad_pedida)
+        .join(OC, OC.id == D.oc_id)
+        .where(OC.proyecto_id.is_not(None), D.insumo_id.is_not(None))
+    )
+    if proyecto_id is not None:
+        presupuestado = presupuestado.where(R.proyecto_id == proyecto_id)
+        comprado = comprado.where(OC.proyecto_id == proyecto_id)
+
+    partes = union_all(presupuestado, comprado).subquery()
+    return select(
+        partes.c.proyecto_id,
+        partes.c.insumo_id,
+        func.coalesce(func.sum(partes.c.presupuestado), 0.0),
+        func.coalesce(func.sum(partes.c.comprado), 0.0),
+        func.now(),
+    ).group_by(partes.c.proyecto_id, partes.c.insumo_id)
+
+
+def recalcular_totales_presupuesto(
+    db: Session | Connection,
+    proyecto_id: uuid.UUID | None = None,
+) -> dict[str, Any]:
+    """Reconstruye la tabla (o un proyecto) desde renglones/APU y OCs. Sin commit.
+
+    En Postgres bloquea la tabla (EXCLUSIVE: lecturas sí, escrituras no)
+    para que ninguna OC concurrente sume sobre filas que se están rehaciendo.
+    """
+
+    bind = db if isinstance(db, Connection) else db.get_bind()
+    if bind.dialect.name == "postgresql":
+        db.execute(text("LOCK TABLE presupuesto_insumo_totales IN EXCLUSIVE MODE"))
+
+    tabla = models.PresupuestoInsumoTotal
+    borrar = delete(tabla)
+    if proyecto_id is not None:
+        borrar = borrar.where(tabla.proyecto_id == proyecto_id)
+    db.execute(borrar)
+    db.execute(
+        insert(tabla).from_select(
+            ["proyecto_id", "insumo_id", "cantidad_presupuestada", "cantidad_comprada", "actualizado_en"],
+            _totales_desde_origen(proyecto_id),
+        )
+    )
+    contar = select(func.count()).select_from(tabla)
+    if proyecto_id is not None:
+        contar = contar.where(tabla.proyecto_id == proyecto_id)
+    return {"status": "ok", "filas": int(db.execute(contar).scalar_one())}
+
+
+def huella_presupuesto(db: Session, proyecto_id: uuid.UUID) -> str:
+    """Hash de los renglones del proyecto (descripción, unidad, cantidad, precio).
+
+    Sirve de llave para el caché de PDFs: en Postgres se calcula en el
+    servidor (`md5(string_agg(...))`), así una descarga repetida solo trae
+    una fila en vez de todos los renglones.
+    """
+
+    R = models.PresupuestoRenglon
+    campos = (
+        cast(R.id, String),
+        R.descripcion,
+        R.unidad_medida,
+        cast(R.cantidad_total, String),
+        cast(R.costo_unitario_ia, String),
+    )
+    filtro = R.proyecto_id == proyecto_id
+
+    if db.get_bind().dialect.name == "postgresql":
+        fila = func.concat_ws("|", *campos)
+        agregado = func.string_agg(fila, aggregate_order_by(literal_column("E'\\n'"), R.descripcion, R.id))
+        total, md5 = db.execute(
+            select(func.count(), func.coalesce(func.md5(agregado), "")).where(filtro)
+        ).one()
+        return f"{total}:{md5}"
+
+    filas = db.execute(select(*campos).where(filtro).order_by(R.descripcion, R.id)).all()
+    h = hashlib.md5()
+    for f in filas:
+        h.update("|".join("" if v is None else str(v) for v in f).encode("utf-8"))
+        h.update(b"\n")
+    return f"{len(filas)}:{h.hexdigest()}"
@@ -42,6 +42,11 @@ class AsistenciaGPSRequest(BaseModel):
     latitud: float
     longitud: float
     fecha: datetime.datetime
+    idempotency_key: str | None = Field(default=None, min_length=1, max_length=100)
+
+
+class AsistenciaBatchRequest(BaseModel):
+    registros: list[AsistenciaGPSRequest] = Field(min_length=1, max_length=1000)
 
 
 class OrdenCompraEstadoUpdate(BaseModel):
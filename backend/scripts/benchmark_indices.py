@@ -0,0 +1,147 @@
+"""Benchmark de índices: tiempos antes/después en auditor, planilla e inventario.
+
+Crea un esquema temporal (`bench_indices` por defecto) en la BD de
+DATABASE_URL, lo llena con `seed_datos_sinteticos.sembrar`, mide las
+consultas reales de los servicios sin índices secundarios, crea los índices
+declarados en `models.py`, vuelve a medir y elimina el esquema.
+
+Requiere Postgres 13+ (`gen_random_uuid()` nativo). Uso:
+    python backend/scripts/benchmark_indices.py --escala 1 --repeticiones 20
+
+No toca las tablas del esquema público.
+"""
+
+from __future__ import annotations
+
+import argparse
+import datetime
+import os
+import pathlib
+import statistics
+import sys
+import time
+from typing import Callable
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateIndex
+
+_ROOT = pathlib.Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import backend.database as d  # noqa: E402
+from backend import models  # noqa: E402
+from backend.ia_auditor import obtener_teorico_disponible, verificar_desviacion_presupuesto  # noqa: E402
+from backend.inventario_service import resumen_libro  # noqa: E402
+from backend.planilla_service import calcular_pago_semanal  # noqa: E402
+from backend.scripts.seed_datos_sinteticos import Volumenes, sembrar  # noqa: E402
+
+
+def _engine(esquema: str):
+    engine = create_engine(d.db_url, pool_pre_ping=True)
+
+    @event.listens_for(engine, "connect")
+    def _search_path(dbapi_conn, _rec):
+        with dbapi_conn.cursor() as cur:
+            # Solo el esquema temporal: así create_all no "ve" las tablas de public.
+            cur.execute(f'SET search_path TO "{esquema}"')
+
+    return engine
+
+
+def _indices() -> list:
+    return [idx for table in models.Base.metadata.sorted_tables for idx in table.indexes]
+
+
+def _medir(SessionBench: sessionmaker, repeticiones: int) -> dict[str, float]:
+    with SessionBench() as db:
+        proyecto_id = db.execute(text("SELECT id FROM proyectos ORDER BY nombre_proyecto LIMIT 1")).scalar()
+        insumo_id = db.execute(text("SELECT id FROM insumos_maestro ORDER BY descripcion LIMIT 1")).scalar()
+        jornal_id = db.execute(text("SELECT id FROM trabajadores WHERE tipo_pago = 'jornal' LIMIT 1")).scalar()
+        destajo_id = db.execute(text("SELECT id FROM trabajadores WHERE tipo_pago = 'destajo' LIMIT 1")).scalar()
+
+    fin = datetime.datetime.utcnow()
+    inicio = fin - datetime.timedelta(days=7)
+
+    consultas: dict[str, Callable[[Session], object]] = {
+        "auditor.verificar_desviacion_presupuesto": lambda db: verificar_desviacion_presupuesto(db, proyecto_id),
+        "auditor.obtener_teorico_disponible": lambda db: obtener_teorico_disponible(db, proyecto_id, insumo_id),
+        "planilla.calcular_pago_semanal (jornal)": lambda db: calcular_pago_semanal(db, jornal_id, inicio, fin),
+        "planilla.calcular_pago_semanal (destajo)": lambda db: calcular_pago_semanal(db, destajo_id, inicio, fin),
+        "GET /inventario/resumen?proyecto_id": lambda db: resumen_libro(db, proyecto_id),
+    }
+
+    resultados: dict[str, float] = {}
+    with SessionBench() as db:
+        for nombre, consulta in consultas.items():
+            consulta(db)  # calentamiento (caché de planes / buffers)
+            tiempos = []
+            for _ in range(repeticiones):
+                t0 = time.perf_counter()
+                consulta(db)
+                tiempos.append((time.perf_counter() - t0) * 1000)
+            resultados[nombre] = statistics.median(tiempos)
+    return resultados
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--escala", type=float, default=1.0, help="Multiplicador del volumen de datos (default 1)")
+    parser.add_argument("--repeticiones", type=int, default=20)
+    parser.add_argument("--esquema", default="bench_indices")
+    parser.add_argument("--conservar", action="store_true", help="No eliminar el esquema al terminar")
+    args = parser.parse_args()
+
+    esquema = args.esquema
+    if not esquema.replace("_", "").isalnum():
+        raise SystemExit("--esquema debe ser un identificador simple")
+
+    engine = _engine(esquema)
+    SessionBench = sessionmaker(bind=engine, autoflush=False, autocommit=False)
+
+    with engine.begin() as conn:
+        conn.execute(text(f'DROP SCHEMA IF EXISTS "{esquema}" CASCADE'))
+        conn.execute(text(f'CREATE SCHEMA "{esquema}"'))
+
+    try:
+        with engine.begin() as conn:
+            models.Base.metadata.create_all(conn)
+            # Línea base: sin índices secundarios (solo PK/UNIQUE de columnas).
+            for idx in _indices():
+                conn.execute(text(f'DROP INDEX IF EXISTS "{esquema}"."{idx.name}"'))
+            t0 = time.perf_counter()
+            sembrar(conn, Volumenes.por_escala(args.escala))
+            print(f"Siembra: {time.perf_counter() - t0:.1f}s")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE"))
+
+        antes = _medir(SessionBench, args.repeticiones)
+
+        with engine.begin() as conn:
+            t0 = time.perf_counter()
+            for idx in _indices():
+                conn.execute(CreateIndex(idx, if_not_exists=True))
+            print(f"Creación de índices: {time.perf_counter() - t0:.1f}s")
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("ANALYZE"))
+
+        despues = _medir(SessionBench, args.repeticiones)
+
+        ancho = max(len(k) for k in antes)
+        print()
+        print(f"{'consulta':<{ancho}}  {'antes ms':>10}  {'después ms':>10}  {'mejora':>8}")
+        for nombre in antes:
+            a, b = antes[nombre], despues[nombre]
+            print(f"{nombre:<{ancho}}  {a:>10.2f}  {b:>10.2f}  {a / b if b else float('inf'):>7.1f}x")
+    finally:
+        if not args.conservar:
+            with engine.begin() as conn:
+                conn.execute(text(f'DROP SCHEMA IF EXISTS "{esquema}" CASCADE'))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
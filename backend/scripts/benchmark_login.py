@@ -0,0 +1,128 @@
+"""Throughput de login: hash/verificación de contraseñas y ráfaga HTTP.
+
+Modo local (sin servidor): mide `verify_password` desde N hilos (como el
+threadpool de FastAPI), en el hilo que llama vs. el pool de procesos, para
+cada número de rondas PBKDF2:
+
+    python backend/scripts/benchmark_login.py local --hilos 40 --rondas 29000 100000
+
+Modo http: N trabajadores marcan entrada a la vez contra un servidor ya
+levantado (usuario del manifiesto de seed_datos_sinteticos.py):
+
+    python backend/scripts/benchmark_login.py http --manifiesto /tmp/manifiesto.json \\
+        --logins 200 --concurrencia 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import pathlib
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+_ROOT = pathlib.Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql+psycopg2://benchmark@localhost/benchmark")
+
+from backend.scripts.load_test import _percentil  # noqa: E402
+
+
+def _linea(nombre: str, latencias: list[float], duracion: float) -> str:
+    return (
+        f"{nombre:<28}  {len(latencias) / duracion:>8.1f}/s  "
+        f"p50 {_percentil(latencias, 50):>7.1f} ms  p95 {_percentil(latencias, 95):>7.1f} ms  "
+        f"p99 {_percentil(latencias, 99):>7.1f} ms"
+    )
+
+
+def _medir_local(args: argparse.Namespace, procesos: int) -> None:
+    # auth lee la configuración del pool al primer uso: se reimporta por corrida.
+    os.environ["AUTH_HASH_PROCESOS"] = str(procesos)
+    os.environ["AUTH_HASH_COLA"] = str(args.hilos)
+    sys.modules.pop("backend.auth", None)
+    from backend import auth
+
+    for rondas in args.rondas:
+        os.environ["AUTH_PBKDF2_ROUNDS"] = str(rondas)
+        hashed = auth.hash_password("clave-de-prueba")
+
+        def una(_):
+            t0 = time.perf_counter()
+            assert auth.verify_password("clave-de-prueba", hashed)
+            return (time.perf_counter() - t0) * 1000
+
+        with ThreadPoolExecutor(max_workers=args.hilos) as hilos:
+            t0 = time.perf_counter()
+            latencias = list(hilos.map(una, range(args.verificaciones)))
+            duracion = time.perf_counter() - t0
+        modo = f"{procesos} procesos" if procesos else "en el hilo"
+        print(_linea(f"{rondas} rondas, {modo}", latencias, duracion))
+
+    if auth._pool_hash is not None:
+        auth._pool_hash.shutdown()
+
+
+async def _medir_http(args: argparse.Namespace) -> None:
+    import httpx
+
+    manifiesto = json.loads(args.manifiesto.read_text(encoding="utf-8"))
+    datos = {"username": manifiesto["usuario"], "password": manifiesto["password"]}
+    latencias: list[float] = []
+    codigos: dict[int, int] = {}
+    semaforo = asyncio.Semaphore(args.concurrencia)
+
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limites) as c:
+
+        async def login() -> None:
+            async with semaforo:
+                t0 = time.perf_counter()
+                try:
+                    status = (await c.post("/auth/login", data=datos)).status_code
+                except httpx.HTTPError:
+                    status = 0
+                latencias.append((time.perf_counter() - t0) * 1000)
+                codigos[status] = codigos.get(status, 0) + 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(args.logins)))
+        duracion = time.perf_counter() - t0
+
+    print(_linea("POST /auth/login", latencias, duracion))
+    print("códigos:", dict(sorted(codigos.items())))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="modo", required=True)
+
+    local = sub.add_parser("local", help="verify_password en proceso")
+    local.add_argument("--hilos", type=int, default=40, help="Hilos que verifican a la vez (default 40)")
+    local.add_argument("--verificaciones", type=int, default=400)
+    local.add_argument("--rondas", type=int, nargs="+", default=[29000])
+    local.add_argument("--procesos", type=int, default=os.cpu_count() or 2, help="Tamaño del pool a comparar")
+
+    http = sub.add_parser("http", help="Ráfaga de POST /auth/login contra un servidor")
+    http.add_argument("--base-url", default="http://127.0.0.1:8000")
+    http.add_argument("--manifiesto", type=pathlib.Path, required=True, help="Salida de seed_datos_sinteticos.py")
+    http.add_argument("--logins", type=int, default=200)
+    http.add_argument("--concurrencia", type=int, default=200)
+    http.add_argument("--timeout", type=float, default=60.0)
+
+    args = parser.parse_args()
+    if args.modo == "local":
+        _medir_local(args, 0)
+        _medir_local(args, args.procesos)
+    else:
+        asyncio.run(_medir_http(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Páginas por segundo de los PDFs de presupuesto (simple y profesional).
+
+Genera presupuestos sintéticos de ~10 y ~500 páginas en memoria (sin tocar
+uploads ni la BD) con un logo JPEG de tamaño "de teléfono" en PDF_LOGO_PATH,
+que es el caso en que decodificar el logo por página pesa:
+
+    python backend/scripts/benchmark_pdf.py --paginas 10 500 --repeticiones 3
+
+Pasar --logo para usar un logo real en vez del sintético.
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import pathlib
+import re
+import statistics
+import sys
+import tempfile
+import time
+
+_ROOT = pathlib.Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from backend.utils.pdf_gen import generar_pdf_presupuesto, generar_pdf_presupuesto_profesional  # noqa: E402
+
+# Renglones por página aproximados de cada plantilla (LETTER, fuente 9-10pt).
+_RENGLONES_POR_PAGINA = {"simple": 28, "profesional": 32}
+_PAGINA = re.compile(rb"/Type /Page\b(?!s)")
+
+
+def _logo_sintetico(destino: pathlib.Path) -> pathlib.Path:
+    from PIL import Image, ImageDraw
+
+    img = Image.new("RGB", (1600, 1600), "#1A202C")
+    dibujo = ImageDraw.Draw(img)
+    for i in range(0, 1600, 40):
+        dibujo.line([(0, i), (1600, 1600 - i)], fill="#B8860B", width=6)
+    ruta = destino / "logo_benchmark.jpg"
+    img.save(ruta, "JPEG", quality=90)
+    return ruta
+
+
+def _datos(renglones: int) -> dict:
+    return {
+        "nombre": "Benchmark",
+        "departamento": "Guatemala",
+        "fecha": "2026-01-01",
+        "renglones": [
+            {
+                "descripcion": f"Fase {i // 40} - Renglón de prueba número {i} con descripción mediana",
+                "unidad": "m2",
+                "cantidad": float(i % 97 + 1),
+                "precio_unitario": 125.5,
+                "total": float(i % 97 + 1) * 125.5,
+            }
+            for i in range(renglones)
+        ],
+    }
+
+
+def _medir(nombre: str, generador, datos: dict, repeticiones: int) -> None:
+    tiempos: list[float] = []
+    paginas = 0
+    for _ in range(repeticiones):
+        buffer = io.BytesIO()
+        t0 = time.perf_counter()
+        generador(datos, destino=buffer)
+        tiempos.append(time.perf_counter() - t0)
+        paginas = len(_PAGINA.findall(buffer.getvalue()))
+    mediana = statistics.median(tiempos)
+    print(
+        f"{nombre:<12} {paginas:>4} págs  {len(datos['renglones']):>6} renglones  "
+        f"{mediana * 1000:>9.1f} ms  {paginas / mediana:>8.1f} págs/s"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--paginas", type=int, nargs="+", default=[10, 500])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--logo", type=pathlib.Path, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        logo = args.logo or _logo_sintetico(pathlib.Path(tmp))
+        os.environ["PDF_LOGO_PATH"] = str(logo)
+        print(f"logo: {logo} ({logo.stat().st_size // 1024} KB)")
+
+        for paginas in args.paginas:
+            _medir(
+                "simple",
+                generar_pdf_presupuesto,
+                _datos(paginas * _RENGLONES_POR_PAGINA["simple"]),
+                args.repeticiones,
+            )
+            _medir(
+                "profesional",
+                generar_pdf_presupuesto_profesional,
+                _datos(paginas * _RENGLONES_POR_PAGINA["profesional"]),
+                args.repeticiones,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ import pathlib
 import sys
 
 from sqlalchemy.dialects import postgresql
-from sqlalchemy.schema import CreateTable
+from sqlalchemy.schema import CreateIndex, CreateTable
 from sqlalchemy.sql.sqltypes import Enum as SAEnum
 
 sys.path.append(str(pathlib.Path(__file__).resolve().parents[1]))
@@ -72,6 +72,13 @@ def main() -> None:
         lines.append(str(CreateTable(table).compile(dialect=dialect)).rstrip() + ";")
         lines.append("")
 
+    # Same indexes as the Alembic migrations (IF NOT EXISTS keeps the file re-runnable).
+    lines.append("-- Indexes")
+    for table in models.Base.metadata.sorted_tables:
+        for index in sorted(table.indexes, key=lambda i: i.name or ""):
+            lines.append(str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect)).rstrip() + ";")
+    lines.append("")
+
     out_path.write_text("\n".join(lines), encoding="utf-8")
     print(f"Wrote: {out_path}")
 
@@ -0,0 +1,252 @@
+"""Prueba de carga HTTP (httpx async) con reporte p50/p95/p99 por endpoint.
+
+Flujo típico (BD desechable + LLM falso):
+
+    python backend/scripts/seed_datos_sinteticos.py --confirmar --manifiesto /tmp/manifiesto.json
+    python backend/scripts/stub_llm.py --puerto 8089 &
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub IA_CACHE_ENABLED=false \\
+        uvicorn backend.main:app --workers 2 &
+    python backend/scripts/load_test.py --manifiesto /tmp/manifiesto.json \\
+        --duracion 60 --concurrencia 32 --salida /tmp/carga.json --comparar /tmp/carga_base.json
+
+Con `--comparar` se marca como regresión todo endpoint cuyo p95 empeore más
+de `--umbral` (default 20 %) respecto a una corrida anterior guardada con
+`--salida`. El código de salida es 1 si hay regresiones (útil en CI).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import datetime
+import json
+import pathlib
+import random
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+
+@dataclass
+class Metricas:
+    latencias_ms: list[float] = field(default_factory=list)
+    errores: int = 0
+    codigos: dict[int, int] = field(default_factory=dict)
+
+
+def _percentil(valores: list[float], p: float) -> float:
+    if not valores:
+        return 0.0
+    ordenados = sorted(valores)
+    k = (len(ordenados) - 1) * p / 100
+    f = int(k)
+    c = min(f + 1, len(ordenados) - 1)
+    return ordenados[f] + (ordenados[c] - ordenados[f]) * (k - f)
+
+
+Peticion = Callable[[httpx.AsyncClient], Awaitable[httpx.Response]]
+
+
+def _escenario(manifiesto: dict[str, Any], *, con_ia: bool) -> list[tuple[str, int, Peticion]]:
+    """(nombre, peso, función) por endpoint. Los pesos aproximan el tráfico real."""
+
+    proyectos = manifiesto["proyectos"]
+    renglones = manifiesto["renglones"]
+    trabajadores = manifiesto["trabajadores"]
+
+    def inventario(c: httpx.AsyncClient):
+        return c.get("/inventario/resumen", params={"proyecto_id": random.choice(proyectos)})
+
+    def reportar_avance(c: httpx.AsyncClient):
+        return c.post(
+            "/campo/reportar-avance",
+            json={
+                "renglon_id": random.choice(renglones),
+                "cantidad": round(random.uniform(0.5, 10), 2),
+                "lat": 14.6 + random.random() / 10,
+                "lon": -90.5 + random.random() / 10,
+                "comentario": "carga",
+            },
+        )
+
+    def asistencia(c: httpx.AsyncClient):
+        return c.post(
+            "/campo/asistencia",
+            json={
+                "trabajador_id": random.choice(trabajadores),
+                "latitud": 14.6,
+                "longitud": -90.5,
+                "fecha": datetime.datetime.utcnow().isoformat(),
+            },
+        )
+
+    def estado_resultado(c: httpx.AsyncClient):
+        return c.get(f"/finanzas/estado-resultado/{random.choice(proyectos)}")
+
+    def pdf(c: httpx.AsyncClient):
+        return c.get(f"/proyectos/{random.choice(proyectos)}/presupuesto/pdf")
+
+    def pdf_profesional(c: httpx.AsyncClient):
+        return c.get(f"/proyectos/{random.choice(proyectos)}/presupuesto/pdf-profesional")
+
+    escenario: list[tuple[str, int, Peticion]] = [
+        ("GET /inventario/resumen", 30, inventario),
+        ("POST /campo/reportar-avance", 20, reportar_avance),
+        ("POST /campo/asistencia", 25, asistencia),
+        ("GET /finanzas/estado-resultado/{id}", 15, estado_resultado),
+        ("GET /proyectos/{id}/presupuesto/pdf", 5, pdf),
+        ("GET /proyectos/{id}/presupuesto/pdf-profesional", 5, pdf_profesional),
+    ]
+
+    if con_ia:
+
+        def generar_apu(c: httpx.AsyncClient):
+            return c.post(
+                "/apu/generar",
+                json={
+                    "nombre_renglon": f"Levantado de muro {random.randint(1, 10_000)}",
+                    "departamento": "Guatemala",
+                    "cantidad": 10,
+                    "usar_cache": False,
+                },
+            )
+
+        escenario.append(("POST /apu/generar (LLM stub)", 5, generar_apu))
+    return escenario
+
+
+async def _login(c: httpx.AsyncClient, usuario: str, password: str) -> str:
+    r = await c.post("/auth/login", data={"username": usuario, "password": password})
+    r.raise_for_status()
+    return r.json()["access_token"]
+
+
+async def _correr(args: argparse.Namespace, manifiesto: dict[str, Any]) -> tuple[dict[str, Metricas], float]:
+    escenario = _escenario(manifiesto, con_ia=args.con_ia)
+    nombres = [e[0] for e in escenario]
+    pesos = [e[1] for e in escenario]
+    funciones = {e[0]: e[2] for e in escenario}
+    metricas = {n: Metricas() for n in nombres}
+
+    limites = httpx.Limits(max_connections=args.concurrencia, max_keepalive_connections=args.concurrencia)
+    async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout, limits=limites) as c:
+        token = await _login(c, manifiesto["usuario"], manifiesto["password"])
+        c.headers["Authorization"] = f"Bearer {token}"
+
+        fin = time.perf_counter() + args.duracion
+
+        async def usuario_virtual() -> None:
+            while time.perf_counter() < fin:
+                nombre = random.choices(nombres, weights=pesos)[0]
+                m = metricas[nombre]
+                t0 = time.perf_counter()
+                try:
+                    r = await funciones[nombre](c)
+                    status = r.status_code
+                except httpx.HTTPError:
+                    status = 0
+                m.latencias_ms.append((time.perf_counter() - t0) * 1000)
+                m.codigos[status] = m.codigos.get(status, 0) + 1
+                if not 200 <= status < 300:
+                    m.errores += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(usuario_virtual() for _ in range(args.concurrencia)))
+        return metricas, time.perf_counter() - t0
+
+
+def _resumen(metricas: dict[str, Metricas], duracion: float) -> dict[str, dict[str, Any]]:
+    return {
+        nombre: {
+            "peticiones": len(m.latencias_ms),
+            "errores": m.errores,
+            "codigos": {str(k): v for k, v in sorted(m.codigos.items())},
+            "rps": round(len(m.latencias_ms) / duracion, 2) if duracion > 0 else 0.0,
+            "p50_ms": round(_percentil(m.latencias_ms, 50), 1),
+            "p95_ms": round(_percentil(m.latencias_ms, 95), 1),
+            "p99_ms": round(_percentil(m.latencias_ms, 99), 1),
+            "media_ms": round(statistics.fmean(m.latencias_ms), 1) if m.latencias_ms else 0.0,
+        }
+        for nombre, m in metricas.items()
+    }
+
+
+def _imprimir(resumen: dict[str, dict[str, Any]], base: dict[str, dict[str, Any]] | None, umbral: float) -> int:
+    ancho = max(len(n) for n in resumen)
+    cols = f"{'endpoint':<{ancho}}  {'n':>7}  {'err':>5}  {'rps':>7}  {'p50':>8}  {'p95':>8}  {'p99':>8}"
+    if base:
+        cols += f"  {'Δp95':>8}"
+    print(cols)
+    print("-" * len(cols))
+
+    regresiones = 0
+    for nombre, r in resumen.items():
+        linea = (
+            f"{nombre:<{ancho}}  {r['peticiones']:>7}  {r['errores']:>5}  {r['rps']:>7.1f}  "
+            f"{r['p50_ms']:>8.1f}  {r['p95_ms']:>8.1f}  {r['p99_ms']:>8.1f}"
+        )
+        previo = (base or {}).get(nombre)
+        if previo and previo.get("p95_ms"):
+            delta = (r["p95_ms"] - previo["p95_ms"]) / previo["p95_ms"]
+            linea += f"  {delta:>+7.0%}"
+            if delta > umbral:
+                linea += "  REGRESIÓN"
+                regresiones += 1
+        print(linea)
+
+    total = sum(r["peticiones"] for r in resumen.values())
+    errores = sum(r["errores"] for r in resumen.values())
+    rps = sum(r["rps"] for r in resumen.values())
+    print("-" * len(cols))
+    print(f"Total: {total} peticiones, {errores} errores, {rps:.1f} req/s")
+    return regresiones
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--manifiesto", type=pathlib.Path, required=True, help="Salida de seed_datos_sinteticos.py")
+    parser.add_argument("--duracion", type=float, default=30.0, help="Segundos de carga (default 30)")
+    parser.add_argument("--concurrencia", type=int, default=16, help="Usuarios virtuales (default 16)")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--con-ia", action="store_true", help="Incluye /apu/generar (requiere stub_llm.py)")
+    parser.add_argument("--salida", type=pathlib.Path, default=None, help="Guarda el resumen en JSON")
+    parser.add_argument("--comparar", type=pathlib.Path, default=None, help="Resumen JSON de una corrida base")
+    parser.add_argument("--umbral", type=float, default=0.2, help="Regresión si p95 empeora más que esto (0.2 = 20 %%)")
+    args = parser.parse_args()
+
+    manifiesto = json.loads(args.manifiesto.read_text(encoding="utf-8"))
+    metricas, duracion = asyncio.run(_correr(args, manifiesto))
+    resumen = _resumen(metricas, duracion)
+
+    base = None
+    if args.comparar is not None and args.comparar.exists():
+        base = json.loads(args.comparar.read_text(encoding="utf-8")).get("endpoints")
+
+    regresiones = _imprimir(resumen, base, args.umbral)
+
+    if args.salida is not None:
+        args.salida.write_text(
+            json.dumps(
+                {
+                    "fecha": datetime.datetime.utcnow().isoformat(),
+                    "duracion_s": round(duracion, 2),
+                    "concurrencia": args.concurrencia,
+                    "endpoints": resumen,
+                },
+                indent=2,
+                ensure_ascii=False,
+            ),
+            encoding="utf-8",
+        )
+
+    if regresiones:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""Paso de deploy: deja el esquema al día antes de arrancar la API.
+
+    PYTHONPATH=. python -m backend.scripts.migrar
+
+1. `create_all` crea las tablas que falten (una base nueva queda completa).
+2. `alembic upgrade head` aplica lo que `create_all` no hace sobre tablas
+   existentes: columnas e índices nuevos y el llenado inicial de las tablas
+   materializadas (stock_actual, presupuesto_insumo_totales).
+
+Las revisiones son idempotentes, así que el mismo paso sirve para una base
+nueva y para una que ya corría una versión anterior.
+"""
+
+from __future__ import annotations
+
+import pathlib
+import sys
+
+_ROOT = pathlib.Path(__file__).resolve().parents[2]
+if str(_ROOT) not in sys.path:
+    sys.path.insert(0, str(_ROOT))
+
+from alembic import command  # noqa: E402
+from alembic.config import Config  # noqa: E402
+
+from backend import models  # noqa: E402
+from backend.database import engine  # noqa: E402
+
+
+def main() -> None:
+    models.Base.metadata.create_all(bind=engine)
+    command.upgrade(Config(str(_ROOT / "backend" / "alembic.ini")), "head")
+
+
+if __name__ == "__main__":
+    main()
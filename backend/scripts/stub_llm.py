@@ -0,0 +1,109 @@
+"""Servidor LLM falso compatible con `POST /v1/chat/completions` (pruebas de carga).
+
+Responde un APU válido para cualquier prompt, con una latencia configurable,
+para medir el backend sin pagar (ni esperar) a OpenAI:
+
+    python backend/scripts/stub_llm.py --puerto 8089 --latencia-ms 800
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=stub uvicorn backend.main:app
+
+La respuesta (unidad + insumos) pasa la validación de `ia_apu`; los precios
+varían ±10 % para que los upserts de insumos no sean siempre idénticos.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+_INSUMOS = [
+    {"tipo": "material", "nombre": "Block de 15", "unidad": "unidad", "rendimiento": 12.5, "precio_guate": 5.5},
+    {"tipo": "material", "nombre": "Cemento UGC", "unidad": "saco", "rendimiento": 0.25, "precio_guate": 82.0},
+    {"tipo": "material", "nombre": "Arena de río", "unidad": "m3", "rendimiento": 0.03, "precio_guate": 180.0},
+    {"tipo": "mano_obra", "nombre": "Albañil + Ayudante", "unidad": "m2", "rendimiento": 1.0, "precio_guate": 45.0},
+    {"tipo": "equipo", "nombre": "Andamio", "unidad": "día", "rendimiento": 0.1, "precio_guate": 35.0},
+]
+
+
+def _apu() -> dict:
+    insumos = []
+    for base in _INSUMOS:
+        insumo = dict(base)
+        insumo["precio_guate"] = round(base["precio_guate"] * random.uniform(0.9, 1.1), 2)
+        insumos.append(insumo)
+    return {"unidad": "m2", "insumos": insumos}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    latencia_s = 0.0
+    jitter_s = 0.0
+    tasa_429 = 0.0
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length") or 0)
+        self.rfile.read(length)
+        cls = type(self)
+
+        if cls.tasa_429 and random.random() < cls.tasa_429:
+            self._responder(429, {"error": {"message": "rate limited (stub)", "type": "rate_limit"}})
+            return
+
+        time.sleep(max(0.0, cls.latencia_s + random.uniform(-cls.jitter_s, cls.jitter_s)))
+        self._responder(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": json.dumps(_apu(), ensure_ascii=False)},
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            },
+        )
+
+    def _responder(self, status: int, body: dict) -> None:
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8089)
+    parser.add_argument("--latencia-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=100.0)
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Fracción de respuestas 429 (0-1)")
+    args = parser.parse_args()
+
+    _Handler.latencia_s = args.latencia_ms / 1000
+    _Handler.jitter_s = args.jitter_ms / 1000
+    _Handler.tasa_429 = args.tasa_429
+
+    server = ThreadingHTTPServer((args.host, args.puerto), _Handler)
+    print(f"LLM stub en http://{args.host}:{args.puerto}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -24,6 +24,22 @@ CREATE TABLE insumos_maestro (
 );
 
 
+CREATE TABLE jobs (
+	id UUID NOT NULL, 
+	tipo VARCHAR(50) NOT NULL, 
+	estado VARCHAR(20), 
+	completados INTEGER, 
+	total INTEGER, 
+	parametros JSON, 
+	parciales JSON, 
+	resultado JSON, 
+	error VARCHAR(1000), 
+	creado_en TIMESTAMP WITHOUT TIME ZONE, 
+	actualizado_en TIMESTAMP WITHOUT TIME ZONE, 
+	PRIMARY KEY (id)
+);
+
+
 CREATE TABLE proyectos (
 	id UUID NOT NULL, 
 	nombre_proyecto VARCHAR NOT NULL, 
@@ -43,6 +59,7 @@ CREATE TABLE usuarios (
 	approved_by_id UUID, 
 	approved_at TIMESTAMP WITHOUT TIME ZONE, 
 	creado_en TIMESTAMP WITHOUT TIME ZONE, 
+	token_version INTEGER DEFAULT '0' NOT NULL, 
 	PRIMARY KEY (id), 
 	UNIQUE (username), 
 	UNIQUE (email), 
@@ -77,6 +94,9 @@ CREATE TABLE fotos_bitacora (
 	id UUID NOT NULL, 
 	proyecto_id UUID, 
 	url_foto VARCHAR(255), 
+	url_thumbnail VARCHAR(255), 
+	url_webp VARCHAR(255), 
+	sha256 VARCHAR(64), 
 	comentario VARCHAR(500), 
 	fecha_registro TIMESTAMP WITHOUT TIME ZONE, 
 	PRIMARY KEY (id), 
@@ -133,6 +153,18 @@ CREATE TABLE ordenes_compra (
 );
 
 
+CREATE TABLE presupuesto_insumo_totales (
+	proyecto_id UUID NOT NULL, 
+	insumo_id UUID NOT NULL, 
+	cantidad_presupuestada FLOAT NOT NULL, 
+	cantidad_comprada FLOAT NOT NULL, 
+	actualizado_en TIMESTAMP WITHOUT TIME ZONE, 
+	PRIMARY KEY (proyecto_id, insumo_id), 
+	FOREIGN KEY(proyecto_id) REFERENCES proyectos (id), 
+	FOREIGN KEY(insumo_id) REFERENCES insumos_maestro (id)
+);
+
+
 CREATE TABLE presupuesto_renglones (
 	id UUID NOT NULL, 
 	proyecto_id UUID NOT NULL, 
@@ -145,6 +177,17 @@ CREATE TABLE presupuesto_renglones (
 );
 
 
+CREATE TABLE stock_actual (
+	proyecto_id UUID NOT NULL, 
+	insumo_id UUID NOT NULL, 
+	cantidad FLOAT NOT NULL, 
+	actualizado_en TIMESTAMP WITHOUT TIME ZONE, 
+	PRIMARY KEY (proyecto_id, insumo_id), 
+	FOREIGN KEY(proyecto_id) REFERENCES proyectos (id), 
+	FOREIGN KEY(insumo_id) REFERENCES insumos_maestro (id)
+);
+
+
 CREATE TABLE trabajadores (
 	id UUID NOT NULL, 
 	nombre_completo VARCHAR(200) NOT NULL, 
@@ -181,6 +224,7 @@ CREATE TABLE asistencia (
 	latitud_gps FLOAT, 
 	longitud_gps FLOAT, 
 	gps_check BOOLEAN, 
+	idempotency_key VARCHAR(100), 
 	PRIMARY KEY (id), 
 	FOREIGN KEY(trabajador_id) REFERENCES trabajadores (id)
 );
@@ -231,6 +275,22 @@ CREATE TABLE fotos_evidencia (
 	id UUID NOT NULL, 
 	reporte_id UUID, 
 	url_foto VARCHAR(255) NOT NULL, 
+	url_thumbnail VARCHAR(255), 
+	url_webp VARCHAR(255), 
+	sha256 VARCHAR(64), 
 	PRIMARY KEY (id), 
 	FOREIGN KEY(reporte_id) REFERENCES reportes_avance (id)
 );
+
+-- Indexes
+CREATE UNIQUE INDEX IF NOT EXISTS uq_insumos_maestro_tipo_descripcion_unidad ON insumos_maestro (tipo, descripcion, unidad_compra);
+CREATE INDEX IF NOT EXISTS ix_movimientos_bodega_proyecto_insumo ON movimientos_bodega (proyecto_id, insumo_id);
+CREATE INDEX IF NOT EXISTS ix_ordenes_compra_proyecto_estado ON ordenes_compra (proyecto_id, estado);
+CREATE INDEX IF NOT EXISTS ix_presupuesto_renglones_proyecto_id ON presupuesto_renglones (proyecto_id);
+CREATE INDEX IF NOT EXISTS ix_apu_composicion_insumo_id ON apu_composicion (insumo_id);
+CREATE INDEX IF NOT EXISTS ix_apu_composicion_renglon_id ON apu_composicion (renglon_id);
+CREATE INDEX IF NOT EXISTS ix_asistencia_trabajador_fecha ON asistencia (trabajador_id, fecha);
+CREATE UNIQUE INDEX IF NOT EXISTS uq_asistencia_trabajador_idempotency_key ON asistencia (trabajador_id, idempotency_key);
+CREATE INDEX IF NOT EXISTS ix_detalle_orden_compra_insumo_id ON detalle_orden_compra (insumo_id);
+CREATE INDEX IF NOT EXISTS ix_detalle_orden_compra_oc_id ON detalle_orden_compra (oc_id);
+CREATE INDEX IF NOT EXISTS ix_reportes_avance_usuario_fecha ON reportes_avance (usuario_id, fecha_reporte);
@@ -1,12 +1,31 @@
 from __future__ import annotations
 
+import codecs
 import csv
+import datetime
 import io
-from typing import Any
-
+import itertools
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, BinaryIO, Iterator
+
+from sqlalchemy import insert, tuple_, update
 from sqlalchemy.orm import Session
 
 from backend import models
+from backend.presupuesto_service import sumar_comprado
+from backend.utils.procesos import contexto_pool
+
+
+_CHUNK_BYTES = 1024 * 1024
+
+_pool_lock = threading.Lock()
+_pool_validacion: ProcessPoolExecutor | None = None
+_procesos_validacion = 1
 
 
 def _first_present(row: dict[str, Any], keys: list[str]) -> str | None:
@@ -35,12 +54,282 @@ def _parse_float(value: Any) -> float:
     return float(s)
 
 
+def _env_int(name: str, default: int) -> int:
+    raw = os.getenv(name, str(default)).strip().strip('"').strip("'")
+    try:
+        return int(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser un entero") from exc
+
+
+def _abrir_texto(archivo: bytes | BinaryIO) -> io.TextIOWrapper:
+    """Envuelve el archivo binario en un lector de texto incremental.
+
+    Detecta la codificación con una pasada en bloques (memoria constante):
+    UTF-8 (con o sin BOM) y, si no decodifica, latin-1 como antes.
+    """
+
+    fileobj: BinaryIO = io.BytesIO(archivo) if isinstance(archivo, (bytes, bytearray)) else archivo
+    inicio = fileobj.tell()
+
+    encoding = "utf-8-sig"
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    try:
+        while True:
+            chunk = fileobj.read(_CHUNK_BYTES)
+            if not chunk:
+                decoder.decode(b"", final=True)
+                break
+            decoder.decode(chunk)
+    except UnicodeDecodeError:
+        encoding = "latin-1"
+
+    fileobj.seek(inicio)
+    return io.TextIOWrapper(fileobj, encoding=encoding, newline="")
+
+
+def _normalizar_fila(row: dict[str, Any], idx: int, departamento_default: str) -> dict[str, Any]:
+    """Valida una fila del CSV y retorna sus valores normalizados."""
+
+    proyecto_nombre = _first_present(row, ["proyecto", "nombre_proyecto"])
+    material_desc = _first_present(row, ["material", "descripcion"])
+    if not proyecto_nombre or not material_desc:
+        raise ValueError(f"Fila {idx}: faltan columnas requeridas proyecto/material")
+
+    departamento = (
+        _first_present(row, ["departamento"]) or departamento_default
+    ).strip() or departamento_default
+
+    tipo = (_first_present(row, ["tipo"]) or "material").strip().lower() or "material"
+
+    unidad = _first_present(row, ["unidad_compra", "unidad"])
+
+    cantidad_raw = _first_present(row, ["cantidad"])
+    precio_raw = _first_present(row, ["costo_unitario", "precio_unitario", "precio"])
+    if cantidad_raw is None or precio_raw is None:
+        raise ValueError(f"Fila {idx}: faltan columnas cantidad/costo_unitario")
+
+    try:
+        cantidad = _parse_float(cantidad_raw)
+        precio_unitario = _parse_float(precio_raw)
+    except ValueError:
+        raise ValueError(f"Fila {idx}: cantidad/costo_unitario no numéricos ({cantidad_raw}, {precio_raw})")
+    if cantidad <= 0:
+        raise ValueError(f"Fila {idx}: cantidad inválida ({cantidad_raw})")
+    if precio_unitario < 0:
+        raise ValueError(f"Fila {idx}: costo_unitario inválido ({precio_raw})")
+
+    return {
+        "idx": idx,
+        "proyecto": proyecto_nombre.strip(),
+        "departamento": departamento,
+        "material": material_desc.strip(),
+        "tipo": tipo,
+        "unidad": (unidad or "").strip(),
+        "cantidad": float(cantidad),
+        "precio_unitario": float(precio_unitario),
+    }
+
+
+def _lotes(reader: csv.DictReader, tamano: int) -> Iterator[list[tuple[int, dict[str, Any]]]]:
+    lote: list[tuple[int, dict[str, Any]]] = []
+    for idx, row in enumerate(reader, start=2):  # header is line 1
+        lote.append((idx, row))
+        if len(lote) >= tamano:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _validar_lote(lote: list[tuple[int, dict[str, Any]]], departamento_default: str) -> dict[str, Any]:
+    """Normaliza un lote sin tocar la BD (corre en un proceso del pool).
+
+    Retorna solo lo necesario para proyectar la importación, no las filas,
+    para que el resultado que viaja de vuelta al proceso principal sea pequeño.
+    """
+
+    validas = 0
+    errores: list[dict[str, Any]] = []
+    proyectos: dict[str, int] = {}
+    insumos: dict[tuple[str, str], tuple[int, bool]] = {}
+    for idx, row in lote:
+        try:
+            f = _normalizar_fila(row, idx, departamento_default)
+        except ValueError as exc:
+            errores.append({"fila": idx, "error": str(exc)})
+            continue
+        validas += 1
+        proyectos.setdefault(f["proyecto"], idx)
+        insumos.setdefault((f["material"], f["tipo"]), (idx, bool(f["unidad"])))
+    return {"filas": len(lote), "validas": validas, "errores": errores, "proyectos": proyectos, "insumos": insumos}
+
+
+def _get_pool_validacion() -> ProcessPoolExecutor:
+    global _pool_validacion, _procesos_validacion
+    with _pool_lock:
+        if _pool_validacion is None:
+            _procesos_validacion = max(1, _env_int("CSV_VALIDACION_PROCESOS", os.cpu_count() or 2))
+            _pool_validacion = ProcessPoolExecutor(
+                max_workers=_procesos_validacion, mp_context=contexto_pool()
+            )
+        return _pool_validacion
+
+
+def cerrar_pool_validacion(roto: ProcessPoolExecutor | None = None) -> None:
+    global _pool_validacion
+    with _pool_lock:
+        if roto is not None and _pool_validacion is not roto:
+            return
+        if _pool_validacion is not None:
+            _pool_validacion.shutdown(wait=False, cancel_futures=True)
+        _pool_validacion = None
+
+
+def _validar_lotes(reader: csv.DictReader, tamano: int, departamento_default: str) -> Iterator[dict[str, Any]]:
+    """Reparte los lotes en el pool de procesos manteniendo el orden.
+
+    Acota los lotes en vuelo para que la memoria no crezca con el archivo.
+    Si el pool no está disponible (p.ej. plataforma sin fork/semaphores)
+    o se rompe a mitad del archivo (murió un worker), valida en el proceso
+    actual; el pool roto se descarta para que la próxima validación use otro.
+    """
+
+    try:
+        pool = _get_pool_validacion()
+    except (OSError, NotImplementedError):
+        pool = None
+
+    if pool is None:
+        for lote in _lotes(reader, tamano):
+            yield _validar_lote(lote, departamento_default)
+        return
+
+    max_en_vuelo = 2 * _procesos_validacion
+    lotes = _lotes(reader, tamano)
+    en_vuelo: list[tuple[Future, list[tuple[int, dict[str, Any]]]]] = []
+    try:
+        for lote in lotes:
+            try:
+                futuro = pool.submit(_validar_lote, lote, departamento_default)
+            except BrokenProcessPool:
+                lotes = itertools.chain([lote], lotes)
+                raise
+            en_vuelo.append((futuro, lote))
+            if len(en_vuelo) >= max_en_vuelo:
+                yield en_vuelo[0][0].result()
+                en_vuelo.pop(0)
+        while en_vuelo:
+            yield en_vuelo[0][0].result()
+            en_vuelo.pop(0)
+    except BrokenProcessPool:
+        cerrar_pool_validacion(roto=pool)
+        for _futuro, lote in en_vuelo:
+            yield _validar_lote(lote, departamento_default)
+        for lote in lotes:
+            yield _validar_lote(lote, departamento_default)
+
+
+def validar_csv_maestro(
+    archivo: bytes | BinaryIO,
+    db: Session,
+    *,
+    departamento_default: str = "Guatemala",
+    tamano_lote: int | None = None,
+) -> dict[str, Any]:
+    """Valida el CSV completo sin escribir en la BD (modo `validate_only`).
+
+    La normalización de filas (`_parse_float`, columnas requeridas) corre en
+    un pool de procesos (CSV_VALIDACION_PROCESOS, default = núcleos) por lotes.
+    Retorna todos los errores de fila a la vez y cuántos proyectos, insumos,
+    órdenes y detalles crearía la importación. Para esas proyecciones se hacen
+    solo consultas de lectura (qué proyectos/insumos ya existen).
+    """
+
+    t0 = time.perf_counter()
+    tamano = max(1, tamano_lote or _env_int("CSV_IMPORT_LOTE", 5000))
+
+    texto = _abrir_texto(archivo)
+    try:
+        reader = csv.DictReader(texto)
+        if not reader.fieldnames:
+            raise ValueError("CSV sin encabezados")
+
+        filas = 0
+        validas = 0
+        errores: list[dict[str, Any]] = []
+        proyectos: dict[str, int] = {}
+        insumos: dict[tuple[str, str], tuple[int, bool]] = {}
+        try:
+            for parcial in _validar_lotes(reader, tamano, departamento_default):
+                filas += parcial["filas"]
+                validas += parcial["validas"]
+                errores.extend(parcial["errores"])
+                for nombre, idx in parcial["proyectos"].items():
+                    proyectos.setdefault(nombre, idx)
+                for key, primera in parcial["insumos"].items():
+                    insumos.setdefault(key, primera)
+        except csv.Error as exc:
+            raise ValueError(f"CSV mal formado: {exc}") from exc
+    finally:
+        texto.detach()
+
+    existentes_proyectos: set[str] = set()
+    nombres = list(proyectos)
+    for i in range(0, len(nombres), tamano):
+        existentes_proyectos.update(
+            nombre
+            for (nombre,) in db.query(models.Proyecto.nombre_proyecto).filter(
+                models.Proyecto.nombre_proyecto.in_(nombres[i : i + tamano])
+            )
+        )
+
+    existentes_insumos: set[tuple[str, str]] = set()
+    claves = list(insumos)
+    for i in range(0, len(claves), tamano):
+        existentes_insumos.update(
+            (desc, tipo)
+            for desc, tipo in db.query(models.InsumoMaestro.descripcion, models.InsumoMaestro.tipo).filter(
+                tuple_(models.InsumoMaestro.descripcion, models.InsumoMaestro.tipo).in_(claves[i : i + tamano])
+            )
+        )
+
+    insumos_a_crear = 0
+    for (material, tipo), (idx, tiene_unidad) in insumos.items():
+        if (material, tipo) in existentes_insumos:
+            continue
+        if not tiene_unidad:
+            errores.append(
+                {"fila": idx, "error": f"Fila {idx}: el insumo '{material}' no existe y falta unidad_compra/unidad"}
+            )
+            continue
+        insumos_a_crear += 1
+    errores.sort(key=lambda e: e["fila"])
+
+    duracion = time.perf_counter() - t0
+    return {
+        "status": "ok" if not errores else "con_errores",
+        "validate_only": True,
+        "filas": filas,
+        "filas_con_error": len({e["fila"] for e in errores}),
+        "errores": errores,
+        "proyectos_a_crear": len(proyectos.keys() - existentes_proyectos),
+        "insumos_a_crear": insumos_a_crear,
+        "ordenes_compra_a_crear": len(proyectos),
+        "detalles_a_crear": validas,
+        "duracion_s": round(duracion, 3),
+        "filas_por_segundo": round(filas / duracion, 1) if duracion > 0 else None,
+    }
+
+
 def procesar_csv_maestro(
-    file_bytes: bytes,
+    archivo: bytes | BinaryIO,
     db: Session,
     *,
     departamento_default: str = "Guatemala",
     estado_oc: str = "entregada",
+    tamano_lote: int | None = None,
+    validate_only: bool = False,
 ) -> dict[str, Any]:
     """Importa un CSV de compras/maestro al esquema actual.
 
@@ -61,132 +350,164 @@ def procesar_csv_maestro(
     - costo_unitario | precio_unitario | precio
 
     Otras columnas (p.ej. proveedor, categoria_gasto) se ignoran.
-    """
 
-    try:
-        text = file_bytes.decode("utf-8-sig")
-    except UnicodeDecodeError:
-        text = file_bytes.decode("latin-1")
-
-    stream = io.StringIO(text)
-    reader = csv.DictReader(stream)
-
-    if not reader.fieldnames:
-        raise ValueError("CSV sin encabezados")
-
-    proyectos_creados = 0
-    insumos_creados = 0
-    ocs_creadas = 0
-    detalles_creados = 0
-
-    cache_proyectos: dict[str, models.Proyecto] = {}
-    cache_insumos: dict[tuple[str, str], models.InsumoMaestro] = {}
-    oc_por_proyecto_id: dict[Any, models.OrdenCompra] = {}
-
-    estado_oc_norm = (estado_oc or "").strip().lower() or "entregada"
-
-    for idx, row in enumerate(reader, start=2):  # header is line 1
-        proyecto_nombre = _first_present(row, ["proyecto", "nombre_proyecto"])
-        material_desc = _first_present(row, ["material", "descripcion"])
-        if not proyecto_nombre or not material_desc:
-            raise ValueError(f"Fila {idx}: faltan columnas requeridas proyecto/material")
-
-        proyecto_nombre = proyecto_nombre.strip()
-        material_desc = material_desc.strip()
-
-        departamento = (
-            _first_present(row, ["departamento"]) or departamento_default
-        ).strip() or departamento_default
+    `archivo` puede ser bytes o un archivo binario (p.ej. `UploadFile.file`);
+    se lee en streaming y se procesa en lotes de `CSV_IMPORT_LOTE` filas
+    (default 5000): proyectos/insumos se resuelven con una consulta por lote y
+    los detalles se insertan con un INSERT multi-fila. Toda la importación es
+    una sola transacción, así que un error en cualquier fila no deja datos
+    parciales.
 
-        tipo = (_first_present(row, ["tipo"]) or "material").strip().lower() or "material"
+    Con `validate_only=True` no escribe nada: delega en `validar_csv_maestro`.
+    """
 
-        unidad = _first_present(row, ["unidad_compra", "unidad"])
-        unidad = (unidad or "").strip()
+    if validate_only:
+        return validar_csv_maestro(
+            archivo, db, departamento_default=departamento_default, tamano_lote=tamano_lote
+        )
 
-        cantidad_raw = _first_present(row, ["cantidad"])
-        precio_raw = _first_present(row, ["costo_unitario", "precio_unitario", "precio"])
-        if cantidad_raw is None or precio_raw is None:
-            raise ValueError(f"Fila {idx}: faltan columnas cantidad/costo_unitario")
+    t0 = time.perf_counter()
+    tamano = max(1, tamano_lote or _env_int("CSV_IMPORT_LOTE", 5000))
 
-        cantidad = _parse_float(cantidad_raw)
-        precio_unitario = _parse_float(precio_raw)
-        if cantidad <= 0:
-            raise ValueError(f"Fila {idx}: cantidad inválida ({cantidad_raw})")
-        if precio_unitario < 0:
-            raise ValueError(f"Fila {idx}: costo_unitario inválido ({precio_raw})")
-
-        # 1) Proyecto
-        proyecto = cache_proyectos.get(proyecto_nombre)
-        if proyecto is None:
-            proyecto = (
-                db.query(models.Proyecto)
-                .filter(models.Proyecto.nombre_proyecto == proyecto_nombre)
-                .first()
-            )
-            if proyecto is None:
-                proyecto = models.Proyecto(
-                    nombre_proyecto=proyecto_nombre,
-                    departamento=departamento,
-                )
-                db.add(proyecto)
-                db.flush()
-                proyectos_creados += 1
-            cache_proyectos[proyecto_nombre] = proyecto
-
-        # 2) Insumo
-        key = (material_desc, tipo)
-        insumo = cache_insumos.get(key)
-        if insumo is None:
-            insumo = (
-                db.query(models.InsumoMaestro)
-                .filter(models.InsumoMaestro.descripcion == material_desc)
-                .filter(models.InsumoMaestro.tipo == tipo)
-                .first()
-            )
-            if insumo is None:
-                if not unidad:
-                    raise ValueError(
-                        f"Fila {idx}: el insumo '{material_desc}' no existe y falta unidad_compra/unidad"
+    texto = _abrir_texto(archivo)
+    try:
+        reader = csv.DictReader(texto)
+
+        if not reader.fieldnames:
+            raise ValueError("CSV sin encabezados")
+
+        proyectos_creados = 0
+        insumos_creados = 0
+        detalles_creados = 0
+
+        cache_proyectos: dict[str, uuid.UUID] = {}
+        cache_insumos: dict[tuple[str, str], uuid.UUID] = {}
+        oc_por_proyecto_id: dict[uuid.UUID, uuid.UUID] = {}
+        total_por_oc: dict[uuid.UUID, float] = {}
+        comprado: dict[tuple[uuid.UUID, uuid.UUID], float] = {}
+
+        estado_oc_norm = (estado_oc or "").strip().lower() or "entregada"
+
+        for lote in _lotes(reader, tamano):
+            filas = [_normalizar_fila(row, idx, departamento_default) for idx, row in lote]
+
+            # 1) Proyectos: una consulta por lote + un INSERT multi-fila para los nuevos.
+            nombres = {f["proyecto"] for f in filas} - cache_proyectos.keys()
+            if nombres:
+                for pid, nombre in db.query(models.Proyecto.id, models.Proyecto.nombre_proyecto).filter(
+                    models.Proyecto.nombre_proyecto.in_(nombres)
+                ):
+                    cache_proyectos.setdefault(nombre, pid)
+
+                nuevos: dict[str, dict[str, Any]] = {}
+                for f in filas:
+                    if f["proyecto"] not in cache_proyectos and f["proyecto"] not in nuevos:
+                        nuevos[f["proyecto"]] = {
+                            "id": uuid.uuid4(),
+                            "nombre_proyecto": f["proyecto"],
+                            "departamento": f["departamento"],
+                        }
+                if nuevos:
+                    db.execute(insert(models.Proyecto), list(nuevos.values()))
+                    for nombre, fila in nuevos.items():
+                        cache_proyectos[nombre] = fila["id"]
+                    proyectos_creados += len(nuevos)
+
+            # 2) Insumos (por descripcion + tipo).
+            claves = {(f["material"], f["tipo"]) for f in filas} - cache_insumos.keys()
+            if claves:
+                for iid, desc, tipo in db.query(
+                    models.InsumoMaestro.id,
+                    models.InsumoMaestro.descripcion,
+                    models.InsumoMaestro.tipo,
+                ).filter(tuple_(models.InsumoMaestro.descripcion, models.InsumoMaestro.tipo).in_(claves)):
+                    cache_insumos.setdefault((desc, tipo), iid)
+
+                nuevos_insumos: dict[tuple[str, str], dict[str, Any]] = {}
+                for f in filas:
+                    key = (f["material"], f["tipo"])
+                    if key in cache_insumos or key in nuevos_insumos:
+                        continue
+                    if not f["unidad"]:
+                        raise ValueError(
+                            f"Fila {f['idx']}: el insumo '{f['material']}' no existe y falta unidad_compra/unidad"
+                        )
+                    nuevos_insumos[key] = {
+                        "id": uuid.uuid4(),
+                        "descripcion": f["material"],
+                        "tipo": f["tipo"],
+                        "unidad_compra": f["unidad"],
+                        "precio_referencial_gtq": f["precio_unitario"],
+                        "ultimo_sondeo_ia": datetime.datetime.utcnow(),
+                    }
+                if nuevos_insumos:
+                    db.execute(insert(models.InsumoMaestro), list(nuevos_insumos.values()))
+                    for key, fila in nuevos_insumos.items():
+                        cache_insumos[key] = fila["id"]
+                    insumos_creados += len(nuevos_insumos)
+
+            # 3) Orden de compra (1 por proyecto por importación).
+            nuevas_oc: list[dict[str, Any]] = []
+            for f in filas:
+                proyecto_id = cache_proyectos[f["proyecto"]]
+                if proyecto_id not in oc_por_proyecto_id:
+                    oc_id = uuid.uuid4()
+                    oc_por_proyecto_id[proyecto_id] = oc_id
+                    total_por_oc[oc_id] = 0.0
+                    nuevas_oc.append(
+                        {
+                            "id": oc_id,
+                            "proyecto_id": proyecto_id,
+                            "estado": estado_oc_norm,
+                            "fecha_emision": datetime.datetime.utcnow(),
+                            "total_oc": 0.0,
+                        }
                     )
-                insumo = models.InsumoMaestro(
-                    descripcion=material_desc,
-                    tipo=tipo,
-                    unidad_compra=unidad,
-                    precio_referencial_gtq=float(precio_unitario),
+            if nuevas_oc:
+                db.execute(insert(models.OrdenCompra), nuevas_oc)
+
+            # 4) Detalles: un INSERT multi-fila por lote.
+            detalles: list[dict[str, Any]] = []
+            for f in filas:
+                oc_id = oc_por_proyecto_id[cache_proyectos[f["proyecto"]]]
+                subtotal = f["cantidad"] * f["precio_unitario"]
+                detalles.append(
+                    {
+                        "id": uuid.uuid4(),
+                        "oc_id": oc_id,
+                        "insumo_id": cache_insumos[(f["material"], f["tipo"])],
+                        "cantidad_pedida": f["cantidad"],
+                        "precio_unitario_compra": f["precio_unitario"],
+                        "subtotal": float(subtotal),
+                    }
                 )
-                db.add(insumo)
-                db.flush()
-                insumos_creados += 1
-            cache_insumos[key] = insumo
-
-        # 3) Orden de compra (1 por proyecto por importación)
-        oc = oc_por_proyecto_id.get(proyecto.id)
-        if oc is None:
-            oc = models.OrdenCompra(proyecto_id=proyecto.id, estado=estado_oc_norm)
-            db.add(oc)
-            db.flush()
-            oc_por_proyecto_id[proyecto.id] = oc
-            ocs_creadas += 1
-
-        subtotal = float(cantidad) * float(precio_unitario)
-        detalle = models.DetalleOrdenCompra(
-            oc_id=oc.id,
-            insumo_id=insumo.id,
-            cantidad_pedida=float(cantidad),
-            precio_unitario_compra=float(precio_unitario),
-            subtotal=float(subtotal),
-        )
-        db.add(detalle)
-        detalles_creados += 1
-
-        oc.total_oc = float(getattr(oc, "total_oc", 0.0) or 0.0) + float(subtotal)
+                total_por_oc[oc_id] += float(subtotal)
+            db.execute(insert(models.DetalleOrdenCompra), detalles)
+            detalles_creados += len(detalles)
+            for f, d in zip(filas, detalles):
+                clave = (cache_proyectos[f["proyecto"]], d["insumo_id"])
+                comprado[clave] = comprado.get(clave, 0.0) + float(d["cantidad_pedida"])
+
+        if total_por_oc:
+            db.execute(
+                update(models.OrdenCompra),
+                [{"id": oc_id, "total_oc": total} for oc_id, total in total_por_oc.items()],
+            )
+        # Índice de disponibilidad: un solo upsert con lo comprado en todo el archivo.
+        sumar_comprado(db, comprado)
 
-    db.commit()
+        db.commit()
+    finally:
+        # No cerrar el archivo del llamador (UploadFile lo gestiona FastAPI).
+        texto.detach()
 
+    duracion = time.perf_counter() - t0
     return {
         "status": "ok",
         "proyectos_creados": proyectos_creados,
         "insumos_creados": insumos_creados,
-        "ordenes_compra_creadas": ocs_creadas,
+        "ordenes_compra_creadas": len(oc_por_proyecto_id),
         "detalles_creados": detalles_creados,
+        "duracion_s": round(duracion, 3),
+        "filas_por_segundo": round(detalles_creados / duracion, 1) if duracion > 0 else None,
     }
@@ -0,0 +1,135 @@
+"""Paginación por keyset (cursor) para endpoints de listado.
+
+A diferencia de OFFSET, el costo de cada página no crece con la posición:
+el cursor guarda (valor del campo de orden, id) de la última fila y la
+siguiente página filtra `WHERE (campo, id) > (valor, id)` usando el índice.
+
+Uso típico en un endpoint:
+
+    orden_sql = parse_orden(orden, {"fecha": models.GastoPersonal.fecha})
+    filas, next_cursor = paginar(q, orden=orden_sql, id_col=models.GastoPersonal.id,
+                                 limit=limit, cursor=cursor)
+
+`parse_orden` acepta "campo" (ascendente) o "-campo" (descendente). Los NULL
+del campo de orden van siempre al final. Un cursor solo es válido con el
+mismo `orden` con el que se generó. Errores de parámetros -> ValueError.
+"""
+
+from __future__ import annotations
+
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any
+
+from sqlalchemy import and_, or_
+from sqlalchemy.engine import Row
+from sqlalchemy.orm import Query
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+
+@dataclass(frozen=True)
+class Orden:
+    campo: str
+    columna: InstrumentedAttribute
+    descendente: bool = False
+
+    @property
+    def texto(self) -> str:
+        return f"-{self.campo}" if self.descendente else self.campo
+
+
+def parse_orden(orden: str, permitidos: dict[str, InstrumentedAttribute]) -> Orden:
+    raw = (orden or "").strip()
+    descendente = raw.startswith("-")
+    campo = raw.lstrip("+-").strip()
+    if campo not in permitidos:
+        raise ValueError(f"orden inválido '{orden}'. Permitidos: {sorted(permitidos)} (prefijo '-' = descendente)")
+    return Orden(campo=campo, columna=permitidos[campo], descendente=descendente)
+
+
+def _a_json(value: Any) -> Any:
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def _desde_json(value: Any, columna: InstrumentedAttribute) -> Any:
+    if value is None:
+        return None
+    try:
+        tipo = columna.type.python_type
+    except NotImplementedError:
+        return value
+    if tipo is datetime.datetime:
+        return datetime.datetime.fromisoformat(value)
+    if tipo is uuid.UUID:
+        return uuid.UUID(str(value))
+    return tipo(value)
+
+
+def codificar_cursor(orden: Orden, valor: Any, id_valor: Any) -> str:
+    payload = json.dumps({"o": orden.texto, "v": _a_json(valor), "id": _a_json(id_valor)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str, orden: Orden, id_col: InstrumentedAttribute) -> tuple[Any, Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["o"] != orden.texto:
+            raise ValueError("cursor generado con otro orden")
+        return _desde_json(payload["v"], orden.columna), _desde_json(payload["id"], id_col)
+    except ValueError as exc:
+        raise ValueError(f"cursor inválido: {exc}") from exc
+    except (KeyError, TypeError, binascii.Error, UnicodeError) as exc:
+        raise ValueError("cursor inválido") from exc
+
+
+def _valor_de_fila(fila: Any, atributo: InstrumentedAttribute) -> Any:
+    objetos = tuple(fila) if isinstance(fila, Row) else (fila,)
+    for obj in objetos:
+        if isinstance(obj, atributo.class_):
+            return getattr(obj, atributo.key)
+    raise ValueError(f"La consulta no incluye {atributo.class_.__name__}")
+
+
+def paginar(
+    query: Query,
+    *,
+    orden: Orden,
+    id_col: InstrumentedAttribute,
+    limit: int,
+    cursor: str | None = None,
+) -> tuple[list[Any], str | None]:
+    """Aplica orden + keyset + LIMIT a `query`. Retorna (filas, next_cursor)."""
+
+    col = orden.columna
+    if cursor:
+        valor, id_valor = decodificar_cursor(cursor, orden, id_col)
+        if valor is None:
+            # Ya estamos en la cola de NULLs: solo desempata el id.
+            query = query.filter(and_(col.is_(None), id_col > id_valor))
+        else:
+            pasado = col < valor if orden.descendente else col > valor
+            query = query.filter(
+                or_(pasado, and_(col == valor, id_col > id_valor), col.is_(None))
+            )
+
+    query = query.order_by(
+        (col.desc() if orden.descendente else col.asc()).nulls_last(),
+        id_col.asc(),
+    )
+    filas = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = codificar_cursor(orden, _valor_de_fila(ultima, col), _valor_de_fila(ultima, id_col))
+    return filas, next_cursor
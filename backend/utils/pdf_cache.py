@@ -0,0 +1,153 @@
+"""Caché en disco de PDFs generados, direccionado por contenido.
+
+El nombre del archivo lleva la clave (hash de los datos + versión de la
+plantilla), así una descarga repetida con los mismos datos reutiliza el
+archivo en vez de volver a correr reportlab, y el ETag de la respuesta es
+la misma clave.
+
+La recolección (`recolectar`) borra artefactos más viejos que
+`PDF_CACHE_MAX_DIAS` y, si el directorio sigue sobre `PDF_CACHE_MAX_MB`,
+los menos usados primero (cada acierto actualiza el mtime). Corre como
+máximo cada `PDF_CACHE_GC_INTERVALO_S` tras generar un archivo nuevo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+import tempfile
+import threading
+import time
+from typing import Any, Callable
+
+# Subir la versión cuando cambie el diseño de un documento: invalida sus PDFs cacheados.
+VERSION_PLANTILLA = {
+    "presupuesto": "2",
+    "presupuesto_profesional": "2",
+}
+
+_gc_lock = threading.Lock()
+_ultimo_gc = 0.0
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} must be a number") from exc
+
+
+def clave(plantilla: str, *partes: Any) -> str:
+    """sha256 de (plantilla, versión, partes...). `partes` debe ser serializable a JSON."""
+
+    payload = json.dumps(
+        [plantilla, VERSION_PLANTILLA.get(plantilla, "1"), *partes],
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def etag(clave_pdf: str) -> str:
+    return f'"{clave_pdf[:32]}"'
+
+
+def etag_coincide(if_none_match: str | None, valor: str) -> bool:
+    if not if_none_match:
+        return False
+    candidatos = {v.strip().removeprefix("W/") for v in if_none_match.split(",")}
+    return "*" in candidatos or valor in candidatos
+
+
+def obtener_o_generar(
+    directorio: pathlib.Path,
+    nombre: str,
+    generar: Callable[[pathlib.Path], str | os.PathLike],
+) -> tuple[pathlib.Path, bool]:
+    """Retorna (ruta, acierto). En un fallo llama `generar(dir_temporal)`.
+
+    `generar` escribe el PDF dentro del directorio temporal y retorna su ruta;
+    el archivo se mueve atómicamente a `directorio / nombre`, así dos
+    peticiones simultáneas nunca sirven un PDF a medio escribir.
+    """
+
+    destino = directorio / nombre
+    if destino.exists():
+        try:
+            os.utime(destino)
+        except OSError:
+            pass
+        return destino, True
+
+    directorio.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=directorio, prefix=".tmp-") as tmp:
+        generado = pathlib.Path(generar(pathlib.Path(tmp)))
+        os.replace(generado, destino)
+
+    _recolectar_si_toca(directorio)
+    return destino, False
+
+
+def _recolectar_si_toca(directorio: pathlib.Path) -> None:
+    global _ultimo_gc
+    intervalo = _env_float("PDF_CACHE_GC_INTERVALO_S", 300)
+    with _gc_lock:
+        ahora = time.monotonic()
+        if _ultimo_gc and ahora - _ultimo_gc < intervalo:
+            return
+        _ultimo_gc = ahora
+    recolectar(directorio)
+
+
+def recolectar(
+    directorio: pathlib.Path,
+    *,
+    max_bytes: int | None = None,
+    max_edad_s: float | None = None,
+) -> dict[str, int]:
+    """Borra PDFs vencidos y, si hace falta, los menos usados hasta quedar bajo el tope."""
+
+    if max_bytes is None:
+        max_bytes = int(_env_float("PDF_CACHE_MAX_MB", 500) * 1024 * 1024)
+    if max_edad_s is None:
+        max_edad_s = _env_float("PDF_CACHE_MAX_DIAS", 30) * 86400
+
+    if not directorio.is_dir():
+        return {"borrados": 0, "bytes_liberados": 0, "bytes_en_uso": 0}
+
+    limite = time.time() - max_edad_s
+    archivos: list[tuple[float, int, pathlib.Path]] = []
+    borrados = liberados = 0
+    for p in directorio.iterdir():
+        if p.name.startswith(".tmp-") and p.is_dir():
+            # Restos de una generación interrumpida.
+            if p.stat().st_mtime < time.time() - 3600:
+                shutil.rmtree(p, ignore_errors=True)
+            continue
+        if p.suffix.lower() != ".pdf" or not p.is_file():
+            continue
+        st = p.stat()
+        if st.st_mtime < limite:
+            p.unlink(missing_ok=True)
+            borrados += 1
+            liberados += st.st_size
+        else:
+            archivos.append((st.st_mtime, st.st_size, p))
+
+    en_uso = sum(a[1] for a in archivos)
+    for _mtime, tamano, p in sorted(archivos):
+        if en_uso <= max_bytes:
+            break
+        p.unlink(missing_ok=True)
+        borrados += 1
+        liberados += tamano
+        en_uso -= tamano
+
+    return {"borrados": borrados, "bytes_liberados": liberados, "bytes_en_uso": en_uso}
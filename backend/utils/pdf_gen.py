@@ -3,9 +3,10 @@ from __future__ import annotations
 import os
 import pathlib
 import re
+import threading
 import uuid
 import datetime
-from typing import Any
+from typing import Any, BinaryIO
 
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib import colors
@@ -23,6 +24,16 @@ def _safe_name(value: str) -> str:
     return value[:60] if value else "Proyecto"
 
 
+def _ruta_salida(filename: str, output_dir: str | pathlib.Path | None) -> pathlib.Path:
+    out_path = pathlib.Path(output_dir).resolve() / filename if output_dir else pathlib.Path(filename)
+    try:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+    except Exception:
+        # Si no se puede crear el directorio, dejar que falle el save con error claro.
+        pass
+    return out_path
+
+
 def _find_logo_path(*, explicit_path: str | pathlib.Path | None = None) -> pathlib.Path | None:
     if explicit_path:
         p = pathlib.Path(explicit_path).expanduser()
@@ -55,12 +66,117 @@ def _find_logo_path(*, explicit_path: str | pathlib.Path | None = None) -> pathl
     return None
 
 
+def _logo_miniatura_px() -> int:
+    raw = os.getenv("PDF_LOGO_MINIATURA_PX", "400").strip().strip('"').strip("'")
+    try:
+        return max(0, int(raw or 0))
+    except ValueError as exc:
+        raise RuntimeError("PDF_LOGO_MINIATURA_PX debe ser un entero") from exc
+
+
+def _decodificar_logo(ruta: pathlib.Path, lado: int) -> ImageReader | None:
+    try:
+        if lado > 0:
+            from PIL import Image as PILImage
+
+            img = PILImage.open(ruta)
+            img.load()
+            if max(img.size) > lado:
+                img.thumbnail((lado, lado), PILImage.LANCZOS)
+            reader = ImageReader(img)
+        else:
+            reader = ImageReader(str(ruta))
+        # Decodificar ahora y no al dibujar la primera página.
+        reader.getRGBData()
+        return reader
+    except Exception:
+        return None
+
+
+class _RecursosPDF:
+    """Logos decodificados, hoja de estilos y rutas resueltas, una vez por proceso.
+
+    Los logos se reducen a `PDF_LOGO_MINIATURA_PX` de lado (0 = original): a
+    0.65-1.1" impresos, 400 px ya son ~300 dpi y el PDF no lleva la foto
+    completa. Si cambia `PDF_LOGO_PATH` o el mtime del archivo, se recargan.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._env_logo: str | None = None
+        self._rutas: dict[str, pathlib.Path | None] = {}
+        self._logos: dict[tuple[str, int, int], ImageReader | None] = {}
+        self._estilos: Any = None
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._rutas.clear()
+            self._logos.clear()
+            self._estilos = None
+
+    def logo(self, explicit_path: str | pathlib.Path | None = None) -> ImageReader | None:
+        lado = _logo_miniatura_px()
+        with self._lock:
+            env_logo = os.getenv("PDF_LOGO_PATH", "")
+            if env_logo != self._env_logo:
+                self._env_logo = env_logo
+                self._rutas.clear()
+                self._logos.clear()
+
+            clave_ruta = str(explicit_path or "")
+            if clave_ruta not in self._rutas:
+                self._rutas[clave_ruta] = _find_logo_path(explicit_path=explicit_path)
+            ruta = self._rutas[clave_ruta]
+            if ruta is None:
+                return None
+            try:
+                mtime = ruta.stat().st_mtime_ns
+            except OSError:
+                return None
+
+            clave = (str(ruta), mtime, lado)
+            if clave not in self._logos:
+                self._logos[clave] = _decodificar_logo(ruta, lado)
+            return self._logos[clave]
+
+    def estilos(self) -> Any:
+        with self._lock:
+            if self._estilos is None:
+                self._estilos = getSampleStyleSheet()
+            return self._estilos
+
+
+_recursos = _RecursosPDF()
+
+# Estilo base de la tabla del informe profesional; cada documento solo agrega
+# las filas de fase/total encima (TableStyle(..., parent=...)).
+_ESTILO_TABLA_PRESUPUESTO = TableStyle(
+    [
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2D3748")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+        ("FONTSIZE", (0, 0), (-1, 0), 9),
+        ("BOTTOMPADDING", (0, 0), (-1, 0), 10),
+        ("TOPPADDING", (0, 0), (-1, 0), 10),
+        ("ALIGN", (0, 0), (-1, 0), "CENTER"),
+        ("ALIGN", (0, 1), (0, -1), "LEFT"),
+        ("ALIGN", (1, 1), (-1, -1), "CENTER"),
+        ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#CBD5E0")),
+        ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
+        ("FONTSIZE", (0, 1), (-1, -1), 9),
+        ("LEFTPADDING", (0, 0), (-1, -1), 6),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+
+
 def generar_documento_oficial(
     tipo: str,
     datos: dict[str, Any],
     *,
     output_dir: str | pathlib.Path | None = None,
     logo_path: str | pathlib.Path | None = None,
+    destino: BinaryIO | None = None,
 ) -> str:
     """Genera un PDF con formato de documento oficial.
 
@@ -71,24 +187,20 @@ def generar_documento_oficial(
       - proyecto_nombre: string (opcional)
       - items: lista[{descripcion, total}] (opcional)
 
-    Retorna la ruta del archivo generado.
+    Retorna la ruta del archivo generado. Con `destino` (BytesIO, archivo
+    temporal, ...) escribe el PDF ahí, no toca el disco y retorna solo el
+    nombre sugerido del archivo.
     """
 
     tipo_norm = (tipo or "DOCUMENTO").strip().upper()
     doc_id = datos.get("id")
     doc_id_str = str(doc_id) if doc_id is not None and str(doc_id).strip() else uuid.uuid4().hex[:8]
     filename = f"{_safe_name(tipo_norm)}_{_safe_name(doc_id_str)}.pdf"
-    out_path = pathlib.Path(output_dir).resolve() / filename if output_dir else pathlib.Path(filename)
-
-    try:
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-    except Exception:
-        # Si no se puede crear el directorio, dejar que falle el save con error claro.
-        pass
+    out_path = _ruta_salida(filename, output_dir) if destino is None else None
 
-    c = canvas.Canvas(str(out_path), pagesize=LETTER)
+    c = canvas.Canvas(destino if destino is not None else str(out_path), pagesize=LETTER)
 
-    logo = _find_logo_path(explicit_path=logo_path)
+    logo = _recursos.logo(logo_path)
 
     def header(page_num: int) -> int:
         # Encabezado con logo + marca
@@ -103,7 +215,7 @@ def generar_documento_oficial(
         if logo is not None:
             try:
                 c.drawImage(
-                    ImageReader(str(logo)),
+                    logo,
                     logo_x,
                     logo_y,
                     width=logo_w,
@@ -201,18 +313,20 @@ def generar_documento_oficial(
 
     footer()
     c.save()
-    return str(out_path)
+    return str(out_path) if out_path is not None else filename
 
 
 def generar_pdf_presupuesto(
     datos_proyecto: dict[str, Any],
     *,
     output_dir: str | pathlib.Path | None = None,
+    destino: BinaryIO | None = None,
 ) -> str:
     """Genera un PDF simple del presupuesto.
 
     - Si `output_dir` se provee, guarda el archivo allí.
-    - Retorna la ruta del archivo generado (string).
+    - Si `destino` se provee, escribe el PDF en ese stream (sin disco).
+    - Retorna la ruta del archivo generado (o el nombre sugerido con `destino`).
     """
 
     nombre = str(datos_proyecto.get("nombre") or "Proyecto")
@@ -238,6 +352,7 @@ def generar_pdf_presupuesto(
             "departamento": departamento,
         },
         output_dir=output_dir,
+        destino=destino,
     )
 
 
@@ -247,6 +362,7 @@ def generar_pdf_presupuesto_profesional(
     output_dir: str | pathlib.Path | None = None,
     logo_ms_path: str | pathlib.Path | None = None,
     logo_wm_path: str | pathlib.Path | None = None,
+    destino: BinaryIO | None = None,
 ) -> str:
     """Genera un informe profesional (tabla) del presupuesto por fases.
 
@@ -255,6 +371,8 @@ def generar_pdf_presupuesto_profesional(
       - departamento
       - fecha (opcional)
       - renglones: lista[{descripcion, unidad, cantidad, precio_unitario, total, fase?}]
+
+    Con `destino` escribe en ese stream y retorna el nombre sugerido.
     """
 
     nombre = str(datos_proyecto.get("nombre") or "Proyecto")
@@ -267,18 +385,14 @@ def generar_pdf_presupuesto_profesional(
     if not isinstance(renglones, list):
         renglones = []
 
-    ms_logo = _find_logo_path(explicit_path=logo_ms_path) or _find_logo_path()
-    wm_logo = _find_logo_path(explicit_path=logo_wm_path)
+    ms_logo = _recursos.logo(logo_ms_path)
+    wm_logo = _recursos.logo(logo_wm_path)
 
     filename = f"Informe_Presupuesto_{_safe_name(nombre)}_{uuid.uuid4().hex[:8]}.pdf"
-    out_path = pathlib.Path(output_dir).resolve() / filename if output_dir else pathlib.Path(filename)
-    try:
-        out_path.parent.mkdir(parents=True, exist_ok=True)
-    except Exception:
-        pass
+    out_path = _ruta_salida(filename, output_dir) if destino is None else None
 
     doc = SimpleDocTemplate(
-        str(out_path),
+        destino if destino is not None else str(out_path),
         pagesize=LETTER,
         leftMargin=0.55 * inch,
         rightMargin=0.55 * inch,
@@ -288,7 +402,7 @@ def generar_pdf_presupuesto_profesional(
         author="SOFTCON-MYS-CONSTRU-WM",
     )
 
-    styles = getSampleStyleSheet()
+    styles = _recursos.estilos()
     story: list[Any] = []
 
     story.append(Paragraph(f"<b>PROYECTO:</b> {nombre}", styles["Normal"]))
@@ -381,27 +495,7 @@ def generar_pdf_presupuesto_profesional(
         repeatRows=1,
     )
 
-    table.setStyle(
-        TableStyle(
-            [
-                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2D3748")),
-                ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-                ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ("FONTSIZE", (0, 0), (-1, 0), 9),
-                ("BOTTOMPADDING", (0, 0), (-1, 0), 10),
-                ("TOPPADDING", (0, 0), (-1, 0), 10),
-                ("ALIGN", (0, 0), (-1, 0), "CENTER"),
-                ("ALIGN", (0, 1), (0, -1), "LEFT"),
-                ("ALIGN", (1, 1), (-1, -1), "CENTER"),
-                ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#CBD5E0")),
-                ("VALIGN", (0, 0), (-1, -1), "MIDDLE"),
-                ("FONTSIZE", (0, 1), (-1, -1), 9),
-                ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-            ]
-            + row_styles
-        )
-    )
+    table.setStyle(TableStyle(row_styles, parent=_ESTILO_TABLA_PRESUPUESTO))
 
     story.append(table)
     story.append(Spacer(1, 0.25 * inch))
@@ -414,7 +508,7 @@ def generar_pdf_presupuesto_profesional(
         if ms_logo is not None:
             try:
                 canv.drawImage(
-                    ImageReader(str(ms_logo)),
+                    ms_logo,
                     doc.leftMargin,
                     LETTER[1] - 0.95 * inch,
                     width=0.65 * inch,
@@ -428,7 +522,7 @@ def generar_pdf_presupuesto_profesional(
         if wm_logo is not None:
             try:
                 canv.drawImage(
-                    ImageReader(str(wm_logo)),
+                    wm_logo,
                     LETTER[0] - doc.rightMargin - 0.65 * inch,
                     LETTER[1] - 0.95 * inch,
                     width=0.65 * inch,
@@ -465,4 +559,4 @@ def generar_pdf_presupuesto_profesional(
         canv.restoreState()
 
     doc.build(story, onFirstPage=_on_page, onLaterPages=_on_page)
-    return str(out_path)
\ No newline at end of file
+    return str(out_path) if out_path is not None else filename
\ No newline at end of file
@@ -0,0 +1,18 @@
+"""Contexto de multiprocessing para los pools de procesos del servidor.
+
+Los pools se crean en el primer uso, dentro de un proceso de uvicorn que ya
+tiene hilos corriendo (threadpool, jobs, IA). Con `fork` el hijo hereda los
+locks que esos hilos tengan tomados en ese instante (logging, pool de
+SQLAlchemy...) y puede quedar bloqueado para siempre. `forkserver` (o
+`spawn`, donde no existe) arranca los workers desde un proceso limpio.
+"""
+
+from __future__ import annotations
+
+import multiprocessing
+from multiprocessing.context import BaseContext
+
+
+def contexto_pool() -> BaseContext:
+    metodo = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return multiprocessing.get_context(metodo)
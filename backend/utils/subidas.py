@@ -0,0 +1,224 @@
+"""Subidas reanudables (estilo tus) para fotos de campo con señal intermitente.
+
+Flujo:
+  1. `crear_subida(tamano_total, ...)` reserva un id y un archivo `.part` en
+     el directorio de staging (con un `.json` de metadatos al lado).
+  2. `anexar(id, offset, bloques)` agrega bytes solo si `offset` coincide con
+     lo ya recibido; si la conexión se corta a media petición, lo escrito
+     hasta ahí queda y el cliente reanuda desde `estado(id).offset`.
+  3. Completa (offset == tamaño total), `abrir_completa(id)` entrega el
+     archivo para moverlo a su destino final y `descartar(id)` limpia.
+
+Las subidas sin terminar se borran después de UPLOAD_SUBIDA_HORAS (24).
+Los PATCH concurrentes de una misma subida se serializan por proceso; con
+varias réplicas, el staging debe estar en un volumen compartido y el cliente
+no debe enviar dos bloques a la vez (como exige tus).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import datetime
+import json
+import os
+import pathlib
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator
+
+import anyio
+import anyio.to_thread
+
+
+class SubidaNoEncontrada(LookupError):
+    pass
+
+
+class OffsetInvalido(ValueError):
+    def __init__(self, offset_actual: int):
+        super().__init__(f"Offset inválido; el servidor tiene {offset_actual} bytes")
+        self.offset_actual = offset_actual
+
+
+class SubidaExcedida(ValueError):
+    pass
+
+
+class SubidaIncompleta(ValueError):
+    pass
+
+
+@dataclass
+class EstadoSubida:
+    id: str
+    tamano_total: int
+    offset: int
+    nombre: str | None
+    usuario: str | None
+    creado_en: str
+
+    @property
+    def completa(self) -> bool:
+        return self.offset >= self.tamano_total
+
+
+_locks: dict[str, asyncio.Lock] = {}
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser numérico") from exc
+
+
+def _rutas(directorio: pathlib.Path, subida_id: str) -> tuple[pathlib.Path, pathlib.Path]:
+    # El id se valida como UUID: nunca se arma una ruta con texto del cliente.
+    try:
+        normalizado = str(uuid.UUID(str(subida_id)))
+    except ValueError as exc:
+        raise SubidaNoEncontrada(subida_id) from exc
+    return directorio / f"{normalizado}.part", directorio / f"{normalizado}.json"
+
+
+def _lock(subida_id: str) -> asyncio.Lock:
+    return _locks.setdefault(subida_id, asyncio.Lock())
+
+
+def _purgar_vencidas(directorio: pathlib.Path) -> None:
+    limite = time.time() - _env_float("UPLOAD_SUBIDA_HORAS", 24) * 3600
+    for meta in directorio.glob("*.json"):
+        try:
+            if meta.stat().st_mtime < limite:
+                meta.with_suffix(".part").unlink(missing_ok=True)
+                meta.unlink(missing_ok=True)
+                _locks.pop(meta.stem, None)
+        except OSError:
+            continue
+
+
+async def crear_subida(
+    directorio: pathlib.Path,
+    tamano_total: int,
+    *,
+    max_bytes: int,
+    nombre: str | None = None,
+    usuario: str | None = None,
+) -> EstadoSubida:
+    if tamano_total > max_bytes:
+        raise SubidaExcedida(f"La foto supera {max_bytes / (1024 * 1024):g} MB")
+
+    await anyio.Path(directorio).mkdir(parents=True, exist_ok=True)
+    await anyio.to_thread.run_sync(_purgar_vencidas, directorio)
+
+    estado = EstadoSubida(
+        id=str(uuid.uuid4()),
+        tamano_total=int(tamano_total),
+        offset=0,
+        nombre=nombre,
+        usuario=usuario,
+        creado_en=datetime.datetime.utcnow().isoformat(),
+    )
+    parte, meta = _rutas(directorio, estado.id)
+    await anyio.Path(parte).touch()
+    meta_dict = asdict(estado)
+    meta_dict.pop("offset")
+    await anyio.Path(meta).write_text(json.dumps(meta_dict))
+    return estado
+
+
+async def estado(directorio: pathlib.Path, subida_id: str, *, usuario: str | None = None) -> EstadoSubida:
+    """Metadatos + offset (= tamaño actual del `.part`, la única fuente de verdad).
+
+    Con `usuario`, la subida de otro usuario se reporta como inexistente.
+    """
+
+    parte, meta = _rutas(directorio, subida_id)
+    try:
+        datos: dict[str, Any] = json.loads(await anyio.Path(meta).read_text())
+        offset = (await anyio.Path(parte).stat()).st_size
+    except FileNotFoundError as exc:
+        raise SubidaNoEncontrada(subida_id) from exc
+    if usuario is not None and datos.get("usuario") != usuario:
+        raise SubidaNoEncontrada(subida_id)
+    return EstadoSubida(offset=offset, **datos)
+
+
+async def anexar(
+    directorio: pathlib.Path,
+    subida_id: str,
+    offset: int,
+    bloques: AsyncIterator[bytes],
+) -> EstadoSubida:
+    """Agrega el cuerpo de un PATCH en `offset`. Retorna el estado con el nuevo offset.
+
+    Lo recibido se escribe a medida que llega: si la petición se corta, el
+    offset avanza hasta el último byte escrito.
+    """
+
+    parte, meta = _rutas(directorio, subida_id)
+    async with _lock(parte.stem):
+        actual = await estado(directorio, subida_id)
+        if offset != actual.offset:
+            raise OffsetInvalido(actual.offset)
+
+        escrito = actual.offset
+        async with await anyio.open_file(parte, "ab") as f:
+            async for bloque in bloques:
+                if not bloque:
+                    continue
+                if escrito + len(bloque) > actual.tamano_total:
+                    raise SubidaExcedida("El cuerpo excede el tamaño declarado de la subida")
+                await f.write(bloque)
+                await f.flush()
+                escrito += len(bloque)
+        # El mtime del .json marca la última actividad (purga de vencidas).
+        await anyio.to_thread.run_sync(os.utime, meta)
+        actual.offset = escrito
+        return actual
+
+
+class ArchivoSubido:
+    """Archivo completo en staging con la interfaz que espera `uploads.guardar_foto`."""
+
+    def __init__(self, archivo: Any, filename: str | None):
+        self._archivo = archivo
+        self.filename = filename
+
+    async def read(self, n: int = -1) -> bytes:
+        return await self._archivo.read(n)
+
+
+async def abrir_completa(directorio: pathlib.Path, subida_id: str):
+    """Context manager asíncrono que entrega un `ArchivoSubido` si la subida está completa."""
+
+    actual = await estado(directorio, subida_id)
+    if not actual.completa:
+        raise SubidaIncompleta(f"Faltan {actual.tamano_total - actual.offset} bytes")
+    parte, _meta = _rutas(directorio, subida_id)
+    return _Abierto(parte, actual.nombre)
+
+
+class _Abierto:
+    def __init__(self, parte: pathlib.Path, nombre: str | None):
+        self._parte = parte
+        self._nombre = nombre
+        self._f: Any = None
+
+    async def __aenter__(self) -> ArchivoSubido:
+        self._f = await anyio.open_file(self._parte, "rb")
+        return ArchivoSubido(self._f, self._nombre)
+
+    async def __aexit__(self, *exc: Any) -> None:
+        await self._f.aclose()
+
+
+async def descartar(directorio: pathlib.Path, subida_id: str) -> None:
+    parte, meta = _rutas(directorio, subida_id)
+    await anyio.Path(parte).unlink(missing_ok=True)
+    await anyio.Path(meta).unlink(missing_ok=True)
+    _locks.pop(parte.stem, None)
@@ -0,0 +1,181 @@
+"""Guardado de fotos subidas (bitácora y evidencias de avance).
+
+- El archivo se lee por bloques y se escribe con E/S asíncrona (anyio), sin
+  bloquear el event loop, mientras se calcula su SHA-256.
+- El nombre final es el hash (`fotos/<sha256>.<ext>`): la misma foto subida
+  dos veces (reintentos, reenvíos de WhatsApp) se guarda una sola vez.
+- Tope de tamaño UPLOAD_MAX_MB (default 15) => `ArchivoDemasiadoGrande`.
+- Con Pillow instalado se generan una miniatura JPEG (UPLOAD_THUMBNAIL_PX,
+  default 320) y una versión WebP (UPLOAD_WEBP_PX, default 1600) en un pool
+  de hilos acotado (UPLOAD_VARIANTES_HILOS, default 2; Pillow libera el GIL al
+  decodificar/redimensionar). Si no es una imagen, solo queda el original.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import pathlib
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any
+
+import anyio
+import anyio.to_thread
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover - Pillow es opcional
+    Image = None
+    ImageOps = None
+
+_logger = logging.getLogger("uvicorn.error")
+
+SUBDIRECTORIO = "fotos"
+_BLOQUE = 256 * 1024
+_EXTENSIONES = {".jpg", ".jpeg", ".png", ".webp", ".heic", ".heif", ".gif"}
+
+_pool: ThreadPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+class ArchivoDemasiadoGrande(ValueError):
+    pass
+
+
+@dataclass(frozen=True)
+class FotoGuardada:
+    url: str
+    sha256: str
+    tamano: int
+    url_thumbnail: str | None = None
+    url_webp: str | None = None
+    duplicada: bool = False
+
+
+def _env_float(name: str, default: float) -> float:
+    raw = (os.getenv(name) or "").strip().strip('"').strip("'")
+    if not raw:
+        return default
+    try:
+        return float(raw)
+    except ValueError as exc:
+        raise RuntimeError(f"{name} debe ser numérico") from exc
+
+
+def tamano_maximo() -> int:
+    return int(_env_float("UPLOAD_MAX_MB", 15) * 1024 * 1024)
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=max(1, int(_env_float("UPLOAD_VARIANTES_HILOS", 2))),
+                thread_name_prefix="uploads",
+            )
+        return _pool
+
+
+def cerrar_pool_uploads() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def _extension(filename: str | None, por_defecto: str) -> str:
+    suffix = pathlib.Path(filename or "").suffix.lower()
+    return suffix if suffix in _EXTENSIONES else por_defecto
+
+
+def _generar_variantes(original: pathlib.Path, thumb: pathlib.Path, webp: pathlib.Path) -> tuple[bool, bool]:
+    """Corre en el pool. Retorna (hay_thumbnail, hay_webp); no pisa variantes existentes."""
+
+    if Image is None:
+        return False, False
+    if thumb.exists() and webp.exists():
+        return True, True
+    try:
+        with Image.open(original) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ("RGB", "L"):
+                img = img.convert("RGB")
+
+            for destino, lado, formato, opciones in (
+                (thumb, int(_env_float("UPLOAD_THUMBNAIL_PX", 320)), "JPEG", {"quality": 75, "optimize": True}),
+                (webp, int(_env_float("UPLOAD_WEBP_PX", 1600)), "WEBP", {"quality": 80, "method": 4}),
+            ):
+                if destino.exists():
+                    continue
+                copia = img.copy()
+                copia.thumbnail((lado, lado), Image.LANCZOS)
+                tmp = destino.with_name(f".{destino.name}.{uuid.uuid4().hex}")
+                copia.save(tmp, formato, **opciones)
+                os.replace(tmp, destino)
+        return True, True
+    except Exception as exc:
+        _logger.info("Sin variantes para %s: %s", original.name, exc)
+        return thumb.exists(), webp.exists()
+
+
+async def guardar_foto(
+    archivo: Any,
+    directorio: pathlib.Path,
+    *,
+    prefijo_url: str = "/uploads",
+    por_defecto: str = ".jpg",
+) -> FotoGuardada:
+    """Guarda `archivo` (UploadFile o cualquier objeto con `async read(n)`).
+
+    Las URLs retornadas son relativas (`{prefijo_url}/fotos/...`).
+    Excede UPLOAD_MAX_MB => `ArchivoDemasiadoGrande` (no queda nada en disco).
+    """
+
+    destino_dir = directorio / SUBDIRECTORIO
+    await anyio.Path(destino_dir).mkdir(parents=True, exist_ok=True)
+    ext = _extension(getattr(archivo, "filename", None), por_defecto)
+    tmp = destino_dir / f".subida-{uuid.uuid4().hex}"
+
+    limite = tamano_maximo()
+    h = hashlib.sha256()
+    tamano = 0
+    try:
+        async with await anyio.open_file(tmp, "wb") as f:
+            while bloque := await archivo.read(_BLOQUE):
+                tamano += len(bloque)
+                if tamano > limite:
+                    raise ArchivoDemasiadoGrande(f"La foto supera {limite / (1024 * 1024):g} MB")
+                h.update(bloque)
+                await f.write(bloque)
+
+        sha = h.hexdigest()
+        final = destino_dir / f"{sha}{ext}"
+        duplicada = await anyio.Path(final).exists()
+        if duplicada:
+            await anyio.Path(tmp).unlink(missing_ok=True)
+        else:
+            await anyio.to_thread.run_sync(os.replace, tmp, final)
+    except BaseException:
+        await anyio.Path(tmp).unlink(missing_ok=True)
+        raise
+
+    thumb = destino_dir / f"{sha}_thumb.jpg"
+    webp = destino_dir / f"{sha}_web.webp"
+    hay_thumb, hay_webp = await asyncio.wrap_future(_get_pool().submit(_generar_variantes, final, thumb, webp))
+
+    base = f"{prefijo_url.rstrip('/')}/{SUBDIRECTORIO}"
+    return FotoGuardada(
+        url=f"{base}/{final.name}",
+        sha256=sha,
+        tamano=tamano,
+        url_thumbnail=f"{base}/{thumb.name}" if hay_thumb else None,
+        url_webp=f"{base}/{webp.name}" if hay_webp else None,
+        duplicada=duplicada,
+    )
@@ -0,0 +1,15 @@
+import api from './client.js';
+
+// Los listados del backend son paginados por cursor: la siguiente página viene
+// en el header `X-Next-Cursor` o en `next_cursor` del cuerpo. Esto los recorre
+// hasta el final y devuelve todos los elementos juntos.
+export async function getTodasLasPaginas(url, { params = {}, extraer = (data) => data || [] } = {}) {
+  const todos = [];
+  let cursor = null;
+  do {
+    const res = await api.get(url, { params: { limit: 500, ...params, ...(cursor ? { cursor } : {}) } });
+    todos.push(...extraer(res.data));
+    cursor = res.headers?.['x-next-cursor'] || res.data?.next_cursor || null;
+  } while (cursor);
+  return todos;
+}
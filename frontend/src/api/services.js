@@ -1,8 +1,9 @@
 import api from './config.js';
+import { getTodasLasPaginas } from './paginacion.js';
 
 export const proyectosApi = {
-  // NOTE: backend currently has POST /proyectos (query params) but not GET /proyectos
-  getAll: () => api.get('/proyectos'),
+  // GET /proyectos es paginado; se recorren todas las páginas
+  getAll: () => getTodasLasPaginas('/proyectos').then((data) => ({ data })),
   getById: (id) => api.get(`/proyectos/${id}`),
   crear: (data) => {
     const nombre = data?.nombre ?? data?.nombre_proyecto ?? data?.nombreProyecto;
@@ -1,5 +1,6 @@
 import React, { useEffect, useState } from 'react';
 import api from '../api/index.js';
+import { getTodasLasPaginas } from '../api/paginacion.js';
 
 const ROLES = ['admin', 'supervisor', 'bodeguero', 'trabajador'];
 
@@ -12,8 +13,8 @@ export default function AdminUsuariosPage() {
     setLoading(true);
     setError('');
     try {
-      const res = await api.get('/auth/admin/users/pending');
-      setItems(res?.data?.items || []);
+      const lista = await getTodasLasPaginas('/auth/admin/users/pending', { extraer: (data) => data?.items || [] });
+      setItems(lista);
     } catch (err) {
       setError(err?.response?.data?.detail || err?.message || 'Error cargando usuarios');
     } finally {
@@ -1,16 +1,16 @@
 
 import React, { useEffect, useState } from 'react';
 import api from '../api/client.js';
+import { getTodasLasPaginas } from '../api/paginacion.js';
 
 export default function Aprobaciones() {
   const [pendientes, setPendientes] = useState([]);
   const [status, setStatus] = useState('');
 
   const fetchPendientes = () => {
-    api
-      .get('/compras/pendientes-aprobacion')
-      .then((res) => {
-        setPendientes(res.data || []);
+    getTodasLasPaginas('/compras/pendientes-aprobacion')
+      .then((lista) => {
+        setPendientes(lista);
         setStatus('');
       })
       .catch((err) => setStatus(`Error: ${err?.response?.data?.detail || err?.message || 'No se pudo cargar'}`));
@@ -0,0 +1,119 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from backend import ia_cliente
+
+
+class _StubOpenAI(BaseHTTPRequestHandler):
+    """Servidor mínimo compatible con POST /v1/chat/completions."""
+
+    fallos_pendientes = 0
+    demora_s = 0.0
+    llamadas = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        length = int(self.headers.get("content-length") or 0)
+        self.rfile.read(length)
+        cls = type(self)
+        with cls.lock:
+            cls.llamadas += 1
+            fallar = cls.fallos_pendientes > 0
+            if fallar:
+                cls.fallos_pendientes -= 1
+
+        if fallar:
+            self._responder(429, {"error": {"message": "rate limited", "type": "rate_limit"}})
+            return
+
+        time.sleep(cls.demora_s)
+        self._responder(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "stub",
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {"role": "assistant", "content": '{"unidad": "m2", "insumos": []}'},
+                    }
+                ],
+            },
+        )
+
+    def _responder(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubOpenAI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    _StubOpenAI.fallos_pendientes = 0
+    _StubOpenAI.demora_s = 0.0
+    _StubOpenAI.llamadas = 0
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/v1")
+    monkeypatch.setenv("IA_BACKOFF_BASE_S", "0.01")
+
+    yield _StubOpenAI
+
+    ia_cliente.cerrar_clientes()
+    server.shutdown()
+    server.server_close()
+
+
+def test_reutiliza_el_mismo_cliente(stub):
+    assert ia_cliente.obtener_cliente() is ia_cliente.obtener_cliente()
+
+
+def test_reintenta_ante_429(stub):
+    stub.fallos_pendientes = 2
+
+    content = ia_cliente.completar_json("hola", model="stub")
+
+    assert json.loads(content) == {"unidad": "m2", "insumos": []}
+    assert stub.llamadas == 3
+
+
+def test_agota_reintentos(stub, monkeypatch):
+    monkeypatch.setenv("IA_REINTENTOS", "1")
+    stub.fallos_pendientes = 5
+
+    with pytest.raises(ia_cliente.openai.RateLimitError):
+        ia_cliente.completar_json("hola", model="stub")
+    assert stub.llamadas == 2
+
+
+def test_peticiones_identicas_concurrentes_comparten_llamada(stub):
+    stub.demora_s = 0.3
+    resultados = []
+
+    def pedir():
+        resultados.append(ia_cliente.completar_json("mismo prompt", model="stub"))
+
+    hilos = [threading.Thread(target=pedir) for _ in range(5)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert len(resultados) == 5
+    assert stub.llamadas == 1
@@ -0,0 +1,92 @@
+import datetime
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, create_engine
+from sqlalchemy.orm import Session, declarative_base
+
+from backend.utils import paginacion
+
+Base = declarative_base()
+
+
+class _Item(Base):
+    __tablename__ = "items"
+    id = Column(Integer, primary_key=True)
+    fecha = Column(DateTime, nullable=True)
+
+
+_BASE = datetime.datetime(2026, 1, 1)
+# Fechas repetidas (empates resueltos por id) y NULLs que deben ir al final.
+_FECHAS = [_BASE + datetime.timedelta(days=i % 4) for i in range(10)] + [None, None, None]
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(_Item(id=i + 1, fecha=f) for i, f in enumerate(_FECHAS))
+        session.commit()
+        yield session
+    engine.dispose()
+
+
+def _recorrer(db, orden_txt, limit):
+    orden = paginacion.parse_orden(orden_txt, {"fecha": _Item.fecha})
+    vistos, cursor, paginas = [], None, 0
+    while True:
+        filas, cursor = paginacion.paginar(
+            db.query(_Item), orden=orden, id_col=_Item.id, limit=limit, cursor=cursor
+        )
+        vistos.extend(f.id for f in filas)
+        paginas += 1
+        if cursor is None:
+            return vistos, paginas
+
+
+def _esperado(descendente):
+    con_fecha = [i + 1 for i, f in enumerate(_FECHAS) if f is not None]
+    con_fecha.sort(key=lambda i: (_FECHAS[i - 1], -i if descendente else i), reverse=descendente)
+    return con_fecha + [i + 1 for i, f in enumerate(_FECHAS) if f is None]
+
+
+@pytest.mark.parametrize("limit", [1, 3, 4, 13, 50])
+@pytest.mark.parametrize("orden", ["fecha", "-fecha"])
+def test_recorre_todo_sin_repetir_con_nulls_al_final(db, orden, limit):
+    vistos, paginas = _recorrer(db, orden, limit)
+
+    assert vistos == _esperado(orden.startswith("-"))
+    assert paginas == max(1, -(-len(_FECHAS) // limit))
+
+
+def test_cursor_ida_y_vuelta():
+    orden = paginacion.parse_orden("-fecha", {"fecha": _Item.fecha})
+    cursor = paginacion.codificar_cursor(orden, _BASE, 7)
+
+    assert "=" not in cursor
+    assert paginacion.decodificar_cursor(cursor, orden, _Item.id) == (_BASE, 7)
+
+    cursor_null = paginacion.codificar_cursor(orden, None, 11)
+    assert paginacion.decodificar_cursor(cursor_null, orden, _Item.id) == (None, 11)
+
+
+def test_cursor_de_otro_orden_es_invalido():
+    asc = paginacion.parse_orden("fecha", {"fecha": _Item.fecha})
+    desc = paginacion.parse_orden("-fecha", {"fecha": _Item.fecha})
+    cursor = paginacion.codificar_cursor(asc, _BASE, 1)
+
+    with pytest.raises(ValueError, match="otro orden"):
+        paginacion.decodificar_cursor(cursor, desc, _Item.id)
+
+
+@pytest.mark.parametrize("cursor", ["basura", "e30", "!!!"])
+def test_cursor_malformado_es_value_error(cursor):
+    orden = paginacion.parse_orden("fecha", {"fecha": _Item.fecha})
+
+    with pytest.raises(ValueError, match="cursor inválido"):
+        paginacion.decodificar_cursor(cursor, orden, _Item.id)
+
+
+def test_orden_no_permitido():
+    with pytest.raises(ValueError, match="orden inválido"):
+        paginacion.parse_orden("-monto", {"fecha": _Item.fecha})
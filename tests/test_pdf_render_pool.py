@@ -0,0 +1,41 @@
+import os
+import signal
+
+import pytest
+from fastapi import HTTPException
+
+from backend import pdf_render_service
+
+_DATOS = {
+    "nombre": "Bodega",
+    "departamento": "Guatemala",
+    "fecha": "2026-01-01",
+    "renglones": [
+        {"descripcion": "Muro", "unidad": "m2", "cantidad": 1, "precio_unitario": 1, "total": 1}
+    ],
+}
+
+
+@pytest.fixture
+def pool_render(monkeypatch):
+    monkeypatch.setenv("PDF_RENDER_PROCESOS", "1")
+    pdf_render_service.cerrar_pool_render()
+    yield
+    pdf_render_service.cerrar_pool_render()
+
+
+def test_worker_muerto_da_503_y_el_siguiente_render_usa_otro_pool(pool_render):
+    assert pdf_render_service.renderizar_pdf_bytes("presupuesto", _DATOS)
+
+    pool, _cupos = pdf_render_service._get_pool()
+    for proceso in list(pool._processes.values()):
+        os.kill(proceso.pid, signal.SIGKILL)
+        proceso.join(timeout=10)
+
+    with pytest.raises(HTTPException) as info:
+        pdf_render_service.renderizar_pdf_bytes("presupuesto", _DATOS)
+    assert info.value.status_code == 503
+    assert info.value.headers["Retry-After"]
+
+    assert pdf_render_service.renderizar_pdf_bytes("presupuesto", _DATOS)
+    assert pdf_render_service._get_pool()[0] is not pool
@@ -0,0 +1,107 @@
+import os
+import time
+
+import pytest
+
+from backend.utils import subidas
+
+_MB = 1024 * 1024
+
+
+async def _cuerpo(*bloques, cortar=False):
+    for bloque in bloques:
+        yield bloque
+    if cortar:
+        # Como un PATCH cuya conexión se cae a media petición.
+        raise ConnectionResetError("cliente desconectado")
+
+
+async def _nueva(tmp_path, tamano=10, usuario="ana"):
+    return await subidas.crear_subida(tmp_path, tamano, max_bytes=_MB, nombre="foto.jpg", usuario=usuario)
+
+
+@pytest.mark.asyncio
+async def test_anexa_por_partes_y_entrega_el_archivo(tmp_path):
+    sub = await _nueva(tmp_path)
+
+    estado = await subidas.anexar(tmp_path, sub.id, 0, _cuerpo(b"0123", b"45"))
+    assert (estado.offset, estado.completa) == (6, False)
+    with pytest.raises(subidas.SubidaIncompleta):
+        await subidas.abrir_completa(tmp_path, sub.id)
+
+    estado = await subidas.anexar(tmp_path, sub.id, 6, _cuerpo(b"6789"))
+    assert estado.completa
+    async with await subidas.abrir_completa(tmp_path, sub.id) as archivo:
+        assert archivo.filename == "foto.jpg"
+        assert await archivo.read() == b"0123456789"
+
+    await subidas.descartar(tmp_path, sub.id)
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.asyncio
+async def test_offset_distinto_al_recibido_es_rechazado(tmp_path):
+    sub = await _nueva(tmp_path)
+    await subidas.anexar(tmp_path, sub.id, 0, _cuerpo(b"0123"))
+
+    for offset in (0, 2, 8):
+        with pytest.raises(subidas.OffsetInvalido) as info:
+            await subidas.anexar(tmp_path, sub.id, offset, _cuerpo(b"xx"))
+        assert info.value.offset_actual == 4
+    assert (await subidas.estado(tmp_path, sub.id)).offset == 4
+
+
+@pytest.mark.asyncio
+async def test_patch_interrumpido_conserva_lo_escrito(tmp_path):
+    sub = await _nueva(tmp_path)
+
+    with pytest.raises(ConnectionResetError):
+        await subidas.anexar(tmp_path, sub.id, 0, _cuerpo(b"012", b"34", cortar=True))
+
+    assert (await subidas.estado(tmp_path, sub.id)).offset == 5
+    estado = await subidas.anexar(tmp_path, sub.id, 5, _cuerpo(b"56789"))
+    assert estado.completa
+
+
+@pytest.mark.asyncio
+async def test_no_acepta_mas_que_el_tamano_declarado(tmp_path):
+    with pytest.raises(subidas.SubidaExcedida):
+        await subidas.crear_subida(tmp_path, _MB + 1, max_bytes=_MB)
+
+    sub = await _nueva(tmp_path)
+    with pytest.raises(subidas.SubidaExcedida):
+        await subidas.anexar(tmp_path, sub.id, 0, _cuerpo(b"012345", b"6789X"))
+    # El bloque que excede no se escribe.
+    assert (await subidas.estado(tmp_path, sub.id)).offset == 6
+
+
+@pytest.mark.asyncio
+async def test_subida_de_otro_usuario_no_existe(tmp_path):
+    sub = await _nueva(tmp_path, usuario="ana")
+
+    assert (await subidas.estado(tmp_path, sub.id, usuario="ana")).usuario == "ana"
+    with pytest.raises(subidas.SubidaNoEncontrada):
+        await subidas.estado(tmp_path, sub.id, usuario="beto")
+
+
+@pytest.mark.asyncio
+async def test_id_que_no_es_uuid_no_arma_rutas(tmp_path):
+    with pytest.raises(subidas.SubidaNoEncontrada):
+        await subidas.estado(tmp_path, "../../etc/passwd")
+
+
+@pytest.mark.asyncio
+async def test_purga_subidas_vencidas(tmp_path, monkeypatch):
+    monkeypatch.setenv("UPLOAD_SUBIDA_HORAS", "1")
+    vieja = await _nueva(tmp_path)
+    reciente = await _nueva(tmp_path)
+    hace_dos_horas = time.time() - 2 * 3600
+    os.utime(tmp_path / f"{vieja.id}.json", (hace_dos_horas, hace_dos_horas))
+
+    # La purga corre al abrir una subida nueva.
+    await _nueva(tmp_path)
+
+    with pytest.raises(subidas.SubidaNoEncontrada):
+        await subidas.estado(tmp_path, vieja.id)
+    assert not (tmp_path / f"{vieja.id}.part").exists()
+    assert (await subidas.estado(tmp_path, reciente.id)).offset == 0